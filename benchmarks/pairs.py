@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+"""
+Conversion of the dotted command line arguments of mgmt_cli to the request payload (Pairs.to_obj), over large
+synthetic argument lists: the members of a big group, and objects nested a few levels deep.
+The previous implementation, which scans all the arguments again for every prefix, is kept here for comparison,
+and both are checked to give the same payload.
+
+Usage: benchmarks/pairs.py [sizes...]
+"""
+import collections
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cpapi.cli import Pairs  # noqa: E402
+
+
+class ScanPairs(Pairs):
+    """The previous to_obj, with a scan of the pairs for every prefix"""
+
+    def to_obj(self):
+        if len(self) == 1 and self[0][0] is Pairs.NO_KEY:
+            return self.scalar(self[0][1])
+        pairs = Pairs()
+        all_nums = True
+        any_nums = False
+        for prefix in self.prefixes():
+            vals = ScanPairs(self.get(prefix))
+            if re.match(r'\d+$', prefix):
+                prefix = int(prefix, 10)
+                any_nums = True
+            else:
+                all_nums = False
+            pairs.add(prefix, vals.to_obj())
+        if not all_nums:
+            if any_nums:
+                raise ValueError('mixed (sub)keys: ["%s"]' % '" "'.join(str(i[0]) for i in pairs))
+            return collections.OrderedDict(pairs)
+        return [i[1] for i in sorted(pairs)]
+
+
+def members(size):
+    """set-group name big members.1 host-1 ... members.N host-N"""
+    return [('name', 'big')] + [('members.%d' % i, 'host-%d' % i) for i in range(1, size + 1)]
+
+
+def nested(size):
+    """add-access-rule like arguments, a few levels deep"""
+    args = []
+    for i in range(1, size // 4 + 1):
+        args += [('rules.%d.name' % i, 'rule-%d' % i), ('rules.%d.source.1' % i, 'net-%d' % i),
+                 ('rules.%d.track.type' % i, 'Log'), ('rules.%d.install-on.1' % i, 'gw-%d' % (i % 8))]
+    return args
+
+
+def measure(cls, args):
+    start = time.perf_counter()
+    obj = cls(args).to_obj()
+    return time.perf_counter() - start, obj
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [500, 2000, 5000]
+    print(f"{'case':<10}{'args':>8}{'scan ms':>12}{'trie ms':>12}{'speedup':>10}")
+    for name, make in [('members', members), ('nested', nested)]:
+        for size in sizes:
+            args = make(size)
+            scan, expected = measure(ScanPairs, args)
+            trie, obj = measure(Pairs, args)
+            if obj != expected:
+                raise Exception('different payloads for %s %d' % (name, size))
+            print(f"{name:<10}{len(args):>8}{scan * 1000:>12.1f}{trie * 1000:>12.1f}{scan / trie:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+"""
+Startup time of an offline process.py run, from the source tree and from the packed zipapp.
+
+Usage: benchmarks/startup.py </path/to/file.json> [runs]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(cmd, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def import_time(cmd):
+    """:return: cumulative import time (ms) of the modules imported by the run, from -X importtime"""
+    res = subprocess.run(cmd[:1] + ['-X', 'importtime'] + cmd[1:], stdout=subprocess.DEVNULL,
+                         stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    total = 0
+    for line in res.stderr.splitlines():
+        if line.startswith('import time:') and not line.split('|')[2].startswith('  '):
+            try:
+                total += int(line.split('|')[1])
+            except ValueError:
+                pass
+    return total / 1000.0
+
+
+def main():
+    file_path = sys.argv[1]
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pyz = os.path.join(tmp_dir, 'process.pyz')
+        subprocess.run([sys.executable, os.path.join(ROOT, 'process.py'), '--pack', pyz], check=True)
+        cases = [
+            ('interpreter only', [sys.executable, '-c', 'pass']),
+            ('process.py', [sys.executable, os.path.join(ROOT, 'process.py'), '-f', 'csv', file_path]),
+            ('process.pyz', [sys.executable, pyz, '-f', 'csv', file_path]),
+        ]
+        print(f"{'case':<20}{'min ms':>10}{'median ms':>12}{'imports ms':>12}")
+        for name, cmd in cases:
+            timings = measure(cmd, runs)
+            print(f"{name:<20}{min(timings) * 1000:>10.1f}{statistics.median(timings) * 1000:>12.1f}"
+                  f"{import_time(cmd):>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+"""
+Rendering of API responses in mgmt_cli's text format: the previous recursive simple_yaml, which builds and
+re-indents the lines of every subtree, against the iterative renderer writing to a stream.
+Both are checked to give the same text. The responses are synthetic full details 'show-gateways-and-servers'
+pages, and an object nested deeper than the recursion limit.
+
+Usage: benchmarks/text_format.py [objects]
+"""
+import io
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cpapi.cli import safe_string, simple_yaml, write_yaml  # noqa: E402
+
+
+def recursive_yaml(root, as_string=True):
+    """The previous simple_yaml"""
+    if as_string:
+        return '\n'.join(recursive_yaml(root, False) + [''])
+    if not isinstance(root, (dict, list)) or not root:
+        return [safe_string(root)]
+    if isinstance(root, dict):
+        items = root.items()
+    else:
+        items = ((None, v) for v in root)
+    lines = []
+    for k, v in items:
+        v_lines = recursive_yaml(v, False)
+        indent = '  '
+        if k is None:
+            lines.append('- ' + v_lines.pop(0))
+        else:
+            lines.append(safe_string(k) + ':')
+            if isinstance(v, list):
+                indent = ''
+            if not v or not isinstance(v, (dict, list)):
+                lines[-1] += ' ' + v_lines.pop(0)
+        lines.extend([indent + line for line in v_lines])
+    return lines
+
+
+def gateway(i):
+    return {
+        'uid': '%08x-0000-4000-8000-%012x' % (i, i), 'name': 'gw-%d' % i, 'type': 'simple-gateway',
+        'domain': {'uid': '41e821a0-3720-11e3-aa6e-0800200c9fde', 'name': 'SMC User', 'domain-type': 'domain'},
+        'ipv4-address': '10.%d.%d.1' % (i // 256 % 256, i % 256), 'version': 'R81.10',
+        'policy': {'access-policy-installed': True, 'access-policy-name': 'Standard',
+                   'threat-policy-installed': i % 2 == 0, 'installed-on': '2021-06-01T10:00:00'},
+        'network-security-blades': {'firewall': True, 'ipsec-vpn': i % 3 == 0, 'ips': True},
+        'management-blades': {'network-policy-management': False, 'logging-and-status': True},
+        'interfaces': [{'name': 'eth%d' % n, 'ipv4-address': '192.168.%d.1' % n, 'ipv4-mask-length': 24,
+                        'topology': {'leads-to-internet': n == 0, 'ip-address-behind-this-interface': 'network'}}
+                       for n in range(4)],
+        'groups': [], 'tags': [{'name': 'site-%d' % (i % 10)}],
+        'meta-info': {'lock': 'unlocked', 'validation-state': 'ok', 'last-modify-time': {'posix': 1622541600000 + i},
+                      'creator': 'admin', 'last-modifier': 'admin'},
+        'comments': '', 'color': 'black', 'icon': 'NetworkObjects/gateway', 'read-only': False,
+    }
+
+
+def measure(render):
+    start = time.perf_counter()
+    text = render()
+    return time.perf_counter() - start, text
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    deep = node = {}
+    for _ in range(sys.getrecursionlimit() * 2):
+        node['child'] = node = {}
+    cases = [('%d gateways' % size, {'objects': [gateway(i) for i in range(size)], 'from': 1, 'to': size,
+                                     'total': size}),
+             ('%d levels' % (sys.getrecursionlimit() * 2), deep)]
+    print(f"{'case':<16}{'lines':>10}{'recursive ms':>15}{'iterative ms':>15}{'stream ms':>12}")
+    for name, obj in cases:
+        try:
+            recursive, expected = measure(lambda: recursive_yaml(obj))
+            recursive = '%.1f' % (recursive * 1000)
+        except RecursionError:
+            recursive, expected = 'too deep', None
+        iterative, text = measure(lambda: simple_yaml(obj))
+        stream = io.StringIO()
+        streamed, _ = measure(lambda: write_yaml(obj, stream))
+        if expected is not None and text != expected or stream.getvalue() != text:
+            raise Exception('different text for ' + name)
+        print(f"{name:<16}{text.count(chr(10)):>10}{recursive:>15}{iterative * 1000:>15.1f}{streamed * 1000:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
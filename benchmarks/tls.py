@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+"""
+TLS handshakes of API calls made on a new connection each (single_conn=False), with and without
+resuming the TLS session of the earlier connections, against a local TLS stand-in of the management server.
+Needs the openssl command, to create the stand-in's self-signed certificate.
+
+Usage: benchmarks/tls.py [calls]
+"""
+import json
+import os
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import cpapi  # noqa: E402
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path.endswith('/login'):
+            body = {'sid': 'benchmark', 'api-server-version': '1.5', 'session-timeout': 600}
+        else:
+            body = {'message': 'OK'}
+        data = json.dumps(body).encode()
+        # headers and body in a single write, so that the timings are not those of delayed ACKs
+        self.wfile.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n%s'
+                         % (len(data), data))
+
+
+def serve(tmp_dir):
+    cert = os.path.join(tmp_dir, 'cert.pem')
+    key = os.path.join(tmp_dir, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-keyout', key, '-out', cert,
+                    '-days', '1', '-subj', '/CN=localhost'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                   check=True)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def measure(port, calls, reuse):
+    client = cpapi.APIClient(cpapi.APIClientArgs(server='127.0.0.1', port=port, unsafe_auto_accept=True,
+                                                 single_conn=False, reuse_tls_sessions=reuse))
+    client.save_fingerprint_to_file = lambda server, fingerprint, filename=None: True
+    client.login('benchmark', 'benchmark')
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        res = client.api_call('show-session')
+        timings.append(time.perf_counter() - start)
+        if not res.success:
+            raise Exception(res.error_message)
+    return timings, client.tls_stats
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        server = serve(tmp_dir)
+        print(f"{'case':<20}{'handshakes':>12}{'resumed':>10}{'min ms':>10}{'median ms':>12}")
+        for name, reuse in [('full handshakes', False), ('resumed sessions', True)]:
+            timings, stats = measure(server.server_address[1], calls, reuse)
+            print(f"{name:<20}{stats['handshakes']:>12}{stats['resumed']:>10}{min(timings) * 1000:>10.2f}"
+                  f"{statistics.median(timings) * 1000:>12.2f}")
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
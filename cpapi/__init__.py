@@ -1,5 +1,46 @@
-from .mgmt_api import APIClient
-from .mgmt_api import APIClientArgs
-from .api_exceptions import APIException
-from .api_exceptions import APIClientException
-from .api_response import APIResponse
+import sys
+
+# The public names and the modules that define them. On python 3.7+ the modules are imported on first use,
+# so that importing the package does not pull in ssl, http.client, hashlib and subprocess before they are needed.
+_exports = {
+    "APIClient": "mgmt_api",
+    "APIClientArgs": "mgmt_api",
+    "APIException": "api_exceptions",
+    "APIClientException": "api_exceptions",
+    "APIResponse": "api_response",
+    "APIBatchResponse": "api_response",
+    "SessionCache": "session_cache",
+    "RetryPolicy": "retry",
+    "TokenBucket": "retry",
+    "LatencyTracker": "retry",
+    "PageCheckpoint": "checkpoint",
+    "ObjectCache": "object_cache",
+    "FingerprintStore": "fingerprint_store",
+}
+
+if sys.version_info >= (3, 7):
+    import importlib
+
+    def __getattr__(name):
+        if name not in _exports:
+            raise AttributeError("module %r has no attribute %r" % (__name__, name))
+        value = getattr(importlib.import_module("." + _exports[name], __name__), name)
+        globals()[name] = value
+        return value
+
+    def __dir__():
+        return sorted(list(globals().keys()) + list(_exports.keys()))
+else:
+    from .mgmt_api import APIClient
+    from .mgmt_api import APIClientArgs
+    from .api_exceptions import APIException
+    from .api_exceptions import APIClientException
+    from .api_response import APIResponse
+    from .api_response import APIBatchResponse
+    from .session_cache import SessionCache
+    from .retry import RetryPolicy
+    from .retry import TokenBucket
+    from .retry import LatencyTracker
+    from .checkpoint import PageCheckpoint
+    from .object_cache import ObjectCache
+    from .fingerprint_store import FingerprintStore
@@ -1,4 +1,3 @@
-import json
 import sys
 
 from cpapi.utils import compatible_loads
@@ -35,41 +34,89 @@ def extract_error_and_warning_messages(data):
     return ''.join(error_message)
 
 
-class APIResponse:
+class APIResponse(object):
     """
     An object to represent an API Response.
     Contains data, status_code, success, and sometimes error_message
+    The error message and res_obj are made when they are used. A response created with decode=False keeps its
+    body in .raw and decodes it when .data is first used.
     """
+    __slots__ = ("status_code", "success", "size", "raw", "_data", "_error_message")
+
     def __repr__(self):
-        return '%s(%s)' % (type(self).__name__, json.dumps(self.as_dict(), indent=4, sort_keys=True))
+        if self.success:
+            return '%s(status_code=%s, success=True, size=%d)' % (type(self).__name__, self.status_code, self.size)
+        return '%s(status_code=%s, success=False, error_message=%r)' % (type(self).__name__, self.status_code,
+                                                                        str(self.error_message))
 
-    def __init__(self, json_response, success, status_code=None, err_message=""):
+    def __init__(self, json_response, success, status_code=None, err_message="", decode=True):
         self.status_code = status_code
-        self.data = None
+        self.success = success
+        # size of the response body, 0 when not built from one
+        self.size = len(json_response) if isinstance(json_response, (bytes, str)) else 0
+        # the body until it is decoded
+        self.raw = None
+        self._data = None
+        # an error message given or found while decoding, otherwise made from the data of a failed response
+        self._error_message = None
 
         if err_message:
             self.success = False
-            self.error_message = err_message
-            self.res_obj = {}
+            self._error_message = err_message
+        elif isinstance(json_response, dict):
+            self._data = json_response
+        elif decode:
+            self._decode(json_response)
         else:
-            self.success = success
+            self.raw = json_response
+
+    def _decode(self, json_response):
+        try:
+            self._data = compatible_loads(json_response)
+        except ValueError:
+            self._data = {"errors": [{"message": str(json_response)}]}
+            self._error_message = "APIResponse received a response which is not a valid JSON."
+
+    @property
+    def data(self):
+        if self.raw is not None:
+            raw, self.raw = self.raw, None
+            self._decode(raw)
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self.raw = None
+        self._data = data
+
+    @property
+    def error_message(self):
+        """the error message of a failed response. A successful one has none, unless its body is not valid JSON."""
+        data = self.data
+        if self._error_message is None:
+            if self.success:
+                raise AttributeError("error_message")
             try:
-                if isinstance(json_response, dict):
-                    data_dict = json_response
-                else:
-                    data_dict = compatible_loads(json_response)
-            except ValueError:
-                self.data = {"errors": [{"message": str(json_response)}]}
-                self.error_message = "APIResponse received a response which is not a valid JSON."
-                self.res_obj = {"status_code": self.status_code, "data": self.data}
-            else:
-                self.data = data_dict
-                self.res_obj = {"status_code": self.status_code, "data": self.data}
-                if not self.success:
-                    try:
-                        self.error_message = extract_error_and_warning_messages(self.data)
-                    except KeyError:
-                        raise APIException("Unexpected error format.", json_response)
+                self._error_message = extract_error_and_warning_messages(data)
+            except KeyError:
+                raise APIException("Unexpected error format.", data)
+        return self._error_message
+
+    @error_message.setter
+    def error_message(self, error_message):
+        self._error_message = error_message
+
+    @property
+    def res_obj(self):
+        data = self.data
+        if data is None and not self.success:
+            return {}
+        return {"status_code": self.status_code, "data": data}
+
+    @res_obj.setter
+    def res_obj(self, res_obj):
+        self.status_code = res_obj.get("status_code")
+        self.data = res_obj.get("data")
 
     def as_dict(self):
         attribute_dict = {
@@ -93,17 +140,18 @@ class APIResponse:
         return {"status_code": self.status_code, "data": self.data}
 
     @classmethod
-    def from_http_response(cls, http_response, err_message=""):
+    def from_http_response(cls, http_response, err_message="", decode=True):
         """
         Generate APIResponse from http_response object
 
         :param http_response: input HTTP response object
         :param err_message: if there is an error message included, we include it in the APIResponse
+        :param decode: if set to False, the body is kept in .raw and decoded when .data is first used
         :return: The APIResponse object we generated
         """
         assert isinstance(http_response, HTTPResponse)
         return cls(http_response.read(), success=(http_response.status == 200), status_code=http_response.status,
-                   err_message=err_message)
+                   err_message=err_message, decode=decode)
 
     def set_success_status(self, status):
         """
@@ -112,3 +160,45 @@ class APIResponse:
         :param status: input status
         """
         self.success = status
+
+
+class APIBatchResponse:
+    """
+    The responses of a batch of API calls, in the order of the calls.
+    Every call succeeds or fails on its own, its failure is kept in its APIResponse.
+    Also contains the time each call took and the elapsed time of the whole batch (in seconds).
+    """
+    def __repr__(self):
+        return '%s(%d calls, %d failed, %.3fs)' % (type(self).__name__, len(self.responses), len(self.failures),
+                                                    self.elapsed)
+
+    def __init__(self, responses, durations, elapsed):
+        self.responses = responses
+        self.durations = durations
+        self.elapsed = elapsed
+
+    def __len__(self):
+        return len(self.responses)
+
+    def __iter__(self):
+        return iter(self.responses)
+
+    def __getitem__(self, i):
+        return self.responses[i]
+
+    @property
+    def success(self):
+        """True if all the calls succeeded"""
+        return all(res.success for res in self.responses)
+
+    @property
+    def failures(self):
+        """list of (index, APIResponse) of the calls that failed"""
+        return [(i, res) for i, res in enumerate(self.responses) if not res.success]
+
+    def as_dict(self):
+        return {
+            "success": self.success,
+            "elapsed": self.elapsed,
+            "calls": [dict(res.as_dict(), duration=duration) for res, duration in zip(self.responses, self.durations)]
+        }
@@ -0,0 +1,116 @@
+from __future__ import print_function
+
+import json
+import os
+import sys
+
+from cpapi.utils import get_massage_from_io_error
+
+
+class PageCheckpoint:
+    """
+    An on-disk spool for paginated API queries, so that an interrupted query resumes where it stopped.
+    Every completed page is saved to its own file, and a cursor file records the query and the offset of
+    the next page together with the total the server reported.
+    The spool belongs to a single query: resuming with a different command or payload starts over.
+    """
+
+    CURSOR_FILE = "cursor.json"
+
+    def __init__(self, directory):
+        """
+        :param directory: the spool directory, created if needed
+        """
+        self.directory = directory
+        self.cursor = None
+
+    @staticmethod
+    def query_id(command, payload):
+        """The identity of a query is its command and payload, without the offset that changes between pages"""
+        payload = dict((k, v) for k, v in (payload or {}).items() if k != "offset")
+        return json.dumps([command, payload], sort_keys=True)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _write(self, name, obj):
+        tmp_path = self._path(name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(obj, f)
+        os.replace(tmp_path, self._path(name))
+
+    def resume(self, command, payload):
+        """
+        :return: the saved cursor of the query (dict with "next-offset", "total" and "pages"),
+                 or None when there is nothing to resume
+        """
+        self.cursor = None
+        try:
+            with open(self._path(self.CURSOR_FILE)) as f:
+                cursor = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if cursor.get("query") != self.query_id(command, payload) or not cursor.get("pages") \
+                or cursor["next-offset"] >= cursor["total"]:
+            self.clear()
+            return None
+        self.cursor = cursor
+        return cursor
+
+    def start(self, command, payload):
+        """Start a new spool for the query, dropping whatever was saved before"""
+        self.clear()
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.cursor = {"query": self.query_id(command, payload), "next-offset": None, "total": None, "pages": []}
+
+    def save_page(self, offset, next_offset, total, containers):
+        """
+        Save a completed page, then move the cursor past it.
+
+        :param offset: the offset the page was requested with
+        :param next_offset: the offset of the next page (the 'to' field of the response)
+        :param total: the 'total' field of the response
+        :param containers: dict of container key (usually "objects") to the objects of the page
+        """
+        name = "page-%010d.json" % offset
+        try:
+            self._write(name, containers)
+            self.cursor["pages"].append(name)
+            self.cursor["next-offset"] = next_offset
+            self.cursor["total"] = total
+            self._write(self.CURSOR_FILE, self.cursor)
+        except (IOError, OSError) as e:
+            # a failing spool must not fail the query itself
+            print("Couldn't write checkpoint to: " + self.directory + "\n" + get_massage_from_io_error(e),
+                  file=sys.stderr)
+
+    def is_consistent(self, total):
+        """
+        Objects were added or removed since the spool was written if the server reports a different total,
+        and the saved offsets no longer line up with the server's. Such a spool cannot be merged.
+        """
+        return self.cursor is not None and self.cursor["total"] == total
+
+    def objects(self, container_key="objects"):
+        """Yield the spooled objects page by page, skipping duplicates (by uid) of shifted pages"""
+        seen = set()
+        for name in self.cursor["pages"] if self.cursor else []:
+            with open(self._path(name)) as f:
+                page = json.load(f)
+            for obj in page.get(container_key, []):
+                uid = obj.get("uid") if isinstance(obj, dict) else None
+                if uid is not None:
+                    if uid in seen:
+                        continue
+                    seen.add(uid)
+                yield obj
+
+    def clear(self):
+        """Remove the spool, e.g. after the query completed"""
+        self.cursor = None
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name == self.CURSOR_FILE or name.startswith("page-"):
+                os.remove(self._path(name))
@@ -2,6 +2,7 @@
 
 import argparse
 import collections
+import itertools
 import json
 import os
 import re
@@ -30,8 +31,31 @@ def debug(*args, **kwargs):
         log(*args, **kwargs)
 
 
+class PairsNode(object):
+    """A node of the trie of dotted keys, see Pairs.trie"""
+    __slots__ = ('children', 'index', 'value', 'error')
+
+    def __init__(self):
+        self.children = collections.OrderedDict()
+        # the position and value of the pair whose key ends here, if any
+        self.index = None
+        self.value = None
+        # the first error found in the keys of this prefix
+        self.error = None
+
+    def leaves(self, path=None):
+        """Yield (index, key) of every pair below the node, the key relative to the node"""
+        for part, child in self.children.items():
+            key = part if path is None else path + '.' + part
+            if child.index is not None:
+                yield child.index, key
+            for leaf in child.leaves(key):
+                yield leaf
+
+
 class Pairs(object):
     NO_KEY = None
+    NUMBER = re.compile(r'\d+$')
 
     def __init__(self, pair_list=None):
         if pair_list is None:
@@ -82,25 +106,63 @@ class Pairs(object):
     def add(self, key, val):
         self.list.append((key, val))
 
-    def to_obj(self):
-        if len(self) == 1 and self[0][0] is Pairs.NO_KEY:
-            val = self[0][1]
-            if val in {'null', 'true', 'false'} or val[0] in '"{[':
-                return compatible_loads(val)
-            elif re.match(r'\d+$', val):
-                return int(val, 10)
-            return val
-        pairs = Pairs()
+    @staticmethod
+    def scalar(val):
+        if val in {'null', 'true', 'false'} or val[0] in '"{[':
+            return compatible_loads(val)
+        elif Pairs.NUMBER.match(val):
+            return int(val, 10)
+        return val
+
+    def trie(self):
+        """
+        Split the dotted keys into a trie, in a single pass over the pairs.
+        The errors are recorded on the nodes, and raised by build in the order
+        that the keys are converted.
+        """
+        root = PairsNode()
+        seen = set()
+        for i, (k, v) in enumerate(self.list):
+            parts = k.split('.')
+            if k in seen:
+                child = root.children[parts[0]]
+                if child.error is None:
+                    child.error = 'duplicate key: "%s"' % k
+                continue
+            seen.add(k)
+            node = parent = root
+            for part in parts:
+                parent = node
+                node = node.children.get(part)
+                if node is None:
+                    node = parent.children[part] = PairsNode()
+            if len(parts) > 1 and not parts[-1] and parent.error is None:
+                parent.error = 'empty suffix: "%s."' % parts[-2]
+            node.index = i
+            node.value = v
+        return root
+
+    @staticmethod
+    def build(node):
+        pairs = []
         all_nums = True
         any_nums = False
-        for prefix in self.prefixes():
-            vals = self.get(prefix)
-            if re.match(r'\d+$', prefix):
+        for prefix, child in node.children.items():
+            if child.error is not None:
+                raise ValueError(child.error)
+            if not child.children:
+                val = Pairs.scalar(child.value)
+            elif child.index is not None:
+                raise ValueError('mixed keys: ["%s" "%s"]' % (prefix, '" "'.join(
+                    '%s.%s' % (prefix, s) for _, s in sorted(child.leaves()))))
+            else:
+                val = Pairs.build(child)
+            if Pairs.NUMBER.match(prefix):
                 prefix = int(prefix, 10)
                 any_nums = True
             else:
                 all_nums = False
-            pairs.add(prefix, vals.to_obj())
+            pairs.append((prefix, val))
         if not all_nums:
             if any_nums:
                 raise ValueError('mixed (sub)keys: ["%s"]' % '" "'.join(
@@ -108,50 +170,110 @@ class Pairs(object):
             return collections.OrderedDict(pairs)
         return [i[1] for i in sorted(pairs)]
 
+    def to_obj(self):
+        if len(self) == 1 and self[0][0] is Pairs.NO_KEY:
+            return self.scalar(self[0][1])
+        return self.build(self.trie())
+
+
+PLAIN_STRING = re.compile(r'[A-Za-z_][-0-9A-Za-z_]*$')
+DATE_PREFIX = re.compile(r'[0-9][0-9][0-9][0-9]-')
+RESERVED_WORDS = frozenset([
+    'null', 'true', 'yes', 'on', 'false', 'no', 'off', 'infinity', 'nan',
+    '---', '...'])
+
 
 def safe_string(v):
-    if isinstance(v, string_type) and re.match(
-            r'[A-Za-z_][-0-9A-Za-z_]*$', v) and v.lower() not in {
-                'null', 'true', 'yes', 'on', 'false', 'no', 'off',
-                'infinity', 'nan', '---', '...'} and not re.match(
-                    r'[0-9][0-9][0-9][0-9]-', v):
+    if isinstance(v, string_type) and PLAIN_STRING.match(
+            v) and v.lower() not in RESERVED_WORDS and not DATE_PREFIX.match(
+                v):
         return v
     return json.dumps(v)
 
 
+def yaml_lines(root):
+    """
+    Yield the lines of the configuration in a user friendly format, see
+    simple_yaml. The nodes are walked with a stack of their items, not
+    recursively, so that any depth of nesting can be written.
+    """
+    # the items left of every open dict or list, if it is a dict, the prefix
+    # of the line of its next item, and of the lines below the item
+    stack = []
+    # the same keys come again in every object of a list
+    keys = {}
+
+    def visit(node, first, rest):
+        if not isinstance(node, (dict, list)) or not node:
+            return first + safe_string(node)
+        stack.append([iter(node.items()) if isinstance(node, dict) else
+                      iter(node), isinstance(node, dict), first, rest])
+
+    line = visit(root, '', '')
+    if line is not None:
+        yield line
+    while stack:
+        frame = stack[-1]
+        items, is_dict, first, rest = frame
+        for item in items:
+            break
+        else:
+            stack.pop()
+            continue
+        # only the first item continues the line of its parent
+        frame[2] = rest
+        k, v = item if is_dict else (None, item)
+        if k is None:
+            line = visit(v, first + '- ', rest + '  ')
+            if line is not None:
+                yield line
+            continue
+        key = keys.get(k) if isinstance(k, string_type) else None
+        if key is None:
+            key = safe_string(k) + ':'
+            if isinstance(k, string_type):
+                keys[k] = key
+        if not isinstance(v, (dict, list)) or not v:
+            yield first + key + ' ' + safe_string(v)
+            continue
+        yield first + key
+        if not isinstance(v, list):
+            rest += '  '
+        visit(v, rest, rest)
+
+
 def simple_yaml(root, as_string=True):
     """Print the configuration in a user friendly format."""
 
     if as_string:
-        return '\n'.join(simple_yaml(root, False) + [''])
-
-    if not isinstance(root, (dict, list)) or not root:
-        return [safe_string(root)]
-
-    if isinstance(root, dict):
-        items = root.items()
-    else:
-        items = ((None, v) for v in root)
-    lines = []
-    for k, v in items:
-        v_lines = simple_yaml(v, False)
-        indent = '  '
-        if k is None:
-            lines.append('- ' + v_lines.pop(0))
-        else:
-            lines.append(safe_string(k) + ':')
-            if isinstance(v, list):
-                indent = ''
-            if not v or not isinstance(v, (dict, list)):
-                lines[-1] += ' ' + v_lines.pop(0)
-        lines.extend([indent + line for line in v_lines])
-    return lines
+        return ''.join([line + '\n' for line in yaml_lines(root)])
+    return list(yaml_lines(root))
+
+
+def write_yaml(root, stream, chunk_lines=1024):
+    """Write the configuration in the format of simple_yaml to a stream, a
+    chunk of lines at a time"""
+    lines = yaml_lines(root)
+    while True:
+        chunk = list(itertools.islice(lines, chunk_lines))
+        if not chunk:
+            break
+        chunk.append('')
+        stream.write('\n'.join(chunk))
 
 
 class Format(argparse.Action):
     FORMATS = {
         'json': lambda o: json.dumps(o, indent=2),
         'text': simple_yaml}
+    # the formats of the objects of a paginated query, written one by one:
+    # JSON lines and YAML documents
+    STREAM_FORMATS = {
+        FORMATS['json']: lambda o: json.dumps(o) + '\n',
+        FORMATS['text']: lambda o: '---\n' + simple_yaml(o)}
+    # the formats that are written to the output as they are made
+    WRITERS = {
+        FORMATS['text']: write_yaml}
 
     def __init__(self, option_strings, dest, default=None, **kwargs):
         if default:
@@ -178,21 +300,209 @@ class Args(argparse.Action):
         setattr(namespace, self.dest, val)
 
 
-def pack(name):
+def paginate(client, command, payload, prefetch, write):
+    """
+    Get all the objects of a 'show-*' query page by page, and write each
+    one as soon as its page arrives.
+
+    :return: the response of the last page, as a dict without its data
+    """
+    details_level = payload.pop('details-level', 'standard')
+    api_res = None
+    for api_res in client.gen_api_query(
+            command, details_level, payload=payload, accumulate=False,
+            prefetch=prefetch):
+        if not api_res.success:
+            break
+        for obj in api_res.data.get('objects', []):
+            write(obj)
+    response = api_res.as_dict()
+    if response.get('success'):
+        response['data'] = response['res_obj'] = None
+    return response
+
+
+# the commands that change the database, and are published
+PUBLISH_PREFIXES = ('set-', 'add-', 'delete-', 'get-interfaces')
+
+
+def needs_publish(command):
+    return command.startswith(PUBLISH_PREFIXES)
+
+
+def read_batch(path):
+    """
+    Yield the rows of a batch file: either CSV, with a header row of the
+    argument names (dotted like on the command line), or JSON lines of
+    arguments. A 'command' argument runs the row with another command.
+    A row that cannot be read raises ValueError with its number.
+    """
+    import csv
+    with open(path) as f:
+        first = ''
+        for first in f:
+            if first.strip():
+                break
+        f.seek(0)
+        if first.lstrip().startswith('{'):
+            for i, line in enumerate(f):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(
+                        line, object_pairs_hook=collections.OrderedDict)
+                except ValueError as e:
+                    raise ValueError('row %d: %s' % (i + 1, e))
+                if not isinstance(row, dict):
+                    raise ValueError('row %d: not an object' % (i + 1))
+                yield i + 1, row
+            return
+        reader = csv.reader(f)
+        header = next(reader, [])
+        for i, row in enumerate(reader):
+            # empty cells are left out, like missing arguments
+            pairs = [(k, v) for k, v in zip(header, row) if v != '']
+            try:
+                yield i + 1, Pairs(pairs).to_obj() if pairs else {}
+            except ValueError as e:
+                raise ValueError('row %d: %s' % (i + 1, e))
+
+
+def run_batch(client, command, defaults, rows, workers, publish_every, sync,
+              write):
+    """
+    Run every row of a batch in the client's session, up to workers rows at a
+    time, and write the result of each row. The changes (the rows of commands
+    that need publishing, see needs_publish, that succeeded) are published once
+    at the end, or after every publish_every changes.
+    All the rows are read before the first one runs, so that a bad row fails
+    the batch before it changed anything. When the batch stops midway, e.g. a
+    publish fails, the changes written as successful are published, or
+    discarded if that fails too. The summary tells how many were published
+    and how many were discarded, and the error that stopped the batch.
+
+    :param defaults: the arguments of the command line, the rows add to them
+    :param rows: (number, arguments) of every row, see read_batch
+    :return: summary of the batch
+    """
+    import time
+    start = time.time()
+    rows = list(rows)
+    summary = collections.OrderedDict(
+        [('rows', 0), ('failed', 0), ('changes', 0), ('published', 0),
+         ('publishes', 0)])
+    # the changes made since the last publish
+    changes = 0
+
+    def publish(count):
+        res = client.api_call('publish', {}, wait_for_task=sync)
+        if not res.success:
+            raise Exception('publish failed: %s' % (
+                str(res.error_message).strip()))
+        summary['publishes'] += 1
+        summary['published'] += count
+
+    try:
+        position = 0
+        while position < len(rows):
+            chunk_size = 100
+            if publish_every:
+                # a chunk does not make more changes than the next publish
+                chunk_size = min(chunk_size, publish_every - changes)
+            chunk = rows[position:position + chunk_size]
+            position += len(chunk)
+            calls = []
+            for _, row in chunk:
+                payload = collections.OrderedDict(defaults)
+                payload.update(row)
+                calls.append((payload.pop('command', command), payload))
+            batch = client.api_batch(calls, max_workers=workers,
+                                     wait_for_task=sync)
+            # the whole chunk is counted before its results are written, so
+            # that a failed write does not hide changes that were made
+            results = []
+            for (number, _), (call_command, _), res, duration in zip(
+                    chunk, calls, batch, batch.durations):
+                result = collections.OrderedDict([
+                    ('row', number), ('command', call_command),
+                    ('success', res.success),
+                    ('status-code', res.status_code),
+                    ('duration', round(duration, 3))])
+                if res.success:
+                    if isinstance(res.data, dict) and 'uid' in res.data:
+                        result['uid'] = res.data['uid']
+                    if needs_publish(call_command):
+                        changes += 1
+                        summary['changes'] += 1
+                else:
+                    result['error'] = str(res.error_message).strip()
+                    summary['failed'] += 1
+                summary['rows'] += 1
+                results.append(result)
+            for result in results:
+                write(result)
+            if publish_every and changes >= publish_every:
+                publish(changes)
+                changes = 0
+        if changes:
+            publish(changes)
+            changes = 0
+    except Exception as e:
+        summary['error'] = str(e).strip()
+        if changes:
+            try:
+                publish(changes)
+            except Exception:
+                res = client.api_call('discard', {})
+                summary['discarded' if res.success else 'unpublished'] = \
+                    changes
+    summary['elapsed'] = round(time.time() - start, 3)
+    return summary
+
+
+def compile_source(source, path):
+    """:return: the contents of an unchecked-hash .pyc of the source, zipimport loads it without looking at the .py"""
+    import importlib.util
+    import marshal
+    code = compile(source, path, 'exec', dont_inherit=True)
+    source_hash = importlib.util.source_hash(source)
+    return (importlib.util.MAGIC_NUMBER + (0b01).to_bytes(4, 'little') +
+            source_hash + marshal.dumps(code))
+
+
+def pack(name, main_source=None, extra_files=None, interpreter='python',
+         compiled=False):
+    """
+    Build a single-file zipapp of the cpapi package.
+
+    :param name: the file to create
+    :param main_source: [optional] the __main__.py of the zipapp, defaults to running this CLI
+    :param extra_files: [optional] dict of path within the zipapp to contents, e.g. a script using cpapi
+    :param interpreter: the interpreter of the shebang line
+    :param compiled: also store precompiled .pyc files next to the sources, so that starting the zipapp does
+                     not compile them. They are used only by the python version that packed them.
+    """
     import pkgutil
     import zipfile
     base_file = os.path.basename(os.path.basename(__file__)).partition('.')[0]
     base_dir = os.path.basename(os.path.dirname(__file__))
+    if main_source is None:
+        main_source = 'from %s.%s import run\nrun()\n' % (base_dir, base_file)
+    files = collections.OrderedDict()
+    files[os.path.join(base_dir, '__init__.py')] = pkgutil.get_data(
+        base_dir, '__init__.py')
+    for module in pkgutil.iter_modules([os.path.dirname(__file__)]):
+        f = module.name + '.py'
+        files[os.path.join(base_dir, f)] = pkgutil.get_data(base_dir, f)
+    files.update(extra_files or {})
+    files['__main__.py'] = main_source.encode('utf-8')
     with open(name, 'wb') as f:
-        f.write(b'#!/usr/bin/env python\n')
+        f.write(('#!/usr/bin/env %s\n' % interpreter).encode('utf-8'))
         with zipfile.ZipFile(f, 'a', zipfile.ZIP_DEFLATED) as zf:
-            for f in ('__init__.py', 'api_exceptions.py', 'api_response.py',
-                      'mgmt_api.py', base_file + '.py'):
-                contents = pkgutil.get_data(base_dir, f)
-                zf.writestr(os.path.join(base_dir, f), contents)
-            zf.writestr('__main__.py', (
-                'from %s.%s import run\nrun()\n' % (
-                    base_dir, base_file)).encode('utf-8'))
+            for path, contents in files.items():
+                zf.writestr(path, contents)
+                if compiled:
+                    zf.writestr(path + 'c', compile_source(contents, path))
     umask = os.umask(0o777)
     os.umask(umask)
     os.chmod(name, 0o755 & (0o7777 - umask))
@@ -227,13 +537,20 @@ def main(argv):
         '--format', '-f', metavar='{json|text}', nargs=1, default='text',
         action=Format)
     args_def = [
+        ('--batch', '-b', 'FILE', None),
+        ('--batch-workers', None, 'N', 'MGMT_CLI_BATCH_WORKERS'),
         ('--debug', None, '{on|off}', 'MGMT_CLI_DEBUG'),
+        ('--debug-body-limit', None, 'CHARS', 'MGMT_CLI_DEBUG_BODY_LIMIT'),
+        ('--debug-file', None, 'FILE', 'MGMT_CLI_DEBUG_FILE'),
         ('--domain', '-d', 'DOMAIN', 'MGMT_CLI_DOMAIN'),
         ('--fingerprint', None, 'FINGERPRINT', 'MGMT_CLI_FINGERPRINT'),
         ('--management', '-m', 'SERVER', 'MGMT_CLI_MANAGEMENT'),
+        ('--paginate', None, '{true|false}', 'MGMT_CLI_PAGINATE'),
         ('--password', '-p', 'PASSWORD', 'MGMT_CLI_PASSWORD'),
         ('--port', None, 'PORT', 'MGMT_CLI_PORT'),
+        ('--prefetch', None, 'PAGES', 'MGMT_CLI_PREFETCH'),
         ('--proxy', '-x', 'PROXY', 'MGMT_CLI_PROXY'),
+        ('--publish-every', None, 'N', 'MGMT_CLI_PUBLISH_EVERY'),
         ('--root', '-r', '{true|false}', None),
         ('--session-id', None, 'SESSION-ID', 'MGMT_CLI_SESSION_ID'),
         ('--sync', None, '{true|false}', 'MGMT_CLI_SYNC'),
@@ -261,12 +578,15 @@ def main(argv):
         if getattr(args, attr, None) is NO_DEFAULT:
             delattr(args, attr)
     client_args = {}
+    debug_stream = None
     if getattr(args, 'debug', 'off') == 'on':
         log.debug = True
-        client_args['debug_file'] = sys.stderr  # dummy
-        # FIXME: remove when save_debug_data is fixed
-        APIClient.save_debug_data = lambda self: sys.stderr.write(
-            'API calls: %s\n' % json.dumps(self.api_calls, indent=2))
+        # the api calls are written as they complete, not kept until exit
+        if hasattr(args, 'debug_file'):
+            debug_stream = open(args.debug_file, 'w')
+        client_args['debug_stream'] = debug_stream or sys.stderr
+        if hasattr(args, 'debug_body_limit'):
+            client_args['debug_body_limit'] = int(args.debug_body_limit)
         client_args['http_debug_level'] = 1
     debug('args: %s\n' % args)
     if hasattr(args, 'port'):
@@ -294,42 +614,91 @@ def main(argv):
     args.domain = getattr(args, 'domain', None)
     args.root = compatible_loads(getattr(args, 'root', 'false'))
     args.sync = compatible_loads(getattr(args, 'sync', 'true'))
-    with APIClient(APIClientArgs(**client_args)) as client:
-        call_args = {}
-        if hasattr(args, 'session_id'):
-            call_args['sid'] = args.session_id
-        elif args.root:
-            client.login_as_root(domain=args.domain)
-        elif hasattr(args, 'password') and args.command != 'login':
-            client.login(username=args.user, password=args.password,
-                         domain=args.domain)
-        if hasattr(args, 'version'):
-            # FIXME: remove when api_call accepts api_version
-            client.api_version = args.version
-        saved_stdout = sys.stdout
-        publish_response = None
-        try:
-            sys.stdout = sys.stderr
-            if args.command == 'login':
-                for attr in ('user', 'password', 'domain'):
-                    if attr not in args.arg:
-                        val = getattr(args, attr, None)
-                        if val:
-                            args.arg[attr] = val
-            response = client.api_call(
-                args.command, args.arg, wait_for_task=args.sync,
-                **call_args).as_dict()
-            if any(args.command.startswith(p) for p in {
-                    'set-', 'add-', 'delete-', 'get-interfaces'}):
-                publish_response = client.api_call(
-                    'publish', {}, wait_for_task=args.sync).as_dict()
-        finally:
-            sys.stdout = saved_stdout
+    # all the pages of a 'show-*' query, streamed
+    args.paginate = compatible_loads(getattr(args, 'paginate', 'false')) and \
+        args.command.startswith('show-') and isinstance(args.arg, dict)
+    args.prefetch = int(getattr(args, 'prefetch', 0))
+    if args.paginate and args.prefetch > 0:
+        # the prefetched pages are requested from other threads
+        client_args['thread_safe'] = True
+    # the rows of a batch file, run in one session
+    args.batch = getattr(args, 'batch', None)
+    args.batch_workers = int(getattr(args, 'batch_workers', 1))
+    args.publish_every = int(getattr(args, 'publish_every', 0))
+    if args.batch and args.batch_workers > 1:
+        client_args['thread_safe'] = True
+    try:
+        with APIClient(APIClientArgs(**client_args)) as client:
+            call_args = {}
+            if hasattr(args, 'session_id'):
+                call_args['sid'] = args.session_id
+            elif args.root:
+                client.login_as_root(domain=args.domain)
+            elif hasattr(args, 'password') and args.command != 'login':
+                client.login(username=args.user, password=args.password,
+                             domain=args.domain)
+            if hasattr(args, 'version'):
+                # FIXME: remove when api_call accepts api_version
+                client.api_version = args.version
+            saved_stdout = sys.stdout
+            publish_response = None
+            try:
+                sys.stdout = sys.stderr
+                if args.command == 'login':
+                    for attr in ('user', 'password', 'domain'):
+                        if attr not in args.arg:
+                            val = getattr(args, attr, None)
+                            if val:
+                                args.arg[attr] = val
+                def write(obj):
+                    saved_stdout.write(stream_format(obj))
+
+                stream_format = Format.STREAM_FORMATS[args.format]
+                if (args.paginate or args.batch) and 'sid' in call_args:
+                    # the calls use the client's session, which is not ours
+                    # to log out of
+                    client.sid = call_args['sid']
+                    client.logout_on_exit = False
+                if args.batch:
+                    summary = run_batch(
+                        client, args.command, args.arg,
+                        read_batch(args.batch), args.batch_workers,
+                        args.publish_every, args.sync, write)
+                    log('batch: %s\n' % json.dumps(summary))
+                    if 'error' in summary:
+                        message = 'batch stopped after %d rows: %s' % (
+                            summary['rows'], summary['error'])
+                    else:
+                        message = '%d of %d rows failed' % (
+                            summary['failed'], summary['rows'])
+                    response = {'success': not summary['failed'] and
+                                'error' not in summary, 'data': message}
+                elif args.paginate:
+                    response = paginate(client, args.command, args.arg,
+                                        args.prefetch, write)
+                else:
+                    response = client.api_call(
+                        args.command, args.arg, wait_for_task=args.sync,
+                        **call_args).as_dict()
+                if not args.batch and needs_publish(args.command):
+                    publish_response = client.api_call(
+                        'publish', {}, wait_for_task=args.sync).as_dict()
+            finally:
+                sys.stdout = saved_stdout
+    finally:
+        if debug_stream is not None:
+            debug_stream.close()
+    if args.batch and not response.get('success'):
+        raise Exception(response['data'])
     if not response.get('success'):
         raise Exception(json.dumps(response, indent=2))
     if publish_response and not publish_response.get('success'):
         raise Exception(json.dumps(publish_response, indent=2))
-    sys.stdout.write(args.format(response.get('data')))
+    if not args.paginate and not args.batch:
+        if args.format in Format.WRITERS:
+            Format.WRITERS[args.format](response.get('data'), sys.stdout)
+        else:
+            sys.stdout.write(args.format(response.get('data')))
 
 
 def run():
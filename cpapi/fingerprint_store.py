@@ -0,0 +1,114 @@
+from __future__ import print_function
+
+import json
+import os
+import sys
+import threading
+
+from cpapi.utils import file_lock, get_massage_from_io_error
+
+
+class FingerprintStore:
+    """
+    The trusted fingerprints of management servers, in the JSON file of APIClient.save_fingerprint_to_file, in which
+    the key is the server and the value is its fingerprint.
+    The file is read once and the fingerprints are held in memory. The file is read again only when it changed,
+    e.g. another process accepted a fingerprint, so a lookup costs a stat of the file whatever the number of servers.
+    Reading takes no lock. Writers hold an exclusive lock on a sidecar ".lock" file while they merge their fingerprint
+    into the latest file and replace it, so that concurrent writers, threads or processes, do not lose entries.
+    """
+
+    _stores = {}
+    _stores_lock = threading.Lock()
+
+    def __init__(self, filename="fingerprints.txt"):
+        """
+        :param filename: the fingerprints file, created on the first save
+        """
+        self.filename = filename
+        self.fingerprints = {}
+        # (mtime, size, inode) of the file the fingerprints were read from, None if not read yet
+        self.signature = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, filename="fingerprints.txt"):
+        """:return: the store of the file, shared by all the clients of the process"""
+        path = os.path.abspath(filename)
+        with cls._stores_lock:
+            store = cls._stores.get(path)
+            if store is None:
+                store = cls._stores[path] = cls(path)
+            return store
+
+    def _stat(self):
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return False
+        return st.st_mtime, st.st_size, st.st_ino
+
+    def _read(self):
+        """:return: the fingerprints in the file, {} if there is no file, or None if it cannot be read"""
+        try:
+            with open(self.filename) as f:
+                fingerprints = json.load(f)
+        except ValueError:
+            print("Corrupt JSON file: " + self.filename, file=sys.stderr)
+            return None
+        except (IOError, OSError) as e:
+            if not os.path.isfile(self.filename):
+                return {}
+            print("Couldn't open file: " + self.filename + "\n" + get_massage_from_io_error(e), file=sys.stderr)
+            return None
+        if not isinstance(fingerprints, dict):
+            print("Corrupt JSON file: " + self.filename, file=sys.stderr)
+            return None
+        return fingerprints
+
+    def refresh(self):
+        """Read the file again if it changed since it was read"""
+        signature = self._stat()
+        if signature == self.signature:
+            return
+        with self.lock:
+            if signature == self.signature:
+                return
+            fingerprints = self._read() if signature else {}
+            # an unreadable file is reported once, not on every lookup
+            self.fingerprints = fingerprints or {}
+            self.signature = signature
+
+    def get(self, server):
+        """:return: the stored fingerprint of the server, or "" if there is none"""
+        self.refresh()
+        return self.fingerprints.get(server, "")
+
+    def put(self, server, fingerprint):
+        """
+        Store a server's fingerprint.
+
+        :return: 'True' if everything went well. 'False' if there was some kind of error storing the fingerprint.
+        """
+        if not fingerprint:
+            return False
+        if self.get(server) == fingerprint:
+            return True
+        tmp_filename = "%s.%d.tmp" % (self.filename, os.getpid())
+        try:
+            with self.lock, file_lock(self.filename):
+                # merge into the latest file, which other writers may have changed
+                fingerprints = self._read()
+                if fingerprints is None:
+                    return False
+                fingerprints[server] = fingerprint
+                with open(tmp_filename, "w") as f:
+                    json.dump(fingerprints, f, indent=4, sort_keys=True)
+                os.replace(tmp_filename, self.filename)
+                self.fingerprints = fingerprints
+                self.signature = self._stat()
+            return True
+        except (IOError, OSError) as e:
+            print("Couldn't open file: " + self.filename + " for writing.\n" + get_massage_from_io_error(e),
+                  file=sys.stderr)
+            return False
@@ -14,22 +14,33 @@ import sys
 
 # compatible import for python 2 and 3
 from .api_exceptions import APIException, APIClientException, TimeoutException
-from .api_response import APIResponse
-from cpapi.utils import get_massage_from_io_error, compatible_loads
+from .api_response import APIResponse, APIBatchResponse
+from .fingerprint_store import FingerprintStore
+from .retry import LatencyTracker, RetryPolicy, TokenBucket
+from cpapi.utils import compatible_loads
 
 if sys.version_info >= (3, 0):
     import http.client as http_client
 else:
     import httplib as http_client
 
+import collections
 import hashlib
 import json
 import os.path
+import select
+import socket
 import ssl
 import subprocess
+import threading
 import time
 
 
+# the API ports found by login_as_root, by the python and api_get_port.py script that found them
+_root_ports = {}
+_root_ports_lock = threading.Lock()
+
+
 class APIClientArgs:
     """
     This class provides arguments for APIClient configuration.
@@ -42,7 +53,10 @@ class APIClientArgs:
     def __init__(self, port=None, fingerprint=None, sid=None, server="127.0.0.1", http_debug_level=0,
                  api_calls=None, debug_file="", proxy_host=None, proxy_port=8080,
                  api_version=None, unsafe=False, unsafe_auto_accept=False, context="web_api", single_conn=True,
-                 user_agent="python-api-wrapper"):
+                 user_agent="python-api-wrapper", retry_policy=None, rate_limit=None, thread_safe=False,
+                 object_cache=None, debug_stream=None, debug_body_limit=None, reuse_tls_sessions=True,
+                 call_timeout=None, run_timeout=None, python_path=None, api_get_port_path=None,
+                 mgmt_cli_path=None):
         self.port = port
         # management server fingerprint
         self.fingerprint = fingerprint
@@ -72,6 +86,36 @@ class APIClientArgs:
         self.single_conn = single_conn
         # User agent will be use in api call request header
         self.user_agent = user_agent
+        # RetryPolicy for failed requests. If left empty, a broken connection is reconnected and the request sent once
+        # more.
+        self.retry_policy = retry_policy
+        # Client side rate limit, either a TokenBucket or a number of requests per second. If left empty, not limited.
+        # The calls answered from the object cache send no request, and do not take from the rate limit.
+        self.rate_limit = rate_limit
+        # Indicates that the client is shared between threads: every thread gets its own HTTPS connection
+        # (with single_conn), while the session and the fingerprint are shared
+        self.thread_safe = thread_safe
+        # ObjectCache answering repeated 'show-*' calls by uid without a request. If left empty, nothing is cached.
+        # The calls it answers are kept for debugging (debug_stream, debug_file) marked as "cache-hit".
+        self.object_cache = object_cache
+        # file-like object the api calls are written to as they complete, one JSON record per line, instead of
+        # being kept in api_calls until the client exits
+        self.debug_stream = debug_stream
+        # longest request payload or response data (in characters of JSON) written to the debug stream.
+        # If left empty, not truncated.
+        self.debug_body_limit = debug_body_limit
+        # Indicates that new HTTPS connections resume the TLS session of an earlier one, which saves a full handshake
+        self.reuse_tls_sessions = reuse_tls_sessions
+        # Most seconds a request may wait for the server (the socket timeout). A request that times out is retried as
+        # the retry policy allows. Waiting for a task is limited by the timeout of api_call. If left empty, not limited.
+        self.call_timeout = call_timeout
+        # Most seconds all the API calls of the client may take, counted from its creation. If left empty, not limited.
+        self.run_timeout = run_timeout
+        # The executables of login_as_root: the python that runs the api_get_port.py script, which finds the API port,
+        # and mgmt_cli. If left empty, those of the management server ($MDS_FWDIR and $CPDIR).
+        self.python_path = python_path
+        self.api_get_port_path = api_get_port_path
+        self.mgmt_cli_path = mgmt_cli_path
 
 
 class APIClient:
@@ -102,6 +146,10 @@ class APIClient:
         self.api_calls = api_client_args.api_calls
         # name of debug file. If left empty, debug data will not be saved to disk.
         self.debug_file = api_client_args.debug_file
+        # file-like object the api calls are streamed to
+        self.debug_stream = api_client_args.debug_stream
+        # longest payload or data written to the debug stream
+        self.debug_body_limit = api_client_args.debug_body_limit
         # HTTP proxy server address
         self.proxy_host = api_client_args.proxy_host
         # HTTP proxy port
@@ -116,10 +164,52 @@ class APIClient:
         self.context = api_client_args.context
         # HTTPS connection
         self.conn = None
+        # the SSL context of all the HTTPS connections, see create_ssl_context
+        self.ssl_context = None
+        # Indicates that new HTTPS connections resume the TLS session of an earlier one
+        self.reuse_tls_sessions = api_client_args.reuse_tls_sessions
+        # the TLS session new connections resume, or None
+        self.tls_session = None
+        # number of TLS handshakes made, and how many of them resumed an earlier session
+        self.tls_stats = {"handshakes": 0, "resumed": 0}
+        # most seconds a request may wait for the server, and the time (as time.time()) by which all of them must be done
+        self.call_timeout = api_client_args.call_timeout
+        self.deadline = time.time() + api_client_args.run_timeout if api_client_args.run_timeout else None
+        # the executables of login_as_root
+        self.python_path = api_client_args.python_path or "$MDS_FWDIR/Python/bin/python3"
+        self.api_get_port_path = api_client_args.api_get_port_path or "$MDS_FWDIR/scripts/api_get_port.py"
+        self.mgmt_cli_path = api_client_args.mgmt_cli_path or "$CPDIR/bin/mgmt_cli"
+        # durations of the latest calls, for hedged requests
+        self.latencies = LatencyTracker()
+        # number of hedged requests sent, and how many of them were faster than the original request
+        self.hedge_stats = {"sent": 0, "won": 0}
+        self._hedge_executor = None
+        # the server's fingerprint once it was checked. Every later connection is verified against it, whether its
+        # TLS session is new or resumed, so that the fingerprint is not fetched again for each call.
+        self.pinned_fingerprint = None
         # Indicates that the client should use single HTTPS connection
         self.single_conn = api_client_args.single_conn
+        # Indicates that the client is shared between threads
+        self.thread_safe = api_client_args.thread_safe
+        # per-thread HTTPS connections of a thread safe client, and all of them for closing
+        self._local = threading.local()
+        self._conns = []
+        # guards the shared state: the api_calls log, the fingerprint check and the connections list
+        self._lock = threading.RLock()
+        # ObjectCache of 'show-*' results, or None
+        self.object_cache = api_client_args.object_cache
         # User agent will be use in api call request header
         self.user_agent = api_client_args.user_agent
+        # RetryPolicy for failed requests
+        self.retry_policy = api_client_args.retry_policy if api_client_args.retry_policy \
+            else RetryPolicy.reconnect_once()
+        # TokenBucket limiting the rate of requests, or None
+        self.rate_limiter = api_client_args.rate_limit
+        if self.rate_limiter is not None and not isinstance(self.rate_limiter, TokenBucket):
+            self.rate_limiter = TokenBucket(self.rate_limiter)
+        # Indicates that the session should be logged out when the client exits. Turned off to keep a session
+        # alive for later runs.
+        self.logout_on_exit = True
 
     def __enter__(self):
         return self
@@ -127,11 +217,14 @@ class APIClient:
     def __exit__(self, exc_type, exc_value, traceback):
         """destructor"""
         # if sid is not empty (the login api was called), then call logout
-        if self.sid:
+        if self.sid and self.logout_on_exit:
             self.api_call("logout")
         self.close_connection()
         # save debug data with api calls to disk
         self.save_debug_data()
+        # keep the cached objects for the next run
+        if self.object_cache is not None:
+            self.object_cache.save()
 
     def get_port(self):
         """returns the port of the API client (int)"""
@@ -147,11 +240,58 @@ class APIClient:
 
     def save_debug_data(self):
         """save debug data with api calls to disk"""
-        if self.debug_file:
+        if self.debug_stream is not None:
+            # already written call by call
+            self.debug_stream.flush()
+        elif self.debug_file:
             print("\nSaving data to debug file {}\n".format(self.debug_file), file=sys.stderr)
             out_file = open(self.debug_file, 'w+')
             out_file.write(json.dumps(self.api_calls, indent=4, sort_keys=True))
 
+    @staticmethod
+    def fingerprint_mismatch_message(err):
+        return "Error: Fingerprint value mismatch:\n" + " Expecting : {}\n".format(
+            err.args[1]) + " Got: {}\n".format(
+            err.args[2]) + "If you trust the new fingerprint, edit the 'fingerprints.txt' file."
+
+    def truncate_debug_body(self, body, size=None):
+        """
+        :param body: a request payload or response data
+        :param size: [optional] the length of the body's JSON, when already known
+        :return: the body, or the beginning of its JSON when longer than debug_body_limit
+        """
+        if self.debug_body_limit is None or (size is not None and size <= self.debug_body_limit):
+            return body
+        text = json.dumps(body, sort_keys=True)
+        if len(text) <= self.debug_body_limit:
+            return body
+        return text[:self.debug_body_limit] + "... [{} more characters]".format(len(text) - self.debug_body_limit)
+
+    def write_debug_record(self, url, data, headers, res, cache_hit=False):
+        """write an api call to the debug stream as a single line of JSON"""
+        if res.raw is not None:
+            # left for the caller to decode
+            response_data = "[{} bytes, not decoded]".format(res.size)
+        else:
+            response_data = self.truncate_debug_body(res.data, res.size or None)
+        record = {
+            "request": {
+                "url": url,
+                "payload": self.truncate_debug_body(compatible_loads(data), len(data)),
+                "headers": headers
+            },
+            "response": {
+                "status_code": res.status_code,
+                "data": response_data
+            }
+        }
+        if cache_hit:
+            # answered from the object cache, no request was sent
+            record["cache-hit"] = True
+        line = json.dumps(record, sort_keys=True) + "\n"
+        with self._lock:
+            self.debug_stream.write(line)
+
     def _common_login_logic(self, credentials, continue_last_session, domain, read_only, payload):
         if self.context == "web_api":
             credentials.update({"continue-last-session": continue_last_session,
@@ -210,6 +350,23 @@ class APIClient:
 
         return self._common_login_logic(credentials, continue_last_session, domain, read_only, payload)
 
+    def continue_session(self, sid, api_version=None):
+        """
+        Continue an existing session, e.g. one kept from an earlier run, instead of logging in.
+        The session is validated with a 'keepalive' API call, which also resets its idle timeout.
+
+        :param sid: the session-id to continue
+        :param api_version: [optional] the API version of the session, when known
+        :return: APIResponse object of the 'keepalive' call
+        :side-effects: on success sets the class's sid (and api_version) variables
+        """
+        res = self.api_call("keepalive", {}, sid=sid)
+        if res.success:
+            self.sid = sid
+            if self.api_version is None:
+                self.api_version = api_version
+        return res
+
     def login_as_root(self, domain=None, payload=None):
         """
         This method allows to login into the management server with root permissions.
@@ -220,21 +377,47 @@ class APIClient:
         :param payload: [optional] dict of additional parameters for the login command
         :return: APIResponse object with the relevant details from the login command.
         """
-        python_absolute_path = os.path.expandvars("$MDS_FWDIR/Python/bin/python3")
-        api_get_port_absolute_path = os.path.expandvars("$MDS_FWDIR/scripts/api_get_port.py")
-        mgmt_cli_absolute_path = os.path.expandvars("$CPDIR/bin/mgmt_cli")
-
-        # try to get the management server's port by running a script
+        port = self.get_root_port()
+        login_response = self.mgmt_cli_root_login(port, domain, payload)
+        self.sid = login_response["sid"]
+        self.server = "127.0.0.1"
+        self.domain = domain
+        # the calls of the session go to the port it was made on
+        if port != self.get_port():
+            self.set_port(port)
+        if self.api_version is None:
+            self.api_version = login_response["api-server-version"]
+        return APIResponse(login_response, success=True)
+
+    def get_root_port(self):
+        """
+        :return: the port of the management server this runs on, unless the user set one. It is found by running the
+                 api_get_port.py script once per process, or is the default (443) if that fails.
+        """
         if not self.is_port_default():
-            port = self.get_port()
-        else:
-            try:
-                port = compatible_loads(subprocess.check_output([python_absolute_path,
-                                                                api_get_port_absolute_path, "-f", "json"]))["external_port"]
-            # if can't, default back to what the user wrote or the default (443)
-            except (ValueError, subprocess.CalledProcessError):
-                port = self.get_port()
+            return self.get_port()
+        python_absolute_path = os.path.expandvars(self.python_path)
+        api_get_port_absolute_path = os.path.expandvars(self.api_get_port_path)
+        key = (python_absolute_path, api_get_port_absolute_path)
+        # the lock also keeps concurrent logins from running the script more than once
+        with _root_ports_lock:
+            if key not in _root_ports:
+                # try to get the management server's port by running a script
+                try:
+                    _root_ports[key] = compatible_loads(subprocess.check_output(
+                        [python_absolute_path, api_get_port_absolute_path, "-f", "json"]))["external_port"]
+                # if can't, default back to what the user wrote or the default (443)
+                except (ValueError, subprocess.CalledProcessError, OSError):
+                    return self.get_port()
+            return _root_ports[key]
+
+    def mgmt_cli_root_login(self, port, domain=None, payload=None):
+        """
+        Run a root login with mgmt_cli, without changing the client's session.
 
+        :return: dict with the response of the login command
+        """
+        mgmt_cli_absolute_path = os.path.expandvars(self.mgmt_cli_path)
         try:
             # This simple dict->cli format works only because the login command doesn't require
             # any complex parameters like objects and lists
@@ -244,24 +427,56 @@ class APIClient:
                     new_payload += [key, payload[key]]
             if domain:
                 new_payload += ["domain", domain]
-            login_response = compatible_loads(subprocess.check_output(
+            return compatible_loads(subprocess.check_output(
                 [mgmt_cli_absolute_path, "login", "-r", "true", "-f", "json", "--port", str(port)] + new_payload))
-            self.sid = login_response["sid"]
-            self.server = "127.0.0.1"
-            self.domain = domain
-            if self.api_version is None:
-                self.api_version = login_response["api-server-version"]
-            return APIResponse(login_response, success=True)
         except ValueError as err:
             raise APIClientException(
                 "Could not load JSON from login as root command, perhaps no root privileges?\n" + str(
                     type(err)) + " - " + str(err))
         except subprocess.CalledProcessError as err:
             raise APIClientException("Could not login as root:\n" + str(type(err)) + " - " + str(err))
-        except (WindowsError) as err:
+        except OSError as err:
+            # e.g. mgmt_cli not found, when not run on the management server
             raise APIClientException("Could not login as root:\n" + str(type(err)) + " - " + str(err))
 
-    def api_call(self, command, payload=None, sid=None, wait_for_task=True, timeout=-1):
+    def login_as_root_to_domains(self, domains, max_workers=4, payload=None):
+        """
+        Log into several domains of an MDS with root permissions, see login_as_root.
+        The client logs in as root once at the MDS level (unless it already has a session), and its session logs into
+        every domain with the 'login-to-domain' command, concurrently when the client is thread safe or does not use
+        a single connection. A domain that 'login-to-domain' fails for gets a root login of its own.
+        The client keeps its MDS level session. Use the session of a domain with a client of its own, e.g.
+        APIClient(APIClientArgs(server="127.0.0.1", port=client.get_port(), sid=sid)).
+
+        :param domains: names/uids/IP addresses of the domains
+        :param max_workers: most logins running at the same time
+        :param payload: [optional] dict of additional parameters for the login commands
+        :return: OrderedDict of domain to the APIResponse of its login, with the session's 'sid' in its data
+        """
+        domains = list(domains)
+        if self.sid is None:
+            self.login_as_root(payload=payload)
+
+        def login_to_domain(domain):
+            res = self.api_call("login-to-domain", {"domain": domain})
+            if res.success:
+                return res
+            try:
+                return APIResponse(self.mgmt_cli_root_login(self.get_root_port(), domain, payload), success=True)
+            except APIClientException as err:
+                return APIResponse("", False, err_message=err)
+
+        if max_workers > 1 and len(domains) > 1 and (self.thread_safe or not self.single_conn):
+            from concurrent.futures import ThreadPoolExecutor
+            # make sure the fingerprint is accepted once, before the threads start
+            self.check_fingerprint()
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(login_to_domain, domains))
+        else:
+            results = [login_to_domain(domain) for domain in domains]
+        return collections.OrderedDict(zip(domains, results))
+
+    def api_call(self, command, payload=None, sid=None, wait_for_task=True, timeout=-1, decode=True, idempotent=None):
         """
         performs a web-service API request to the management server
 
@@ -274,12 +489,18 @@ class APIClient:
                               when wait_for_task=False, it is up to the user to call the "show-task" API and check
                               the status of the command.
         :param timeout: Optional positive timeout (in seconds) before stop waiting for the task even if not completed.
+        :param decode: if set to False, the body of the response is kept in the .raw field of the APIResponse and
+                       decoded when its .data is first used, e.g. to decode it in another process. A task the
+                       command started is not waited for.
+        :param idempotent: [optional] the request is safe to send twice, so that it is retried after a timeout, a lost
+                           response or a busy status (see RetryPolicy). Defaults to the command being idempotent
+                           according to the retry policy, e.g. 'show-*'.
         :return: APIResponse object
         :side-effects: updates the class's uid and server variables
         """
         timeout_start = time.time()
-        if self.check_fingerprint() is False:
-            return APIResponse("", False, err_message="Invalid fingerprint")
+        if idempotent is None:
+            idempotent = self.retry_policy.is_idempotent(command)
         if payload is None:
             payload = {}
         # Convert the json payload to a string if needed
@@ -306,66 +527,298 @@ class APIClient:
         if sid is not None:
             _headers["X-chkp-sid"] = sid
 
-        # init https connection. if single connection is True, use last connection
-        conn = self.get_https_connection()
         url = "/" + self.context + "/" + (("v" + str(self.api_version) + "/") if self.api_version else "") + command
+
+        # a 'show-*' of a single object by uid can be answered from the cache, without a request
+        cache_details_level = None
+        if self.object_cache is not None and command.startswith("show-") and isinstance(payload, dict) \
+                and "uid" in payload and set(payload.keys()) <= {"uid", "details-level"}:
+            cache_details_level = payload.get("details-level", "")
+            cached = self.object_cache.get(command, payload["uid"], cache_details_level)
+            if cached is not None:
+                res = APIResponse(cached, True, status_code=200)
+                self.log_api_call(command, url, _data, _headers, res, cache_hit=True)
+                return res
+        if self.check_fingerprint() is False:
+            return APIResponse("", False, err_message="Invalid fingerprint")
+
         response = None
-        try:
-            # Send the data to the server
-            conn.request("POST", url, _data, _headers)
-            # Get the reply from the server
-            response = conn.getresponse()
-            res = APIResponse.from_http_response(response)
-        except ValueError as err:
-            if err.args[0] == "Fingerprint value mismatch":
-                err_message = "Error: Fingerprint value mismatch:\n" + " Expecting : {}\n".format(
-                    err.args[1]) + " Got: {}\n".format(
-                    err.args[2]) + "If you trust the new fingerprint, edit the 'fingerprints.txt' file."
-                res = APIResponse("", False, err_message=err_message)
-            else:
+        attempt = 0
+        deadline = self.deadline
+        # the state of the request when it is one of the two of api_call_hedged
+        hedged = getattr(self._local, "hedged_call", None)
+        while True:
+            attempt += 1
+            remaining = self.call_timeout
+            if deadline is not None:
+                left = deadline - time.time()
+                if left <= 0:
+                    response = None
+                    res = APIResponse("", False, err_message="Deadline exceeded")
+                    break
+                remaining = left if remaining is None else min(remaining, left)
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            # init https connection. if single connection is True, use last connection
+            try:
+                conn = self.get_https_connection(remaining)
+                if not idempotent and self.single_conn and self.connection_dropped(conn):
+                    # the server closed the idle connection: a request sent on it would be lost, and not sent again
+                    self.drop_https_connection(conn)
+                    conn = self.get_https_connection(remaining)
+            except ValueError as err:
+                if err.args[0] != "Fingerprint value mismatch":
+                    raise
+                res = APIResponse("", False, err_message=self.fingerprint_mismatch_message(err))
+                break
+            except Exception as err:
+                if self.retry_policy.is_retryable_exception(err, idempotent, sent=False) \
+                        and self.retry_policy.can_retry(attempt):
+                    self.retry_policy.sleep(attempt, deadline=deadline)
+                    continue
+                raise
+            if hedged is not None and not self.hedged_connection(hedged, conn):
+                if not self.single_conn:
+                    conn.close()
+                res = APIResponse("", False, err_message="Hedged request aborted")
+                break
+            response = None
+            retry_after = None
+            try:
+                # Send the data to the server
+                conn.request("POST", url, _data, _headers)
+                # Get the reply from the server
+                response = conn.getresponse()
+                res = APIResponse.from_http_response(response, decode=decode)
+            except ValueError as err:
+                if err.args[0] == "Fingerprint value mismatch":
+                    res = APIResponse("", False, err_message=self.fingerprint_mismatch_message(err))
+                else:
+                    res = APIResponse("", False, err_message=err)
+            except Exception as err:
                 res = APIResponse("", False, err_message=err)
-        except (http_client.CannotSendRequest, http_client.BadStatusLine, ConnectionAbortedError) as e:
-            self.conn = self.create_https_connection()
-            self.conn.request("POST", url, _data, _headers)
-            response = self.conn.getresponse()
-            res = APIResponse.from_http_response(response)
-        except Exception as err:
-            res = APIResponse("", False, err_message=err)
-        finally:
-            if not self.single_conn:
-                conn.close()
+                if hedged is not None and hedged["aborted"]:
+                    # the other request answered first and shut this connection down
+                    self.drop_https_connection(conn)
+                    res = APIResponse("", False, err_message="Hedged request aborted")
+                    break
+                if self.retry_policy.is_retryable_exception(err, idempotent) and self.retry_policy.can_retry(attempt):
+                    # the connection is broken, the next attempt opens a new one
+                    self.drop_https_connection(conn)
+                    self.retry_policy.sleep(attempt, deadline=deadline)
+                    continue
+                if isinstance(err, socket.timeout):
+                    # a late response would be read as the answer of the next request
+                    self.drop_https_connection(conn)
+            finally:
+                if not self.single_conn:
+                    conn.close()
+
+            if response is not None and self.retry_policy.is_retryable_status(response.status, idempotent) \
+                    and self.retry_policy.can_retry(attempt):
+                try:
+                    retry_after = float(response.getheader("Retry-After"))
+                except (TypeError, ValueError):
+                    pass
+                self.retry_policy.sleep(attempt, retry_after, deadline)
+                continue
+            break
 
         if response:
             res.status_code = response.status
+            if res.success:
+                self.latencies.observe(command, time.time() - timeout_start)
+
+        if self.object_cache is not None:
+            self.update_object_cache(command, payload, res, cache_details_level, decode)
 
+        self.log_api_call(command, url, _data, _headers, res)
+
+        # If we want to wait for the task to end, wait for it
+        if wait_for_task is True and decode and res.success and command != "show-task":
+            if "task-id" in res.data:
+                res = self.__wait_for_task(res.data["task-id"], timeout=(timeout - time.time() + timeout_start))
+            elif "tasks" in res.data:
+                res = self.__wait_for_tasks(res.data["tasks"], timeout=(timeout - time.time() + timeout_start))
+
+        return res
+
+    def update_object_cache(self, command, payload, res, cache_details_level, decode):
+        """keep the response of an api_call in the object cache, or drop the objects the call changed"""
+        if command in ("publish", "discard"):
+            # the changes of the session become everyone's, or are undone
+            self.object_cache.clear()
+        elif not command.startswith("show-"):
+            # the object may have changed even if the response was lost
+            if isinstance(payload, str):
+                payload = compatible_loads(payload)
+            if isinstance(payload, dict) and ("uid" in payload or "name" in payload):
+                self.object_cache.invalidate(payload.get("uid"), payload.get("name"))
+            if decode and isinstance(res.data, dict) and "uid" in res.data:
+                self.object_cache.invalidate(res.data["uid"])
+        elif decode and res.success and isinstance(res.data, dict):
+            if cache_details_level is not None:
+                self.object_cache.put(command, res.data, cache_details_level)
+            elif isinstance(res.data.get("objects"), list):
+                self.object_cache.observe(res.data["objects"])
+
+    def log_api_call(self, command, url, data, headers, res, cache_hit=False):
+        """keep an api call for debugging, in the debug stream or in api_calls"""
+        if not (self.debug_stream is not None or self.debug_file):
+            return
         # When the command is 'login' we'd like to convert the password to "****" so that it
         # would not appear as plaintext in the debug file.
         if command == "login":
-            json_data = compatible_loads(_data)
+            json_data = compatible_loads(data)
             json_data["password"] = "****"
-            _data = json.dumps(json_data)
+            data = json.dumps(json_data)
 
-        if self.debug_file:
+        if self.debug_stream is not None:
+            self.write_debug_record(url, data, headers, res, cache_hit)
+        else:
             # Store the request and the reply (for debug purpose).
             _api_log = {
                 "request": {
                     "url": url,
-                    "payload": compatible_loads(_data),
-                    "headers": _headers
+                    "payload": compatible_loads(data),
+                    "headers": headers
                 },
-                "response": res.response()
+                "response": res.response() if res.raw is None else {"status_code": res.status_code, "data": None}
             }
-            self.api_calls.append(_api_log)
+            if cache_hit:
+                # answered from the object cache, no request was sent
+                _api_log["cache-hit"] = True
+            with self._lock:
+                self.api_calls.append(_api_log)
 
-        # If we want to wait for the task to end, wait for it
-        if wait_for_task is True and res.success and command != "show-task":
-            if "task-id" in res.data:
-                res = self.__wait_for_task(res.data["task-id"], timeout=(timeout - time.time() + timeout_start))
-            elif "tasks" in res.data:
-                res = self.__wait_for_tasks(res.data["tasks"], timeout=(timeout - time.time() + timeout_start))
+    def api_call_hedged(self, command, payload=None, hedge_after=None, **kwargs):
+        """
+        performs a web-service API request, and sends it once more when it takes longer than usual. The response that
+        arrives first is returned. The other request is not sent if it did not start yet, or aborted by shutting down
+        its connection, so that it does not keep its thread waiting for the server.
+        Only requests that are safe to send twice, like the pages of a 'show-*' query, are hedged (see the idempotent
+        argument of api_call), others make a plain api_call.
+        Hedging needs a client that is thread safe or does not use a single connection (see APIClientArgs),
+        other clients make a plain api_call.
 
+        :param command: the command is placed in the URL field
+        :param payload: a JSON object (or a string representing a JSON object) with the command arguments
+        :param hedge_after: [optional] seconds to wait before sending the request again. Defaults to the 95th percentile
+                            of the latest calls of the command, and no request is sent again until 20 were seen.
+        :param kwargs: the other arguments of api_call
+        :return: APIResponse object
+        """
+        if hedge_after is None:
+            hedge_after = self.latencies.percentile(command, 95)
+        idempotent = kwargs.get("idempotent")
+        if idempotent is None:
+            idempotent = self.retry_policy.is_idempotent(command)
+        if hedge_after is None or not idempotent or not (self.thread_safe or not self.single_conn):
+            return self.api_call(command, payload, **kwargs)
+        from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+        with self._lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(max_workers=32)
+        if isinstance(payload, dict):
+            # the caller may change its payload as soon as this returns
+            payload = dict(payload)
+        calls = {}
+
+        def submit():
+            call = {"conn": None, "aborted": False}
+            future = self._hedge_executor.submit(self._hedged_call, call, command, payload, **kwargs)
+            calls[future] = call
+            return future
+
+        first = submit()
+        if wait([first], timeout=hedge_after).done:
+            return first.result()
+        with self._lock:
+            self.hedge_stats["sent"] += 1
+        hedge = submit()
+        pending = [first, hedge]
+        res = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                res = future.result()
+                if res.success:
+                    for other in pending:
+                        other.cancel()
+                        self.abort_hedged_call(calls[other])
+                    if future is hedge:
+                        with self._lock:
+                            self.hedge_stats["won"] += 1
+                    return res
         return res
 
+    def _hedged_call(self, call, command, payload, **kwargs):
+        self._local.hedged_call = call
+        try:
+            return self.api_call(command, payload, **kwargs)
+        finally:
+            self._local.hedged_call = None
+            # the thread's connection serves its next requests, it is not aborted any more
+            with self._lock:
+                call["conn"] = None
+
+    def hedged_connection(self, call, conn):
+        """
+        keep the connection of a request of api_call_hedged, for abort_hedged_call
+        :return: False if the request was aborted and must not be sent
+        """
+        with self._lock:
+            call["conn"] = conn
+            return not call["aborted"]
+
+    def abort_hedged_call(self, call):
+        """abort the slower request of api_call_hedged: a request waiting for its answer fails at once"""
+        with self._lock:
+            call["aborted"] = True
+            conn = call["conn"]
+        sock = getattr(conn, "sock", None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except (OSError, socket.error):
+                pass
+
+    def api_batch(self, calls, max_workers=4, wait_for_task=True, timeout=-1):
+        """
+        performs a batch of web-service API requests, for example a 'show-simple-gateway' for each of a list of
+        gateways, and returns all the responses at once.
+        The calls run concurrently on up to max_workers threads when the client is thread safe (see APIClientArgs)
+        or does not use a single connection, and one after the other otherwise.
+
+        :param calls: list of (command, payload) pairs
+        :param max_workers: most calls running at the same time
+        :param wait_for_task: see api_call
+        :param timeout: see api_call
+        :return: APIBatchResponse object with the responses in the order of the calls
+        """
+        calls = list(calls)
+        batch_start = time.time()
+
+        def run(call):
+            start = time.time()
+            try:
+                res = self.api_call(call[0], call[1], wait_for_task=wait_for_task, timeout=timeout)
+            except Exception as err:
+                # a call failing must not fail the batch
+                res = APIResponse("", False, err_message=err)
+            return res, time.time() - start
+
+        if max_workers > 1 and len(calls) > 1 and (self.thread_safe or not self.single_conn):
+            from concurrent.futures import ThreadPoolExecutor
+            # make sure the fingerprint is accepted once, before the threads start
+            self.check_fingerprint()
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(run, calls))
+        else:
+            results = [run(call) for call in calls]
+        return APIBatchResponse([res for res, _ in results], [duration for _, duration in results],
+                                time.time() - batch_start)
+
     def api_query(self, command, details_level="standard", container_key="objects", include_container_key=False,
                   payload=None):
         """
@@ -398,7 +851,8 @@ class APIClient:
             api_res.data = api_res.data[container_key]
         return api_res
 
-    def gen_api_query(self, command, details_level="standard", container_keys=None, payload=None):
+    def gen_api_query(self, command, details_level="standard", container_keys=None, payload=None, checkpoint=None,
+                      accumulate=True, prefetch=0):
         """
         This is a generator function that yields the list of wanted objects received so far from the management server.
         This is in contrast to normal API calls that return only a limited number of objects.
@@ -409,6 +863,14 @@ class APIClient:
         :param details_level: query APIs always take a details-level argument. Possible values are "standard", "full", "uid"
         :param container_keys: the field in the .data dict that contains the objects
         :param payload: a JSON object (or a string representing a JSON object) with the command arguments
+        :param checkpoint: [optional] PageCheckpoint that saves every received page, so that an interrupted query
+                           resumes from the page it stopped at. If the total number of objects changed in the meantime,
+                           the saved pages are dropped and the query starts over.
+        :param accumulate: if set to False, every yielded APIResponse holds only the objects of its own page, so that
+                           the objects can be processed page by page without keeping all of them in memory
+        :param prefetch: [optional] number of pages requested ahead, concurrently, while the current page is
+                         processed. Used only when the client is thread safe (see APIClientArgs) or does not use a
+                         single connection.
         :yields: an APIResponse object as detailed above
         """
 
@@ -437,9 +899,30 @@ class APIClient:
         else:
             limit = int(payload.get("limit", limit))
             offset = int(payload.get("offset", offset))
+        first_offset = offset
+
+        resumed = False
+        if checkpoint is not None:
+            query = dict(payload, **{"limit": limit, "offset": first_offset, "details-level": details_level})
+            cursor = checkpoint.resume(command, query)
+            if cursor is not None:
+                resumed = True
+                for key in container_keys:
+                    all_objects[key] = list(checkpoint.objects(key))
+                offset = cursor["next-offset"]
+            else:
+                checkpoint.start(command, query)
 
         payload.update({"limit": limit, "offset": iterations * limit + offset, "details-level": details_level})
         api_res = self.api_call(command, payload)
+        if resumed and api_res.success and api_res.data and not checkpoint.is_consistent(api_res.data.get("total")):
+            # objects were added or removed since the pages were saved, their offsets no longer match
+            checkpoint.start(command, query)
+            for key in container_keys:
+                all_objects[key] = []
+            offset = first_offset
+            payload.update({"limit": limit, "offset": offset, "details-level": details_level})
+            api_res = self.api_call(command, payload)
         for container_key in container_keys:
             if not api_res.data or container_key not in api_res.data or not isinstance(api_res.data[container_key], list) \
                     or "total" not in api_res.data or api_res.data["total"] == 0:
@@ -447,33 +930,65 @@ class APIClient:
                 yield api_res
                 break
 
-        # are we done?
-        while not finished:
-            # make the API call, offset should be increased by 'limit' with each iteration
-            if api_res.success is False:
-                raise APIException(api_res.error_message, api_res.data)
-
-            total_objects = api_res.data["total"]  # total number of objects
-            received_objects = api_res.data["to"]  # number of objects we got so far
-            for container_key in container_keys:
-                all_objects[container_key] += api_res.data[container_key]
-                api_res.data[container_key] = all_objects[container_key]
-            # yield the current result
-            yield api_res
-            # did we get all the objects that we're supposed to get
-            if received_objects == total_objects:
-                break
+        executor = None
+        pending = {}  # the requests of the prefetched pages by iteration
+        if prefetch > 0 and not finished and (self.thread_safe or not self.single_conn):
+            from concurrent.futures import ThreadPoolExecutor
+            executor = ThreadPoolExecutor(max_workers=prefetch)
 
-            iterations += 1
-            payload.update({"limit": limit, "offset": iterations * limit + offset, "details-level": details_level})
-            api_res = self.api_call(command, payload)
+        try:
+            # are we done?
+            while not finished:
+                # make the API call, offset should be increased by 'limit' with each iteration
+                if api_res.success is False:
+                    raise APIException(api_res.error_message, api_res.data)
+
+                total_objects = api_res.data["total"]  # total number of objects
+                received_objects = api_res.data["to"]  # number of objects we got so far
+                if executor is not None:
+                    # request the next pages before this one is handed over
+                    for ahead in range(iterations + 1, iterations + prefetch + 1):
+                        ahead_offset = ahead * limit + offset
+                        if ahead not in pending and ahead_offset < total_objects:
+                            pending[ahead] = executor.submit(self.api_call, command,
+                                                             dict(payload, offset=ahead_offset))
+                if checkpoint is not None:
+                    checkpoint.save_page(payload["offset"], received_objects, total_objects,
+                                         dict((key, api_res.data[key]) for key in container_keys))
+                for container_key in container_keys:
+                    if accumulate:
+                        all_objects[container_key] += api_res.data[container_key]
+                        api_res.data[container_key] = all_objects[container_key]
+                    elif all_objects[container_key]:
+                        # the spooled objects of a resumed query come with its first page
+                        api_res.data[container_key] = all_objects[container_key] + api_res.data[container_key]
+                        all_objects[container_key] = []
+                # yield the current result
+                yield api_res
+                # did we get all the objects that we're supposed to get
+                if received_objects == total_objects:
+                    if checkpoint is not None:
+                        checkpoint.clear()
+                    break
+
+                iterations += 1
+                payload.update({"limit": limit, "offset": iterations * limit + offset, "details-level": details_level})
+                if iterations in pending:
+                    api_res = pending.pop(iterations).result()
+                else:
+                    api_res = self.api_call(command, payload)
+        finally:
+            if executor is not None:
+                for future in pending.values():
+                    future.cancel()
+                executor.shutdown(wait=False)
 
     def get_server_fingerprint(self):
         """
         Initiates an HTTPS connection to the server if need and extracts the SHA1 fingerprint from the server's certificate.
         :return: string with SHA1 fingerprint (all uppercase letters)
         """
-        conn = self.get_https_connection()
+        conn = self.get_https_connection(self.call_timeout)
         fingerprint_hash = conn.get_fingerprint_hash()
         if not self.single_conn:
             conn.close()
@@ -579,14 +1094,25 @@ class APIClient:
 
         :return: False if the user does not accept the server certificate, True in all other cases.
         """
-        if self.unsafe:
+        if self.unsafe or self.pinned_fingerprint:
             return True
+        if self.thread_safe:
+            # threads check their own connections, but compare them one at a time, as that may ask the user
+            # and save the file
+            server_fingerprint = self.get_server_fingerprint()
+            with self._lock:
+                return self._check_fingerprint(server_fingerprint)
+        return self._check_fingerprint()
+
+    def _check_fingerprint(self, server_fingerprint=None):
         # Read the fingerprint from the local file
         local_fingerprint = self.read_fingerprint_from_file(self.server)
-        server_fingerprint = self.get_server_fingerprint()
+        if server_fingerprint is None:
+            server_fingerprint = self.get_server_fingerprint()
 
         #Check if fingerprint is passed and matches
         if self.fingerprint == server_fingerprint:
+            self.pinned_fingerprint = server_fingerprint.replace(':', '').upper()
             return True
 
         # If the fingerprint is not stored in the local file
@@ -598,6 +1124,7 @@ class APIClient:
 
             if self.unsafe_auto_accept:
                 self.save_fingerprint_to_file(self.server, server_fingerprint)
+                self.pinned_fingerprint = server_fingerprint.replace(':', '').upper()
                 return True
 
             if local_fingerprint == "":
@@ -617,6 +1144,7 @@ class APIClient:
                 return False
 
         self.fingerprint = server_fingerprint  # set the actual fingerprint in the class instance
+        self.pinned_fingerprint = server_fingerprint.replace(':', '').upper()
         return True
 
     @staticmethod
@@ -644,47 +1172,10 @@ class APIClient:
         :param server: the IP address/name of the Check Point management server.
         :param fingerprint: A SHA1 fingerprint of the server's certificate.
         :param filename: The file in which to store the certificates. The file will hold a JSON structure in which
-                         the key is the server and the value is its fingerprint.
+                         the key is the server and the value is its fingerprint. It is read once, see FingerprintStore.
         :return: 'True' if everything went well. 'False' if there was some kind of error storing the fingerprint.
         """
-        if not fingerprint:
-            return False
-
-        if os.path.isfile(filename):
-            try:
-                with open(filename) as f:
-                    json_dict = json.load(f)
-            except ValueError as e:
-                if e.message == "No JSON object could be decoded":
-                    print("Corrupt JSON file: " + filename, file=sys.stderr)
-                else:
-                    print(e.message, file=sys.stderr)
-                return False
-            except IOError as e:
-                print("Couldn't open file: " + filename + "\n" + get_massage_from_io_error(e), file=sys.stderr)
-                return False
-            except Exception as e:
-                print(e, file=sys.stderr)
-                return False
-            else:
-                if server in json_dict and json_dict[server] == fingerprint:
-                    return True
-                else:
-                    json_dict[server] = fingerprint
-        else:
-            json_dict = {server: fingerprint}
-
-        try:
-            with open(filename, 'w') as filedump:
-                json.dump(json_dict, filedump, indent=4, sort_keys=True)
-                filedump.close()
-            return True
-        except IOError as e:
-            print("Couldn't open file: " + filename + " for writing.\n" + get_massage_from_io_error(e),
-                  file=sys.stderr)
-        except Exception as e:
-            print(e, file=sys.stderr)
-            return False
+        return FingerprintStore.shared(filename).put(server, fingerprint)
 
     @staticmethod
     def read_fingerprint_from_file(server, filename="fingerprints.txt"):
@@ -701,64 +1192,160 @@ class APIClient:
         else:
             assert isinstance(server, (str, unicode))
 
-        if os.path.isfile(filename):
-            try:
-                with open(filename) as f:
-                    json_dict = json.load(f)
-            except ValueError as e:
-                if e.message == "No JSON object could be decoded":
-                    print("Corrupt JSON file: " + filename, file=sys.stderr)
-                else:
-                    print(e.message, file=sys.stderr)
-            except IOError as e:
-                print("Couldn't open file: " + filename + "\n" + get_massage_from_io_error(e),
-                      file=sys.stderr)
-            except Exception as e:
-                print(e, file=sys.stderr)
-            else:
-                # file is ok and readable.
-                if server in json_dict:
-                    return json_dict[server]
-        return ""
-
-    def create_https_connection(self):
-        context = ssl.create_default_context()
-        context.check_hostname = True
+        return FingerprintStore.shared(filename).get(server)
+
+    @staticmethod
+    def create_ssl_context():
+        """
+        The server's certificate is not verified by the SSL context, but by its fingerprint (see check_fingerprint),
+        as management servers usually have self-signed certificates.
+        """
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT if hasattr(ssl, "PROTOCOL_TLS_CLIENT")
+                                 else ssl.PROTOCOL_SSLv23)
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        return context
+
+    def create_https_connection(self, timeout=None):
+        """:param timeout: [optional] socket timeout (in seconds) of the connection"""
+        # one context for all the connections, so that their TLS sessions can be resumed
+        with self._lock:
+            if self.ssl_context is None:
+                self.ssl_context = self.create_ssl_context()
+        kwargs = {"context": self.ssl_context}
+        if timeout is not None:
+            kwargs["timeout"] = timeout
         # create https connection
         if self.proxy_host and self.proxy_port:
-            conn = HTTPSConnection(self.proxy_host, self.proxy_port, context=context)
+            conn = HTTPSConnection(self.proxy_host, self.proxy_port, **kwargs)
             conn.set_tunnel(self.server, self.get_port())
         else:
-            conn = HTTPSConnection(self.server, self.get_port(), context=context)
+            conn = HTTPSConnection(self.server, self.get_port(), **kwargs)
 
-        # Set fingerprint
-        conn.fingerprint = self.fingerprint
+        # Set fingerprint, verified by every connection once it was checked
+        conn.fingerprint = self.pinned_fingerprint
+        # share the TLS sessions and the handshake counters
+        conn.client = self
 
         # Set debug level
         conn.set_debuglevel(self.http_debug_level)
         conn.connect()
         return conn
 
-    def get_https_connection(self):
-        if self.single_conn:
+    def get_https_connection(self, timeout=None):
+        """:param timeout: [optional] socket timeout (in seconds) for the next request of the connection"""
+        if not self.single_conn:
+            return self.create_https_connection(timeout)
+        if self.thread_safe:
+            conn = getattr(self._local, "conn", None)
+            if conn is None:
+                conn = self.create_https_connection(timeout)
+                self._local.conn = conn
+                with self._lock:
+                    self._conns.append(conn)
+        else:
             if self.conn is None:
-                self.conn = self.create_https_connection()
-            return self.conn
-        return self.create_https_connection()
+                self.conn = self.create_https_connection(timeout)
+            conn = self.conn
+        if timeout is not None:
+            conn.set_timeout(timeout)
+        return conn
+
+    @staticmethod
+    def connection_dropped(conn):
+        """:return: True if the server closed an idle connection, which is then readable before a request is sent"""
+        sock = getattr(conn, "sock", None)
+        if sock is None:
+            # connects on the next request
+            return False
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+        except (ValueError, OSError, socket.error):
+            return True
+        return bool(readable)
+
+    def drop_https_connection(self, conn):
+        """close a (broken) connection, so that the next request of the thread opens a new one"""
+        conn.close()
+        if self.thread_safe:
+            if getattr(self._local, "conn", None) is conn:
+                self._local.conn = None
+            with self._lock:
+                if conn in self._conns:
+                    self._conns.remove(conn)
+        elif conn is self.conn:
+            self.conn = None
+
+    def tls_connected(self, sock):
+        """called by every new HTTPS connection after its TLS handshake"""
+        with self._lock:
+            self.tls_stats["handshakes"] += 1
+            if getattr(sock, "session_reused", False):
+                self.tls_stats["resumed"] += 1
+        self.save_tls_session(sock)
+
+    def save_tls_session(self, sock):
+        """keep the TLS session of a connection for the next ones. TLS 1.3 sends it after the handshake."""
+        session = getattr(sock, "session", None)
+        if self.reuse_tls_sessions and session is not None and getattr(session, "has_ticket", True):
+            self.tls_session = session
 
     def close_connection(self):
+        if self._hedge_executor is not None:
+            if sys.version_info >= (3, 9):
+                self._hedge_executor.shutdown(wait=False, cancel_futures=True)
+            else:
+                self._hedge_executor.shutdown(wait=False)
         if self.conn:
             self.conn.close()
+        with self._lock:
+            for conn in self._conns:
+                conn.close()
+            del self._conns[:]
 
 
 class HTTPSConnection(http_client.HTTPSConnection):
     """
     A class for making HTTPS connections that overrides the default HTTPS checks (e.g. not accepting
     self-signed-certificates) and replaces them with a server fingerprint check.
+    The connection resumes the TLS session of its client's earlier connections when possible.
     """
+    fingerprint = None
+    client = None
+
     def connect(self):
         http_client.HTTPConnection.connect(self)
-        self.sock = ssl.wrap_socket(self.sock, self.key_file, self.cert_file, cert_reqs=ssl.CERT_NONE)
+        kwargs = {}
+        if self.client is not None and self.client.tls_session is not None:
+            kwargs["session"] = self.client.tls_session
+        try:
+            self.sock = self._context.wrap_socket(self.sock, **kwargs)
+        except ValueError:
+            if not kwargs:
+                raise
+            # a session that cannot be resumed by this connection
+            self.client.tls_session = None
+            http_client.HTTPConnection.connect(self)
+            self.sock = self._context.wrap_socket(self.sock)
+        if self.client is not None:
+            self.client.tls_connected(self.sock)
+        if self.fingerprint:
+            fingerprint = self.get_fingerprint_hash()
+            if fingerprint != self.fingerprint:
+                self.close()
+                raise ValueError("Fingerprint value mismatch", self.fingerprint, fingerprint)
+
+    def set_timeout(self, timeout):
+        """set the socket timeout of the connection, and of its reconnects"""
+        self.timeout = timeout
+        if self.sock is not None:
+            self.sock.settimeout(timeout)
+
+    def getresponse(self):
+        response = http_client.HTTPSConnection.getresponse(self)
+        if self.client is not None and self.sock is not None:
+            self.client.save_tls_session(self.sock)
+        return response
 
     def get_fingerprint_hash(self):
         if self.sock is None:
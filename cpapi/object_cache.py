@@ -0,0 +1,159 @@
+from __future__ import print_function
+
+import collections
+import copy
+import json
+import os
+import sys
+import threading
+
+from cpapi.utils import get_massage_from_io_error
+
+
+def last_modify_time(obj):
+    """:return: the posix 'last-modify-time' from the object's meta-info, or None"""
+    try:
+        return obj["meta-info"]["last-modify-time"]["posix"]
+    except (KeyError, TypeError):
+        return None
+
+
+class ObjectCache:
+    """
+    A least-recently-used cache of objects returned by 'show-*' API calls, keyed by the object's uid.
+    An entry is valid as long as no newer 'last-modify-time' of the object was seen, e.g. in the objects of
+    a 'show-gateways-and-servers' query given to observe().
+    The entries loaded from the file were not checked against the server by this process: such an entry is used
+    once observe() saw the same 'last-modify-time' of its object, and is a miss before, unless trust_loaded is set.
+    The changes of the client itself are not seen by observe(): the client drops the entries of an object it
+    changes with invalidate(), and all of them with clear() when it publishes or discards.
+    The callers get copies of the cached objects, which they may change.
+    """
+
+    def __init__(self, max_size=1024, filename=None, trust_loaded=False):
+        """
+        :param max_size: most objects kept, the least recently used are dropped first
+        :param filename: [optional] file to load the cache from and save it to, to keep it between runs
+        :param trust_loaded: use the entries loaded from the file even before they were validated by observe(),
+                             they may be stale
+        """
+        self.max_size = max_size
+        self.filename = filename
+        self.trust_loaded = trust_loaded
+        self.entries = collections.OrderedDict()
+        # the latest known last-modify-time of every uid seen in a listing
+        self.modified = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if filename:
+            self.load()
+
+    @staticmethod
+    def key(command, uid, details_level=None):
+        return "|".join([uid, command, details_level or ""])
+
+    def get(self, command, uid, details_level=None):
+        """:return: the cached object, or None on a miss"""
+        key = self.key(command, uid, details_level)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and uid in self.modified:
+                if self.modified[uid] != entry["last-modify-time"]:
+                    # the object changed since it was cached
+                    del self.entries[key]
+                    entry = None
+                else:
+                    entry["validated"] = True
+            if entry is not None and not entry.get("validated") and not self.trust_loaded:
+                # loaded from the file, and not seen since
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            obj = entry["object"]
+        return copy.deepcopy(obj)
+
+    def put(self, command, obj, details_level=None):
+        """Cache an object returned by a 'show-*' command. Objects without a uid are not cached."""
+        uid = obj.get("uid") if isinstance(obj, dict) else None
+        if not uid:
+            return
+        key = self.key(command, uid, details_level)
+        # the caller keeps the object it got, and may change it
+        obj = copy.deepcopy(obj)
+        with self.lock:
+            self.entries[key] = {"object": obj, "last-modify-time": last_modify_time(obj), "validated": True}
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def observe(self, objects):
+        """Learn the current last-modify-time of objects, e.g. of a query, so that stale entries are not used"""
+        with self.lock:
+            for obj in objects:
+                lmt = last_modify_time(obj)
+                if lmt is not None and "uid" in obj:
+                    self.modified[obj["uid"]] = lmt
+
+    def invalidate(self, uid=None, name=None):
+        """Drop the entries of an object, by its uid or its name, e.g. after it was changed or deleted"""
+        with self.lock:
+            for key, entry in list(self.entries.items()):
+                obj = entry["object"]
+                if uid is not None and obj.get("uid") == uid or name is not None and obj.get("name") == name:
+                    del self.entries[key]
+            self.modified.pop(uid, None)
+
+    def clear(self):
+        """Drop all the entries"""
+        with self.lock:
+            self.entries.clear()
+            self.modified.clear()
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def stats(self):
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses, "hit-rate": self.hit_rate}
+
+    def load(self):
+        if not os.path.isfile(self.filename):
+            return
+        try:
+            with open(self.filename) as f:
+                entries = json.load(f)
+        except ValueError:
+            print("Corrupt JSON file: " + self.filename, file=sys.stderr)
+            return
+        except IOError as e:
+            print("Couldn't open file: " + self.filename + "\n" + get_massage_from_io_error(e), file=sys.stderr)
+            return
+        with self.lock:
+            # the file keeps the least recently used first
+            for key, entry in entries:
+                entry["validated"] = False
+                self.entries[key] = entry
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def save(self):
+        if not self.filename:
+            return False
+        with self.lock:
+            entries = [(key, {"object": entry["object"], "last-modify-time": entry["last-modify-time"]})
+                       for key, entry in self.entries.items()]
+        tmp_filename = "%s.%d.tmp" % (self.filename, os.getpid())
+        try:
+            with open(tmp_filename, "w") as f:
+                json.dump(entries, f)
+            os.replace(tmp_filename, self.filename)
+            return True
+        except (IOError, OSError) as e:
+            print("Couldn't open file: " + self.filename + " for writing.\n" + get_massage_from_io_error(e),
+                  file=sys.stderr)
+            return False
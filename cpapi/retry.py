@@ -0,0 +1,167 @@
+import collections
+import random
+import socket
+import ssl
+import sys
+import threading
+import time
+
+if sys.version_info >= (3, 0):
+    import http.client as http_client
+else:
+    import httplib as http_client
+
+
+class RetryPolicy:
+    """
+    This class decides which failed API requests are sent again, and how long to wait before each attempt.
+    Waiting uses exponential backoff with "full jitter": a random delay between 0 and
+    min(backoff_max, backoff_base * 2 ** attempt) seconds, so that parallel clients do not retry in lockstep.
+    A request that may have reached the server (a timeout, a lost response, a busy status) is sent again only when
+    its command is idempotent, e.g. 'show-*': a change like 'add-host' or 'publish' could be made twice. Other
+    commands are retried only when they failed before they were sent.
+    """
+
+    # statuses the management server answers with when it is busy or restarting
+    RETRY_STATUSES = (429, 502, 503, 504)
+    # connections reset, refused or aborted, timeouts and broken HTTP connections (CannotSendRequest, BadStatusLine,
+    # ...). Not any OSError: a missing file or a failed certificate check fails the same way when it is retried.
+    RETRY_EXCEPTIONS = (ConnectionError if sys.version_info >= (3, 0) else socket.error, socket.timeout,
+                        http_client.HTTPException)
+    # failures of sending a request before any of it reached the server, retried whatever the command
+    PRE_SEND_EXCEPTIONS = (http_client.CannotSendRequest,
+                           ConnectionRefusedError if sys.version_info >= (3, 0) else socket.error)
+    # the commands, besides 'show-*', that are safe to send twice
+    IDEMPOTENT_COMMANDS = ("login", "login-to-domain", "keepalive", "where-used")
+
+    def __init__(self, max_attempts=5, backoff_base=0.5, backoff_max=30.0, jitter=True,
+                 retry_statuses=RETRY_STATUSES, retry_exceptions=RETRY_EXCEPTIONS,
+                 idempotent_commands=IDEMPOTENT_COMMANDS):
+        """
+        :param max_attempts: total number of attempts of a request, including the first one
+        :param backoff_base: delay (in seconds) before the first retry, doubled with every retry
+        :param backoff_max: upper bound (in seconds) of a single delay
+        :param jitter: randomize the delays
+        :param retry_statuses: HTTP statuses that are retried
+        :param retry_exceptions: exception types that are retried
+        :param idempotent_commands: the commands, besides 'show-*', that are safe to send twice
+        """
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+        self.retry_statuses = frozenset(retry_statuses)
+        self.retry_exceptions = tuple(retry_exceptions)
+        self.idempotent_commands = frozenset(idempotent_commands)
+
+    @classmethod
+    def reconnect_once(cls):
+        """The client's default: reconnect and send the request once more when the connection broke"""
+        return cls(max_attempts=2, backoff_base=0, retry_statuses=(),
+                   retry_exceptions=(http_client.CannotSendRequest, http_client.BadStatusLine, ConnectionAbortedError))
+
+    def can_retry(self, attempt):
+        """:param attempt: number of attempts made so far"""
+        return attempt < self.max_attempts
+
+    def is_idempotent(self, command):
+        return command.startswith("show-") or command in self.idempotent_commands
+
+    def is_retryable_status(self, status, idempotent=True):
+        """:param idempotent: the request is safe to send twice, see is_idempotent"""
+        return idempotent and status in self.retry_statuses
+
+    def is_retryable_exception(self, err, idempotent=True, sent=True):
+        """
+        :param idempotent: the request is safe to send twice, see is_idempotent
+        :param sent: the request may have reached the server, i.e. it failed after the connection was made
+        """
+        # TLS errors are not retried, whatever they derive from
+        if not isinstance(err, self.retry_exceptions) or isinstance(err, ssl.SSLError):
+            return False
+        return idempotent or not sent or isinstance(err, self.PRE_SEND_EXCEPTIONS)
+
+    def delay(self, attempt, retry_after=None):
+        """
+        :param attempt: number of attempts made so far
+        :param retry_after: [optional] the server's Retry-After value in seconds, used as the lower bound
+        :return: number of seconds to wait before the next attempt
+        """
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        if retry_after is not None:
+            delay = max(delay, min(self.backoff_max, retry_after))
+        return delay
+
+    def sleep(self, attempt, retry_after=None, deadline=None):
+        """:param deadline: [optional] time (as time.time()) the delay does not go past"""
+        delay = self.delay(attempt, retry_after)
+        if deadline is not None:
+            delay = min(delay, deadline - time.time())
+        if delay > 0:
+            time.sleep(delay)
+
+
+class TokenBucket:
+    """
+    Client side rate limit. Every request takes a token, tokens are added at a constant rate
+    up to the bucket's capacity, which allows for short bursts. Safe to share between threads.
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: number of requests per second
+        :param capacity: [optional] largest burst, defaults to one second's worth of requests
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity else max(1.0, rate))
+        self.tokens = self.capacity
+        self.timestamp = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, waiting for one if the bucket is empty"""
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.capacity, self.tokens + (now - self.timestamp) * self.rate)
+            self.timestamp = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class LatencyTracker:
+    """
+    Durations of the latest successful requests of every command, to tell a slow request from a usual one,
+    e.g. to send a hedged request (see APIClient.api_call_hedged). Safe to share between threads.
+    """
+
+    def __init__(self, size=100, min_samples=20):
+        """
+        :param size: number of latest durations kept of every command
+        :param min_samples: fewest durations a percentile is computed from
+        """
+        self.size = size
+        self.min_samples = min_samples
+        self.durations = {}
+        self.lock = threading.Lock()
+
+    def observe(self, command, duration):
+        with self.lock:
+            durations = self.durations.get(command)
+            if durations is None:
+                durations = self.durations[command] = collections.deque(maxlen=self.size)
+            durations.append(duration)
+
+    def percentile(self, command, percent):
+        """:return: the duration (in seconds) percent of the latest requests of the command took at most,
+                    or None while fewer than min_samples were seen"""
+        with self.lock:
+            durations = sorted(self.durations.get(command, ()))
+        if len(durations) < self.min_samples:
+            return None
+        return durations[min(len(durations) - 1, int(len(durations) * percent / 100.0))]
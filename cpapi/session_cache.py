@@ -0,0 +1,101 @@
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import sys
+import time
+
+from cpapi.utils import file_lock, get_massage_from_io_error
+
+
+class SessionCache:
+    """
+    Keeps management API sessions on disk, so that later runs can continue a session instead of logging in again.
+    The cache file holds a JSON structure in which the key identifies the server, the login identity and the domain,
+    and the value holds the session-id, the API version and the time the session expires.
+    The file holds session-ids, so it is created readable and writable by its owner only.
+    Changes are made under a lock of the file (see file_lock), so that parallel runs do not lose each other's sessions.
+    """
+
+    def __init__(self, filename=None):
+        """
+        :param filename: [optional] the cache file, defaults to ~/.cpapi_sessions.json
+        """
+        self.filename = filename if filename else os.path.join(os.path.expanduser("~"), ".cpapi_sessions.json")
+
+    @staticmethod
+    def key(server, port=None, username=None, api_key=None, domain=None, read_only=False):
+        """
+        :return: the cache key of a login. An API key is only kept as its SHA256 digest.
+        """
+        if api_key:
+            identity = "api-key:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+        else:
+            identity = "user:" + (username or "")
+        return "|".join([server, str(port or 443), identity, domain or "", "ro" if read_only else "rw"])
+
+    def load(self):
+        if not os.path.isfile(self.filename):
+            return {}
+        try:
+            with open(self.filename) as f:
+                return json.load(f)
+        except ValueError:
+            print("Corrupt JSON file: " + self.filename, file=sys.stderr)
+        except IOError as e:
+            print("Couldn't open file: " + self.filename + "\n" + get_massage_from_io_error(e), file=sys.stderr)
+        return {}
+
+    def save(self, sessions):
+        tmp_filename = "%s.%d.tmp" % (self.filename, os.getpid())
+        try:
+            fd = os.open(tmp_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump(sessions, f, indent=4, sort_keys=True)
+            os.replace(tmp_filename, self.filename)
+            return True
+        except (IOError, OSError) as e:
+            print("Couldn't open file: " + self.filename + " for writing.\n" + get_massage_from_io_error(e),
+                  file=sys.stderr)
+            return False
+
+    def get(self, key):
+        """
+        :return: the cached session (dict with "sid", "server", "api-version" and "expires") or None when there is no
+                 session for the key or it has already expired.
+        """
+        session = self.load().get(key)
+        if session and session.get("expires", 0) > time.time():
+            return session
+        return None
+
+    def put(self, key, sid, server, api_version=None, session_timeout=600):
+        """
+        Store a session. The session timeout is an idle timeout, so put is called again after the session was used.
+
+        :param session_timeout: the "session-timeout" of the login response, in seconds
+        """
+        try:
+            with file_lock(self.filename):
+                sessions = self.load()
+                now = time.time()
+                # drop what has expired on the way
+                sessions = dict((k, v) for k, v in sessions.items() if v.get("expires", 0) > now)
+                sessions[key] = {"sid": sid, "server": server, "api-version": api_version,
+                                 "session-timeout": session_timeout, "expires": now + session_timeout}
+                return self.save(sessions)
+        except (IOError, OSError) as e:
+            print("Couldn't lock file: " + self.filename + "\n" + get_massage_from_io_error(e), file=sys.stderr)
+            return False
+
+    def remove(self, key):
+        try:
+            with file_lock(self.filename):
+                sessions = self.load()
+                if sessions.pop(key, None) is not None:
+                    return self.save(sessions)
+                return True
+        except (IOError, OSError) as e:
+            print("Couldn't lock file: " + self.filename + "\n" + get_massage_from_io_error(e), file=sys.stderr)
+            return False
@@ -1,6 +1,13 @@
+import contextlib
 import json
 import sys
 
+try:
+    import fcntl
+except ImportError:
+    # no file locking (Windows): the writes are still atomic, but concurrent writers may lose entries
+    fcntl = None
+
 
 def compatible_loads(json_data):
     """
@@ -22,3 +29,21 @@ def get_massage_from_io_error(error):
         return error.strerror
     else:
         return error.message
+
+
+@contextlib.contextmanager
+def file_lock(filename):
+    """
+    Hold an exclusive lock for a file that is replaced atomically, to read, change and replace it without losing
+    the changes of other processes. The lock is taken on a sidecar "<filename>.lock" file, which is kept, as the
+    file itself changes with every replace.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(filename + ".lock", "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
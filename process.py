@@ -1,14 +1,16 @@
 #!/usr/bin/python3
-import fnmatch
-import getpass
+import argparse
+import io
 import json
+import os
 import sys
-import threading
 import time
 from enum import Enum
+from typing import NamedTuple, Optional, Tuple
 
 # cpapi is a library that handles the communication with the Check Point management server.
-from cpapi import APIClient, APIClientArgs
+# Its modules (ssl, http.client, ...) are imported on first use, so offline runs never load them.
+import cpapi
 
 
 class cp_host(Enum):
@@ -31,66 +33,220 @@ class bcolors:
     UNDERLINE = '\033[4m'
 
 
-class Spinner:
-    busy = False
-    delay = 0.1
-
-    @staticmethod
-    def spinning_cursor():
-        while 1:
-            for cursor in '|/-\\':
-                yield cursor
-
-    def __init__(self, delay=None):
-        self.spinner_generator = self.spinning_cursor()
-        if delay and float(delay): self.delay = delay
-
-    def spinner_task(self):
-        while self.busy:
-            sys.stdout.write(next(self.spinner_generator))
-            sys.stdout.flush()
-            time.sleep(self.delay)
-            sys.stdout.write('\b')
-            sys.stdout.flush()
-
-    def __enter__(self):
-        self.busy = True
-        threading.Thread(target=self.spinner_task).start()
-
-    def __exit__(self, exception, value, tb):
-        self.busy = False
-        time.sleep(self.delay)
-        if exception is not None:
-            return False
+class Progress:
+    """
+    Progress of a paginated API call, fed with the 'to'/'total' of every page.
+    Reports objects per second, bytes received and ETA on a single line, at most once per interval.
+    Nothing runs in the background, and nothing is written when stdout is not a TTY.
+    """
+    def __init__(self, done=0, interval=0.5, stream=None, enabled=None):
+        """
+        :param done: number of objects already received, e.g. by a resumed run
+        """
+        self.stream = stream if stream is not None else sys.stdout
+        self.enabled = self.stream.isatty() if enabled is None else enabled
+        self.interval = interval
+        self.start = time.time()
+        self.last = 0.0
+        self.first = done
+        self.done = done
+        self.total = 0
+        self.bytes = 0
+        self.updated = False
+
+    def update(self, done, total, nbytes=0):
+        """
+        :param done: number of objects received so far (the 'to' of the page)
+        :param total: total number of objects (the 'total' of the page)
+        :param nbytes: size of the page
+        """
+        self.updated = True
+        self.done = done
+        self.total = total
+        self.bytes += nbytes
+        if not self.enabled:
+            return
+        now = time.time()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.write(now)
+
+    def write(self, now):
+        elapsed = max(now - self.start, 1e-6)
+        rate = (self.done - self.first) / elapsed
+        eta = (self.total - self.done) / rate if rate > 0 else 0
+        self.stream.write(
+            f"\r  {self.done}/{self.total} objects  {rate:.0f} obj/s  {self.bytes / 1048576:.1f} MB  \
+ETA {int(eta) // 60}:{int(eta) % 60:02d} ")
+        self.stream.flush()
+
+    def finish(self):
+        if self.enabled and self.updated:
+            self.write(time.time())
+            self.stream.write('\n')
+            self.stream.flush()
+
 
 cp_version = {'1.7': 'R81', '1.6.1': 'R80.40 JHF Take 78', '1.6': 'R80.40', '1.5': 'R80.30', \
   '1.4': 'R80.20.M2', '1.3': 'R80.20', '1.2': 'R80.20.M1', '1.1': 'R80.10', '1': 'R80'}
 
 
-def cp_api_call(api_call, api_call_parameters, session_ro=False) -> dict:
-    # getting details from the user
-    api_server = input("Enter server IPv4 address/hostname/FQDN: ")
-    username = input(
-        "Enter username or press <Enter> for API-KEY (MDS/SMS R80.40+): ")
+class Credentials(NamedTuple):
+    """Where and how to log in, either given on the command line/environment or entered by the user"""
+    server: str
+    username: str = ""
+    password: str = ""
+    api_key: str = ""
+    domain: Optional[str] = None
+    port: Optional[int] = None
+    fingerprint: Optional[str] = None
+    unsafe_auto_accept: bool = False
+
+
+def get_credentials(args=None) -> Credentials:
+    """
+    Build the login credentials from the parsed arguments, prompting only for the values that are missing.
+    :param args: argparse namespace of process.py, when omitted everything is prompted for
+    """
+    api_server = getattr(args, 'management', None) or ""
+    username = getattr(args, 'user', None)
+    password = getattr(args, 'password', None) or ""
     api_key = ""
-    password = ""
-    if sys.stdin.isatty():
-        if username != "":
-            password = getpass.getpass("Enter password: ")
-        else:
-            api_key = getpass.getpass("Paste your API Key: ")
-    else:
+    api_key_file = getattr(args, 'api_key_file', None)
+    if api_key_file:
+        try:
+            with open(api_key_file, 'r') as f:
+                api_key = f.read().strip()
+        except OSError as e:
+            print(
+                f"{bcolors.FAIL}[-] Error reading API key file {api_key_file}\n{e}{bcolors.ENDC}"
+            )
+            exit(1)
+        username = ""
+    import getpass
+    try:
+        # getting the missing details from the user
+        if api_server == "":
+            api_server = input("Enter server IPv4 address/hostname/FQDN: ")
+        if username is None:
+            username = input(
+                "Enter username or press <Enter> for API-KEY (MDS/SMS R80.40+): ")
+        if (username != "" and password == "") or (username == ""
+                                                    and api_key == ""):
+            if sys.stdin.isatty():
+                if username != "":
+                    password = getpass.getpass("Enter password: ")
+                else:
+                    api_key = getpass.getpass("Paste your API Key: ")
+            else:
+                print(
+                    f"{bcolors.WARNING}***Attention*** Your input will be shown on the screen!{bcolors.ENDC}"
+                )
+                if username != "":
+                    password = input("Enter password: ")
+                else:
+                    api_key = input("Paste your API Key: ")
+    except EOFError:
         print(
-            f"{bcolors.WARNING}***Attention*** Your input will be shown on the screen!{bcolors.ENDC}"
+            f"{bcolors.FAIL}[-] Missing credentials and no input available - use --management, --user and --password \
+or --api-key-file, or set MGMT_CLI_MANAGEMENT, MGMT_CLI_USER and MGMT_CLI_PASSWORD{bcolors.ENDC}"
         )
-        if username != "":
-            password = input("Enter password: ")
+        exit(1)
+    port = getattr(args, 'port', None)
+    return Credentials(server=api_server,
+                       username=username,
+                       password=password,
+                       api_key=api_key,
+                       domain=getattr(args, 'domain', None),
+                       port=int(port) if port else None,
+                       fingerprint=getattr(args, 'fingerprint', None),
+                       unsafe_auto_accept=getattr(args, 'unsafe_auto_accept',
+                                                  False))
+
+
+def login(client, credentials, session_ro=False, session_cache=None):
+    """
+    Log in to the management server. With a session cache, a still valid session of an earlier run
+    is continued instead, and the session is kept alive for the next run rather than logged out.
+    """
+    cache_key = None
+    cp_api_version = None
+    if session_cache is not None:
+        cache_key = session_cache.key(credentials.server, credentials.port,
+                                      credentials.username,
+                                      credentials.api_key,
+                                      credentials.domain, session_ro)
+        session = session_cache.get(cache_key)
+        if session is not None:
+            if client.continue_session(session['sid'],
+                                       session['api-version']).success:
+                cp_api_version = session['api-version']
+                print(f"{bcolors.OKGREEN}[+] API session continued")
+            else:
+                session_cache.remove(cache_key)
+
+    if cp_api_version is None:
+        if credentials.api_key == "":
+            login_res = client.login(credentials.username,
+                                     credentials.password,
+                                     domain=credentials.domain,
+                                     read_only=session_ro)
         else:
-            api_key = input("Paste your API Key: ")
+            login_res = client.login_with_api_key(credentials.api_key,
+                                                  domain=credentials.domain,
+                                                  read_only=session_ro)
 
-    client_args = APIClientArgs(server=api_server)
+        if login_res.success is False:
+            print(
+                f"{bcolors.FAIL}[-] API login failed:\n{login_res.error_message}{bcolors.ENDC}"
+            )
+            exit(1)
+        print(f"{bcolors.OKGREEN}[+] API login successful")
+        cp_api_version = login_res.data['api-server-version']
+        if session_cache is not None:
+            session_cache.put(cache_key, client.sid, credentials.server,
+                              cp_api_version,
+                              login_res.data.get('session-timeout', 600))
 
-    with APIClient(client_args) as client:
+    if session_cache is not None:
+        client.logout_on_exit = False
+    print(f"  \_API Version: {cp_api_version}{bcolors.ENDC}")
+    if cp_api_version in cp_version:
+        print(
+            f"{bcolors.OKGREEN}  \_Version: {cp_version[cp_api_version]}{bcolors.ENDC}"
+        )
+    return cache_key
+
+
+def cp_api_call(api_call, api_call_parameters, session_ro=False, credentials=None,
+                session_cache=None, retries=5, rate_limit=None,
+                checkpoint=None, counter=None, jobs=1, timeout=None,
+                deadline=None, hedge=False, export=None, pool=None) -> dict:
+    """
+    Get all the pages of a query.
+    With a counter, the objects are counted into it and not returned. More than one job (given a counter)
+    fetches, decodes and counts the pages in a pipeline, see cp_api_pipeline.
+    timeout limits every request and deadline all of them (in seconds). With hedge, a page that takes
+    longer than usual is requested once more, see APIClient.api_call_hedged.
+    With an export (ObjectExport), the objects of every page are also written to it as they arrive.
+    pool is the process pool of the pipeline, see start_decode_pool.
+    """
+    if credentials is None:
+        credentials = get_credentials()
+    api_key = credentials.api_key
+
+    client_args = cpapi.APIClientArgs(
+        server=credentials.server,
+        port=credentials.port,
+        fingerprint=credentials.fingerprint,
+        unsafe_auto_accept=credentials.unsafe_auto_accept,
+        retry_policy=cpapi.RetryPolicy(max_attempts=retries + 1),
+        rate_limit=rate_limit,
+        thread_safe=jobs > 1 or hedge,
+        call_timeout=timeout,
+        run_timeout=deadline)
+
+    with cpapi.APIClient(client_args) as client:
         # create debug file. The debug file will hold all the communication between the python script and
         # Check Point's management server.
         #client.debug_file = "api_calls.json"
@@ -98,140 +254,1092 @@ def cp_api_call(api_call, api_call_parameters, session_ro=False) -> dict:
         # The API client, would look for the server's certificate SHA1 fingerprint in a file.
         # If the fingerprint is not found on the file, it will ask the user if he accepts the server's fingerprint.
         # In case the user does not accept the fingerprint, exit the program.
-        if client.check_fingerprint() is False:
+        try:
+            fingerprint_ok = client.check_fingerprint()
+        except EOFError:
+            # non-interactive run with an unknown fingerprint
             print(
-                f"{bcolors.FAIL}Could not get the server's fingerprint - Check connectivity with the server.{bcolors.ENDC}"
+                f"{bcolors.FAIL}The server's fingerprint is unknown - pass --fingerprint or --unsafe-auto-accept \
+when running without input.{bcolors.ENDC}"
             )
             exit(1)
-
-        # login to server:
-        if api_key == "":
-            login_res = client.login(username, password, read_only=session_ro)
-        else:
-            login_res = client.login_with_api_key(api_key,
-                                                  read_only=session_ro)
-
-        if login_res.success is False:
+        if fingerprint_ok is False:
             print(
-                f"{bcolors.FAIL}[-] API login failed:\n{login_res.error_message}{bcolors.ENDC}"
+                f"{bcolors.FAIL}Could not get the server's fingerprint - Check connectivity with the server.{bcolors.ENDC}"
             )
             exit(1)
-        else:
-            print(f"{bcolors.OKGREEN}[+] API login successful")
-            cp_api_version = login_res.data['api-server-version']
-            print(f"  \_API Version: {cp_api_version}{bcolors.ENDC}")
-            if cp_api_version in cp_version:
-                print(
-                    f"{bcolors.OKGREEN}  \_Version: {cp_version[cp_api_version]}{bcolors.ENDC}"
-                )
+
+        cache_key = login(client, credentials, session_ro, session_cache)
+        if export is not None:
+            export.manifest.update({'server': credentials.server,
+                                    'port': credentials.port,
+                                    'domain': credentials.domain,
+                                    'api-version': client.api_version})
 
         # Execute the API call and loop over all results pages
         print(
             f"{bcolors.OKGREEN}[+] API call execution in progress, patience grasshopper ..."
         )
+        if counter is not None and jobs > 1 and checkpoint is None:
+            dict_res = cp_api_pipeline(client, api_call, api_call_parameters,
+                                       counter, jobs, hedge, export, pool)
+            refresh_session(client, credentials, session_cache, cache_key)
+            return dict_res
         total = -1
         dict_res = {}
-        offset = api_call_parameters['offset']
-        with Spinner():
-            while total != offset:
-                api_call_parameters['offset'] = offset
-                tmp_res = client.api_call(api_call, api_call_parameters)
-                if tmp_res.success is False:
+        objects = []
+        first_offset = offset = api_call_parameters['offset']
+        resumed = False
+        if checkpoint is not None:
+            cursor = checkpoint.resume(api_call, api_call_parameters)
+            if cursor is None:
+                checkpoint.start(api_call, api_call_parameters)
+            else:
+                resumed = True
+                offset = cursor['next-offset']
+                objects = list(checkpoint.objects())
+                if export is not None:
+                    export.write_objects(objects)
+                print(
+                    f"{bcolors.OKGREEN}[+] Resuming from checkpoint at {offset}/{cursor['total']}{bcolors.ENDC}"
+                )
+        progress = Progress(offset)
+        fetch = client.api_call_hedged if hedge else client.api_call
+        while total != offset:
+            api_call_parameters['offset'] = offset
+            tmp_res = fetch(api_call, api_call_parameters)
+            if tmp_res.success is False:
+                progress.finish()
+                print(
+                    f"{bcolors.FAIL}[-] Failed to get the anwer:\n{tmp_res.error_message}{bcolors.ENDC}"
+                )
+                if checkpoint is not None:
                     print(
-                        f"{bcolors.FAIL}[-] Failed to get the anwer:\n{tmp_res.error_message}{bcolors.ENDC}"
+                        f"{bcolors.FAIL}  \_Fetched pages are kept in {checkpoint.directory}, run again to resume{bcolors.ENDC}"
                     )
-                    exit(1)
-                if total == -1:
-                    dict_res = tmp_res.data
-                else:
-                    for key, value in dict_res.items():
-                        if key == 'objects':
-                            value.extend(tmp_res.data[key])
-                        else:
-                            value = tmp_res.data[key]
-                offset = tmp_res.data['to']
-                total = tmp_res.data['total']
+                exit(1)
+            if resumed:
+                resumed = False
+                if not checkpoint.is_consistent(tmp_res.data['total']):
+                    print(
+                        f"{bcolors.WARNING}[!] Total changed since the checkpoint, starting over{bcolors.ENDC}"
+                    )
+                    checkpoint.start(api_call, api_call_parameters)
+                    objects = []
+                    if export is not None:
+                        export.restart()
+                    offset = first_offset
+                    progress = Progress(offset)
+                    continue
+            if checkpoint is not None:
+                checkpoint.save_page(offset, tmp_res.data['to'],
+                                     tmp_res.data['total'],
+                                     {'objects': tmp_res.data['objects']})
+            if export is not None:
+                export.write_objects(tmp_res.data['objects'])
+            objects.extend(tmp_res.data['objects'])
+            dict_res = tmp_res.data
+            offset = tmp_res.data['to']
+            total = tmp_res.data['total']
+            progress.update(offset, total, tmp_res.size)
+        progress.finish()
+        dict_res['objects'] = objects
+        if checkpoint is not None:
+            checkpoint.clear()
+        refresh_session(client, credentials, session_cache, cache_key)
+    if counter is not None:
+        try:
+            counter.update(dict_res['objects'])
+        except (KeyError, TypeError, AttributeError) as e:
+            print(
+                f"{bcolors.FAIL}[-] Function: process_licensing - Failed parsing JSON file\n  \_{e}{bcolors.ENDC}"
+            )
+            exit(1)
+        dict_res['objects'] = []
     return dict_res
 
 
-def process_licensing(tmp_dict):
-    data_raw = tmp_dict
-    dict_results = {}
+def refresh_session(client, credentials, session_cache, cache_key):
+    if session_cache is not None:
+        # the session timeout counts from the last call
+        session = session_cache.get(cache_key)
+        if session is not None:
+            session_cache.put(cache_key, client.sid, credentials.server,
+                              session['api-version'],
+                              session['session-timeout'])
+
+
+def decode_page(body, export=False):
+    """
+    Process pool worker: decode a page of gateways-and-servers and reduce its objects to their license entries.
+    With export, the objects are also compressed for ObjectExport.write.
+    :return: to, total, the license entries, the compressed objects and the seconds it took
+    """
+    start = time.perf_counter()
+    data = json.loads(body)
+    compressed = ObjectExport.compress(data['objects']) if export else None
+    return (data['to'], data['total'], [license_entry(obj) for obj in data['objects']], compressed,
+            time.perf_counter() - start)
+
+
+def pool_phase(name, seconds):
+    """Time a worker process spent in a phase, e.g. decoding a page, replaced by the Profiler's"""
+
+
+def start_decode_pool(jobs):
+    """
+    The process pool of cp_api_pipeline. Its workers are forked at once, so start it before any thread:
+    a thread holding a lock (ssl, queue) while forking may deadlock the child, and Python 3.12+ warns.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    pool = ProcessPoolExecutor(max_workers=jobs)
+    pool.submit(int).result()
+    return pool
+
+
+def cp_api_pipeline(client, api_call, api_call_parameters, counter, jobs,
+                    hedge=False, export=None, pool=None) -> dict:
+    """
+    Fetch all the pages of a query in stages that overlap, counting the objects into counter.
+    jobs threads fetch the raw pages, a pool of jobs processes decodes them, and this thread counts
+    them in page order. At most jobs * 2 pages are in flight: the fetchers wait for the counting.
+    With hedge, a page that takes longer than usual is requested once more.
+    With an export, the pool also compresses the pages, which are written to it in page order.
+    The pool (see start_decode_pool) is started here unless given, and left running if it was given.
+    """
+    import queue
+    import threading
+
+    # the first page is fetched alone, for the total
+    first = client.api_call(api_call, dict(api_call_parameters))
+    if first.success is False:
+        print(
+            f"{bcolors.FAIL}[-] Failed to get the anwer:\n{first.error_message}{bcolors.ENDC}"
+        )
+        exit(1)
+    dict_res = first.data
+    total = dict_res['total']
     try:
-        for key in data_raw['objects']:
-            obj_domain_name = key['domain']['name']
-            obj_type = key['type']
-            obj_name = key['name']
-            # Instantiate dicts for Domain, MDS, VS, HA, and Single GW
-            if obj_domain_name not in dict_results:
-                dict_results[obj_domain_name] = {}
-                for mds in ['OnMDSPrimary', 'OnMDSStandby']:
-                    dict_results[obj_domain_name][mds] = False
-                dict_results[obj_domain_name]['CountTotal'] = 0
-                for gw in ['VS', 'HA', 'GW']:
-                    dict_results[obj_domain_name][gw] = {}
-                    dict_results[obj_domain_name][gw]['Members'] = []
-                    dict_results[obj_domain_name][gw]['Count'] = 0
-            # Mark CMA availability for Primary and Standby MDS
-            if 'management-blades' in key and 'network-policy-management' in key[
-                    'management-blades']:
-                dict_results[obj_domain_name]['OnMDSPrimary'] = True
-                dict_results[obj_domain_name][
-                    'OnMDSStandby'] = True if 'secondary' in key[
-                        'management-blades'] else False
-            # Go over all GWs and add to the dict
-            if 'network-security-blades' in key:
-                obj_gw_blades = key['network-security-blades']
-                if "firewall" in obj_gw_blades and obj_gw_blades[
-                        'firewall'] == True:
-                    cluster_members = key['cluster-member-names'] if 'cluster-member-names' in key else []
-                    # Go over VS GW
-                    if obj_type == cp_host.vs.value:
-                        if len(fnmatch.filter(cluster_members,
-                                              '*_' + obj_name)) > 0:
-                            dict_results[obj_domain_name]['VS'][
-                                'Members'] += cluster_members
-                            dict_results[obj_domain_name]['VS'][
-                                'Count'] += len(cluster_members)
-                            dict_results[obj_domain_name]['CountTotal'] += len(
-                                cluster_members)
-                    # Go over HA GW Cluster
-                    elif obj_type == cp_host.ha.value:
-                        dict_results[obj_domain_name]['HA'][
-                            'Members'] += cluster_members
-                        dict_results[obj_domain_name]['HA']['Count'] += len(
-                            cluster_members)
-                        dict_results[obj_domain_name]['CountTotal'] += len(
-                            cluster_members)
-                    # Go over Single GW
-                    elif obj_type == cp_host.single.value:
-                        dict_results[obj_domain_name]['GW']['Members'] += [
-                            obj_name
-                        ]
-                        dict_results[obj_domain_name]['GW']['Count'] += 1
-                        dict_results[obj_domain_name]['CountTotal'] += 1
-    except Exception as e:
+        counter.update(dict_res['objects'])
+    except (KeyError, TypeError, AttributeError) as e:
+        print(
+            f"{bcolors.FAIL}[-] Function: cp_api_pipeline - Failed parsing the answer\n  \_{e}{bcolors.ENDC}"
+        )
+        exit(1)
+    if export is not None:
+        export.write_objects(dict_res['objects'])
+    dict_res['objects'] = []
+    progress = Progress(api_call_parameters['offset'])
+    progress.update(dict_res['to'], total, first.size)
+    offsets = list(range(dict_res['to'], total, api_call_parameters['limit']))
+
+    pages = queue.Queue(maxsize=jobs * 2)
+    window = threading.Semaphore(jobs * 2)
+    fetch_page = client.api_call_hedged if hedge else client.api_call
+    next_offset = iter(offsets)
+    lock = threading.Lock()
+    stop = threading.Event()
+    # the decodings not counted yet
+    pending = set()
+    own_pool = pool is None
+    if own_pool:
+        # before the fetchers start
+        pool = start_decode_pool(jobs)
+
+    def fetch():
+        while True:
+            window.acquire()
+            with lock:
+                offset = next(next_offset, None)
+            if offset is None or stop.is_set():
+                return
+            try:
+                res = fetch_page(api_call,
+                                 dict(api_call_parameters, offset=offset),
+                                 decode=False)
+            except Exception as e:
+                # fail the page, not the fetcher, which the counting waits for
+                res = cpapi.APIResponse("", False, err_message=e)
+            if stop.is_set():
+                return
+            future = None
+            if res.success:
+                try:
+                    future = pool.submit(decode_page, res.raw,
+                                         export is not None)
+                except RuntimeError:
+                    # the pool was shut down, the run is over
+                    return
+                with lock:
+                    pending.add(future)
+                res.raw = None
+            pages.put((offset, res, future))
+
+    for _ in range(min(jobs, len(offsets))):
+        threading.Thread(target=fetch, daemon=True).start()
+    received = {}
+    try:
+        for offset in offsets:
+            while offset not in received:
+                page_offset, res, future = pages.get()
+                received[page_offset] = (res, future)
+            res, future = received.pop(offset)
+            if res.success is False:
+                progress.finish()
+                print(
+                    f"{bcolors.FAIL}[-] Failed to get the anwer:\n{res.error_message}{bcolors.ENDC}"
+                )
+                exit(1)
+            try:
+                to, page_total, entries, compressed, seconds = future.result()
+            except (KeyError, TypeError, AttributeError, ValueError) as e:
+                progress.finish()
+                print(
+                    f"{bcolors.FAIL}[-] Function: cp_api_pipeline - Failed parsing the answer\n  \_{e}{bcolors.ENDC}"
+                )
+                exit(1)
+            with lock:
+                pending.discard(future)
+            pool_phase('decode', seconds)
+            counter.update_entries(entries)
+            if export is not None:
+                export.write(compressed, len(entries))
+            window.release()
+            if page_total != total and dict_res['total'] == total:
+                dict_res['total'] = page_total
+                print(
+                    f"{bcolors.WARNING}[!] Objects were added or removed during the run, the counts may be off{bcolors.ENDC}"
+                )
+            dict_res['to'] = to
+            progress.update(to, total, res.size)
+    finally:
+        progress.finish()
+        stop.set()
+        with lock:
+            for future in pending:
+                future.cancel()
+        for _ in range(jobs):
+            window.release()
+        if own_pool:
+            pool.shutdown(wait=False)
+    return dict_res
+
+
+class JSONObjectStream:
+    """
+    Incremental reader for the 'objects' array of a show-gateways-and-servers export.
+    Objects are decoded one at a time from fixed-size chunks, so the file is never held in memory as a whole.
+    """
+    whitespace = ' \t\r\n'
+
+    def __init__(self, f, key='objects', chunk_size=1 << 20):
+        self.f = f
+        self.key = key
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in self.whitespace:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                raise ValueError('Unexpected end of JSON input')
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expecting '{char}' at offset {self.pos}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if self.fill():
+                    continue
+                raise
+            # a scalar ending exactly at the chunk boundary may continue in the next chunk
+            if end == len(self.buf) and self.fill():
+                continue
+            self.pos = end
+            return obj
+
+    def items(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            char = self.peek()
+            self.pos += 1
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError(f"Expecting ',' delimiter at offset {self.pos - 1}")
+
+    def __iter__(self):
+        # A bare list of objects is accepted as well as the full API answer
+        if self.peek() == '[':
+            yield from self.items()
+            return
+        self.expect('{')
+        if self.peek() == '}':
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            if key == self.key:
+                yield from self.items()
+            else:
+                self.value()
+            char = self.peek()
+            self.pos += 1
+            if char == '}':
+                return
+            if char != ',':
+                raise ValueError(f"Expecting ',' delimiter at offset {self.pos - 1}")
+
+
+class ObjectExport:
+    """
+    Export of the fetched gateways and servers objects, written while they are counted: a gzip compressed
+    NDJSON file, one object per line, and a manifest next to it (FILE.manifest.json) with the server,
+    its API version, the time of the export and the number of objects.
+    Every page is compressed on its own, as a gzip member of the file, so that the pages can be compressed
+    in the processes that decode them. The file is written under a temporary name and renamed once complete,
+    the manifest is written last.
+    """
+    MANIFEST_SUFFIX = '.manifest.json'
+    FORMAT = 'gateways-and-servers ndjson+gzip'
+    # favour speed, the export is written while the pages are fetched
+    COMPRESS_LEVEL = 1
+
+    def __init__(self, path, command, parameters):
+        self.path = path
+        self.tmp_path = f"{path}.{os.getpid()}.tmp"
+        self.f = open(self.tmp_path, 'wb')
+        self.objects = 0
+        self.manifest = {
+            'format': self.FORMAT,
+            'command': command,
+            'details-level': parameters.get('details-level'),
+            'exported-at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        }
+
+    @classmethod
+    def compress(cls, objects):
+        import gzip
+        lines = ''.join(json.dumps(obj) + '\n' for obj in objects)
+        return gzip.compress(lines.encode('utf-8'), cls.COMPRESS_LEVEL)
+
+    def write(self, data, count):
+        """Append a page compressed by compress, of count objects"""
+        self.f.write(data)
+        self.objects += count
+
+    def write_objects(self, objects):
+        self.write(self.compress(objects), len(objects))
+
+    def restart(self):
+        """Drop what was written, e.g. when a query starts over"""
+        self.f.seek(0)
+        self.f.truncate()
+        self.objects = 0
+
+    def close(self, **manifest):
+        """Complete the export: rename the file and write its manifest"""
+        self.f.close()
+        os.replace(self.tmp_path, self.path)
+        self.manifest.update(manifest)
+        self.manifest['objects'] = self.objects
+        tmp_path = self.path + self.MANIFEST_SUFFIX + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path + self.MANIFEST_SUFFIX)
+
+    def abort(self):
+        """Remove the incomplete export"""
+        if not self.f.closed:
+            self.f.close()
+            os.remove(self.tmp_path)
+
+
+def read_manifest(file_path):
+    """:return: the manifest of an ObjectExport, or None if the file is not one"""
+    try:
+        with open(file_path + ObjectExport.MANIFEST_SUFFIX) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    if manifest.get('format') != ObjectExport.FORMAT:
+        raise ValueError(f"Unknown export format in {file_path}{ObjectExport.MANIFEST_SUFFIX}")
+    return manifest
+
+
+def iter_objects(file_path):
+    """
+    Stream the gateways and servers objects from an offline JSON export, or from an ObjectExport.
+    Either may be gzip compressed.
+    """
+    import zlib
+    manifest = read_manifest(file_path)
+    with open(file_path, 'rb') as f:
+        if f.peek(2)[:2] == b'\x1f\x8b':
+            import gzip
+            f = gzip.GzipFile(fileobj=f)
+        try:
+            if manifest is None:
+                yield from JSONObjectStream(io.TextIOWrapper(f, encoding='utf-8'))
+                return
+            count = 0
+            for obj in iter_ndjson(f):
+                yield obj
+                count += 1
+        except (EOFError, zlib.error) as e:
+            # a truncated or corrupt gzip file
+            raise ValueError(f"Corrupt gzip file {file_path}: {e}")
+        if count != manifest['objects']:
+            raise ValueError(
+                f"Incomplete export: {count} of {manifest['objects']} objects")
+
+
+def iter_ndjson(f, chunk_size=1 << 20):
+    """
+    Stream the objects of an NDJSON file opened in binary mode. The complete lines of every chunk are
+    decoded at once, as a JSON array, which is much faster than decoding the lines one by one.
+    Blank lines are skipped, e.g. of concatenated or edited files.
+    """
+    rest = b''
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        chunk = rest + chunk
+        end = chunk.rfind(b'\n') + 1
+        rest = chunk[end:]
+        # JSON strings cannot hold a raw newline, so every newline separates two objects
+        lines = [line for line in chunk[:end].split(b'\n') if line.strip()]
+        if lines:
+            yield from json.loads(b'[' + b','.join(lines) + b']')
+    if rest.strip():
+        yield json.loads(rest)
+
+
+class LicenseEntry(NamedTuple):
+    """The licensing relevant part of a single gateways-and-servers object"""
+    domain: str
+    kind: Optional[str]
+    members: Tuple[str, ...]
+    standby: Optional[bool]
+    name: str = ''
+
+
+def is_vs_deployed(cluster_members, vs_name):
+    """A VS is deployed when one of its cluster members is named <VSX member>_<VS name>"""
+    suffix = '_' + vs_name
+    for member in cluster_members:
+        if member.endswith(suffix):
+            return True
+    return False
+
+
+def license_entry(obj) -> LicenseEntry:
+    obj_domain_name = obj['domain']['name']
+    obj_type = obj['type']
+    obj_name = obj['name']
+    kind = None
+    members = ()
+    standby = None
+    # Mark CMA availability for Primary and Standby MDS
+    if 'management-blades' in obj and 'network-policy-management' in obj[
+            'management-blades']:
+        standby = 'secondary' in obj['management-blades']
+    # Go over all GWs
+    if 'network-security-blades' in obj:
+        obj_gw_blades = obj['network-security-blades']
+        if "firewall" in obj_gw_blades and obj_gw_blades['firewall'] == True:
+            cluster_members = tuple(obj.get('cluster-member-names', ()))
+            # Go over VS GW
+            if obj_type == cp_host.vs.value:
+                if is_vs_deployed(cluster_members, obj_name):
+                    kind = 'VS'
+                    members = cluster_members
+            # Go over HA GW Cluster
+            elif obj_type == cp_host.ha.value:
+                kind = 'HA'
+                members = cluster_members
+            # Go over Single GW
+            elif obj_type == cp_host.single.value:
+                kind = 'GW'
+                members = (obj_name, )
+    return LicenseEntry(obj_domain_name, kind, members, standby, obj_name)
+
+
+def object_key(obj):
+    """Objects are matched between runs by uid, falling back to domain/type/name for exports without uids"""
+    if 'uid' in obj:
+        return obj['uid']
+    return (obj['domain']['name'], obj['type'], obj['name'])
+
+
+class MemberIndex:
+    """
+    The cluster members counted in a run, built once while counting.
+    Maps every member name to the clusters and VS (domain, category, name) it is counted under,
+    so that a member counted more than once is found.
+    VS member names are named after the VSX member, so they are matched across domains, e.g. to find
+    colliding VS names of different domains. ClusterXL members are matched within their domain only.
+    """
+    def __init__(self):
+        self.parents = {}
+
+    def add(self, entry):
+        parent = (entry.domain, entry.kind, entry.name)
+        for member in entry.members:
+            key = member if entry.kind == 'VS' else (entry.domain, member)
+            parents = self.parents.get(key)
+            if parents is None:
+                self.parents[key] = [parent]
+            elif parent not in parents:
+                parents.append(parent)
+
+    def duplicates(self):
+        """
+        :return: dict of member to its parents, for the members counted more than once. VS members are
+                 given by name, ClusterXL members by name and domain, e.g. "member (domain)".
+        """
+        duplicates = {}
+        for key, parents in self.parents.items():
+            if len(parents) > 1:
+                member = key if isinstance(key, str) else f"{key[1]} ({key[0]})"
+                duplicates[member] = list(parents)
+        return duplicates
+
+
+class LicenseCounter:
+    """
+    Folds gateways-and-servers objects into per-domain license counts.
+    The results dict is keyed by domain name, every domain holds the MDS flags, the total count,
+    and the members and count of the VS, HA and GW categories.
+    Collecting the member names can be turned off when only the counts are reported,
+    and indexing the cluster members when the members counted twice are not reported.
+    """
+    def __init__(self, keep_members=True, index=True):
+        self.results = {}
+        self.keep_members = keep_members
+        self.index = MemberIndex() if index else None
+
+    def domain(self, name):
+        # Instantiate dicts for Domain, MDS, VS, HA, and Single GW
+        if name not in self.results:
+            self.results[name] = {}
+            for mds in ['OnMDSPrimary', 'OnMDSStandby']:
+                self.results[name][mds] = False
+            self.results[name]['CountTotal'] = 0
+            for gw in ['VS', 'HA', 'GW']:
+                self.results[name][gw] = {}
+                self.results[name][gw]['Members'] = []
+                self.results[name][gw]['Count'] = 0
+        return self.results[name]
+
+    def add(self, obj) -> LicenseEntry:
+        entry = license_entry(obj)
+        self.add_entry(entry)
+        return entry
+
+    def add_entry(self, entry):
+        domain = self.domain(entry.domain)
+        if entry.standby is not None:
+            domain['OnMDSPrimary'] = True
+            domain['OnMDSStandby'] = entry.standby
+        if entry.kind is not None:
+            if self.keep_members:
+                domain[entry.kind]['Members'] += entry.members
+            domain[entry.kind]['Count'] += len(entry.members)
+            domain['CountTotal'] += len(entry.members)
+            if entry.kind != 'GW' and self.index is not None:
+                self.index.add(entry)
+
+    def update(self, objects):
+        for obj in objects:
+            self.add(obj)
+
+    def update_entries(self, entries):
+        for entry in entries:
+            self.add_entry(entry)
+
+    def totals(self):
+        """:return: tuple of the Primary MDS and the Standby MDS gateway totals"""
+        mds_prim_total = 0
+        mds_stand_total = 0
+        for value in self.results.values():
+            mds_prim_total += value['CountTotal']
+            mds_stand_total += value['CountTotal'] if value[
+                'OnMDSStandby'] == True else 0
+        return mds_prim_total, mds_stand_total
+
+
+def count_licensing(objects, keep_members=True) -> LicenseCounter:
+    counter = LicenseCounter(keep_members)
+    try:
+        counter.update(objects)
+    except (KeyError, TypeError, AttributeError) as e:
         print(
             f"{bcolors.FAIL}[-] Function: process_licensing - Failed parsing JSON file\n  \_{e}{bcolors.ENDC}"
         )
         exit(1)
-    # Instantiate totals
-    mds_prim_total = 0
-    mds_stand_total = 0
-    print(f"{bcolors.OKGREEN}[+] Summary output:\n{bcolors.ENDC}")
-    for key, value in sorted(dict_results.items()):
-        print(f"{bcolors.HEADER}{bcolors.BOLD}Domain: {key}{bcolors.ENDC}\n\
+    return counter
+
+
+class SummaryWriter:
+    """
+    Base class of the summary output formats.
+    Every domain is written to the stream as soon as it is rendered, the report is never built as a whole.
+    """
+    labels = {'GW': 'SingleGW', 'HA': 'ClusterXL', 'VS': 'VS'}
+
+    def __init__(self, stream=None, members=False):
+        self.stream = stream if stream is not None else sys.stdout
+        self.members = members
+
+    def record(self, name, value):
+        """The flat representation of a domain used by the machine-readable formats"""
+        record = {'Domain': name}
+        for kind in ['GW', 'HA', 'VS']:
+            record[self.labels[kind]] = value[kind]['Count']
+        record['PrimaryMDS'] = value['OnMDSPrimary']
+        record['StandbyMDS'] = value['OnMDSStandby']
+        record['TotalCount'] = value['CountTotal']
+        if self.members:
+            record['Members'] = {
+                self.labels[kind]: value[kind]['Members']
+                for kind in ['GW', 'HA', 'VS']
+            }
+        return record
+
+    def begin(self):
+        pass
+
+    def domain(self, name, value):
+        raise NotImplementedError
+
+    def duplicates(self, duplicates):
+        """:param duplicates: dict of member to the (domain, category, name) it is counted under, see MemberIndex"""
+        pass
+
+    def duplicate_records(self, duplicates):
+        return {
+            member: [{'Domain': domain, 'Type': self.labels[kind], 'Name': name}
+                     for domain, kind, name in parents]
+            for member, parents in sorted(duplicates.items())
+        }
+
+    def end(self, mds_prim_total, mds_stand_total):
+        pass
+
+
+class TextWriter(SummaryWriter):
+    def begin(self):
+        self.stream.write(f"{bcolors.OKGREEN}[+] Summary output:\n{bcolors.ENDC}\n")
+
+    def domain(self, name, value):
+        self.stream.write(f"{bcolors.HEADER}{bcolors.BOLD}Domain: {name}{bcolors.ENDC}\n\
   {bcolors.OKCYAN}SingleGW: {value['GW']['Count']}\t ClusterXL: {value['HA']['Count']}\tVS: {value['VS']['Count']}\t\
   StandbyMDS: {value['OnMDSStandby']}{bcolors.ENDC}\n\
-  {bcolors.OKGREEN}TotalCount: {value['CountTotal']}{bcolors.ENDC}")
-        mds_prim_total += value['CountTotal']
-        mds_stand_total += value['CountTotal'] if value[
-            'OnMDSStandby'] == True else 0
+  {bcolors.OKGREEN}TotalCount: {value['CountTotal']}{bcolors.ENDC}\n")
+        if self.members:
+            for kind in ['GW', 'HA', 'VS']:
+                if value[kind]['Members']:
+                    self.stream.write(
+                        f"  {bcolors.OKCYAN}{self.labels[kind]} members: {' '.join(value[kind]['Members'])}{bcolors.ENDC}\n"
+                    )
+
+    def duplicates(self, duplicates):
+        for member, parents in sorted(duplicates.items()):
+            counted = ', '.join(f"{self.labels[kind]} {name} ({domain})"
+                                for domain, kind, name in parents)
+            self.stream.write(
+                f"{bcolors.WARNING}[!] {member} is counted {len(parents)} times: {counted}{bcolors.ENDC}\n"
+            )
+
+    def end(self, mds_prim_total, mds_stand_total):
+        self.stream.write(
+            f"{bcolors.BOLD}{bcolors.OKGREEN}Primary MDS Total GWs: {mds_prim_total}\tStandby MDS Total GWs: {mds_stand_total}{bcolors.ENDC}\n"
+        )
+
+
+class JSONWriter(SummaryWriter):
+    def begin(self):
+        self.first = True
+        self.stream.write('{"Domains": [')
+
+    def domain(self, name, value):
+        self.stream.write(('\n  ' if self.first else ',\n  ') +
+                          json.dumps(self.record(name, value)))
+        self.first = False
+
+    def duplicates(self, duplicates):
+        self.duplicate_members = self.duplicate_records(duplicates)
+
+    def end(self, mds_prim_total, mds_stand_total):
+        totals = {'PrimaryMDS': mds_prim_total, 'StandbyMDS': mds_stand_total}
+        self.stream.write('\n]')
+        if getattr(self, 'duplicate_members', None):
+            self.stream.write(f', "Duplicates": {json.dumps(self.duplicate_members)}')
+        self.stream.write(f', "Totals": {json.dumps(totals)}}}\n')
+
+
+class NDJSONWriter(SummaryWriter):
+    def domain(self, name, value):
+        self.stream.write(json.dumps(self.record(name, value)) + '\n')
+
+    def duplicates(self, duplicates):
+        self.stream.write(
+            json.dumps({'Duplicates': self.duplicate_records(duplicates)}) + '\n')
+
+    def end(self, mds_prim_total, mds_stand_total):
+        totals = {'PrimaryMDS': mds_prim_total, 'StandbyMDS': mds_stand_total}
+        self.stream.write(json.dumps({'Totals': totals}) + '\n')
+
+
+class CSVWriter(SummaryWriter):
+    """
+    One row per domain, the MDS totals are left to the consumer (sum of TotalCount, and of it where StandbyMDS).
+    The members counted more than once are reported as warnings on stderr.
+    """
+    def begin(self):
+        import csv
+        self.writer = csv.writer(self.stream)
+        header = ['Domain', 'SingleGW', 'ClusterXL', 'VS', 'PrimaryMDS', 'StandbyMDS', 'TotalCount']
+        if self.members:
+            header += [self.labels[kind] + 'Members' for kind in ['GW', 'HA', 'VS']]
+        self.writer.writerow(header)
+
+    def domain(self, name, value):
+        record = self.record(name, value)
+        members = record.pop('Members', {})
+        self.writer.writerow(
+            list(record.values()) + [' '.join(m) for m in members.values()])
+
+    def duplicates(self, duplicates):
+        # warnings on stderr, the rows of the domains stay a single table
+        TextWriter(sys.stderr).duplicates(duplicates)
+
+
+class Format(argparse.Action):
+    FORMATS = {
+        'text': TextWriter,
+        'json': JSONWriter,
+        'ndjson': NDJSONWriter,
+        'csv': CSVWriter}
+
+    def __init__(self, option_strings, dest, default=None, **kwargs):
+        if default:
+            default = self.FORMATS[default]
+        super(Format, self).__init__(
+            option_strings, dest, default=default, **kwargs)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        if values[0] not in self.FORMATS:
+            raise argparse.ArgumentError(self, 'unknown format: "%s"' % values[0])
+        setattr(namespace, self.dest, self.FORMATS[values[0]])
+
+
+def write_summary(counter, writer=None):
+    if writer is None:
+        writer = TextWriter()
+    writer.begin()
+    for key, value in sorted(counter.results.items()):
+        writer.domain(key, value)
+    duplicates = counter.index.duplicates() if counter.index is not None else {}
+    if duplicates:
+        writer.duplicates(duplicates)
+    writer.end(*counter.totals())
+    writer.stream.flush()
+
+
+def process_licensing(tmp_dict, writer=None):
+    keep_members = writer is None or writer.members
+    write_summary(count_licensing(tmp_dict['objects'], keep_members), writer)
+
+
+class LicenseDiff:
+    """
+    Changes in the license counts between two runs.
+    changes is keyed by domain, then by category (VS, HA, GW), and holds the sets of the added and removed members.
+    """
+    def __init__(self, old, new):
+        self.old = old
+        self.new = new
+        self.changes = {}
+
+    def members(self, domain, kind):
+        if domain not in self.changes:
+            self.changes[domain] = {}
+        if kind not in self.changes[domain]:
+            self.changes[domain][kind] = {'Added': set(), 'Removed': set()}
+        return self.changes[domain][kind]
+
+    def record(self, old, new):
+        if old is not None and new is not None and (
+                old.domain, old.kind) == (new.domain, new.kind):
+            if old.kind is None:
+                return
+            members = self.members(new.domain, new.kind)
+            members['Added'].update(set(new.members).difference(old.members))
+            members['Removed'].update(set(old.members).difference(new.members))
+            return
+        if old is not None and old.kind is not None:
+            self.members(old.domain, old.kind)['Removed'].update(old.members)
+        if new is not None and new.kind is not None:
+            self.members(new.domain, new.kind)['Added'].update(new.members)
+
+    def net(self):
+        """
+        Drop the members both added and removed in a domain and category, e.g. moved between clusters,
+        as their count did not change, and the domains left without changes.
+        """
+        for domain in list(self.changes):
+            for kind in list(self.changes[domain]):
+                members = self.changes[domain][kind]
+                moved = members['Added'] & members['Removed']
+                members['Added'] -= moved
+                members['Removed'] -= moved
+                if not (members['Added'] or members['Removed']):
+                    del self.changes[domain][kind]
+            if not self.changes[domain]:
+                del self.changes[domain]
+
+    def standby_changes(self):
+        """:return: dict of domain to (old, new) OnMDSStandby flags for the domains where the flag changed"""
+        flags = {}
+        for domain in self.old.results.keys() | self.new.results.keys():
+            old = self.old.results.get(domain, {}).get('OnMDSStandby', False)
+            new = self.new.results.get(domain, {}).get('OnMDSStandby', False)
+            if old != new:
+                flags[domain] = (old, new)
+        return flags
+
+
+def diff_licensing(old_objects, new_objects) -> LicenseDiff:
+    """
+    Compare two sets of gateways-and-servers objects, matched by uid.
+    The old objects are reduced to a uid index of their license entries while streaming,
+    the new objects are streamed against that index, so neither input is held in memory as a whole.
+    """
+    diff = LicenseDiff(LicenseCounter(False, False), LicenseCounter(False, False))
+    index = {}
+    try:
+        for obj in old_objects:
+            index[object_key(obj)] = diff.old.add(obj)
+        for obj in new_objects:
+            entry = diff.new.add(obj)
+            old = index.pop(object_key(obj), None)
+            if old != entry:
+                diff.record(old, entry)
+        for old in index.values():
+            diff.record(old, None)
+        diff.net()
+    except (KeyError, TypeError, AttributeError) as e:
+        print(
+            f"{bcolors.FAIL}[-] Function: diff_licensing - Failed parsing JSON file\n  \_{e}{bcolors.ENDC}"
+        )
+        exit(1)
+    return diff
+
+
+def print_diff(diff):
+    print(f"{bcolors.OKGREEN}[+] Diff output:\n{bcolors.ENDC}")
+    standby = diff.standby_changes()
+    labels = {'GW': 'SingleGW', 'HA': 'ClusterXL', 'VS': 'VS'}
+    for domain in sorted(diff.changes.keys() | standby.keys()):
+        print(f"{bcolors.HEADER}{bcolors.BOLD}Domain: {domain}{bcolors.ENDC}")
+        for kind in ['GW', 'HA', 'VS']:
+            members = diff.changes.get(domain, {}).get(kind)
+            if not members or not (members['Added'] or members['Removed']):
+                continue
+            added = ' '.join(f"+{m}" for m in sorted(members['Added']))
+            removed = ' '.join(f"-{m}" for m in sorted(members['Removed']))
+            print(
+                f"  {bcolors.OKCYAN}{labels[kind]}: {bcolors.OKGREEN}{added}{bcolors.FAIL} {removed}{bcolors.ENDC}"
+            )
+        if domain in standby:
+            print(
+                f"  {bcolors.WARNING}StandbyMDS: {standby[domain][0]} -> {standby[domain][1]}{bcolors.ENDC}"
+            )
+    old_prim, old_stand = diff.old.totals()
+    new_prim, new_stand = diff.new.totals()
     print(
-        f"{bcolors.BOLD}{bcolors.OKGREEN}Primary MDS Total GWs: {mds_prim_total}\tStandby MDS Total GWs: {mds_stand_total}{bcolors.ENDC}"
+        f"{bcolors.BOLD}{bcolors.OKGREEN}Primary MDS Total GWs: {old_prim} -> {new_prim} ({new_prim - old_prim:+d})\t\
+Standby MDS Total GWs: {old_stand} -> {new_stand} ({new_stand - old_stand:+d}){bcolors.ENDC}"
     )
 
 
+class Profiler:
+    """
+    Per-phase timing of a run, enabled with --profile.
+    Phases are timed by wrapping the functions of each phase only while profiling, so a normal run pays nothing.
+    The time of nested phases is subtracted from the outer one (e.g. decode from fetch).
+    Phases of other threads (e.g. the fetchers of --jobs) are added up, so they may exceed the total.
+    So are the phases of the pool processes of --jobs, reported apart (e.g. 'decode (pool)').
+    Optionally dumps cProfile stats (for pstats), and samples the main thread's stacks into the folded
+    format of flamegraph.pl and speedscope.
+    """
+    def __init__(self, stats_file=None, stacks_file=None, interval=0.005):
+        import threading
+        self.phases = {}
+        self.lock = threading.Lock()
+        # the phases each thread is in
+        self.local = threading.local()
+        self.stats_file = stats_file
+        self.stacks_file = stacks_file
+        self.interval = interval
+        self.samples = {}
+        self.cprofile = None
+        self.sampling = False
+
+    @property
+    def stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def enter(self, name):
+        self.stack.append([name, time.perf_counter(), 0.0])
+
+    def exit(self):
+        stack = self.stack
+        name, start, children = stack.pop()
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            phase = self.phases.setdefault(name, [0, 0.0])
+            phase[0] += 1
+            phase[1] += elapsed - children
+        if stack:
+            stack[-1][2] += elapsed
+
+    def add(self, name, seconds):
+        """Add the time of a phase timed elsewhere, e.g. in a pool process"""
+        with self.lock:
+            phase = self.phases.setdefault(name, [0, 0.0])
+            phase[0] += 1
+            phase[1] += seconds
+
+    def pool_phase(self, name, seconds):
+        self.add(f"{name} (pool)", seconds)
+
+    def wrap(self, owner, attr, name, within=()):
+        """Time every call of owner.attr as the named phase, unless called from one of the phases in within"""
+        func = getattr(owner, attr)
+
+        def timed(*args, **kwargs):
+            if self.stack and self.stack[-1][0] in within:
+                return func(*args, **kwargs)
+            self.enter(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.exit()
+
+        timed.__wrapped__ = func
+        setattr(owner, attr, timed)
+
+    def instrument(self, online):
+        module = sys.modules[__name__]
+        for func, name in [('diff_licensing', 'aggregate'), ('write_summary', 'render'), ('print_diff', 'render')]:
+            self.wrap(module, func, name)
+        self.wrap(LicenseCounter, 'update', 'aggregate')
+        self.wrap(LicenseCounter, 'update_entries', 'aggregate')
+        self.wrap(JSONObjectStream, 'value', 'decode')
+        if online:
+            from cpapi import api_response, mgmt_api
+            for method in ['login', 'login_with_api_key', 'continue_session']:
+                self.wrap(mgmt_api.APIClient, method, 'login')
+            self.wrap(mgmt_api.APIClient, 'check_fingerprint', 'fingerprint')
+            # the requests of a login are part of the login phase
+            self.wrap(mgmt_api.APIClient, 'api_call', 'fetch', within=('login', ))
+            self.wrap(api_response, 'compatible_loads', 'decode')
+            module.pool_phase = self.pool_phase
+
+    def sample(self, thread_id):
+        while self.sampling:
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                key = ';'.join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+            time.sleep(self.interval)
+
+    def start(self):
+        self.started = time.perf_counter()
+        if self.stats_file:
+            import cProfile
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        if self.stacks_file:
+            import threading
+            self.sampling = True
+            self.sampler = threading.Thread(target=self.sample,
+                                            args=(threading.get_ident(), ),
+                                            daemon=True)
+            self.sampler.start()
+
+    def stop(self):
+        self.elapsed = time.perf_counter() - self.started
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.stats_file)
+        if self.sampling:
+            self.sampling = False
+            self.sampler.join()
+            with open(self.stacks_file, 'w') as f:
+                for stack, count in sorted(self.samples.items()):
+                    f.write(f"{stack} {count}\n")
+
+    def report(self, stream=None):
+        stream = stream if stream is not None else sys.stderr
+        stream.write(f"{bcolors.OKGREEN}[+] Profile:{bcolors.ENDC}\n")
+        stream.write(f"  {'phase':<15}{'calls':>8}{'seconds':>12}{'%':>8}\n")
+        accounted = 0.0
+        for name, (calls, seconds) in sorted(self.phases.items(), key=lambda p: -p[1][1]):
+            if not name.endswith(' (pool)'):
+                # the pool processes run alongside this one
+                accounted += seconds
+            stream.write(
+                f"  {name:<15}{calls:>8}{seconds:>12.4f}{100 * seconds / self.elapsed:>8.1f}\n")
+        other = self.elapsed - accounted
+        if other >= 0:
+            # not known when the phases of several threads overlap
+            stream.write(f"  {'other':<15}{'':>8}{other:>12.4f}{100 * other / self.elapsed:>8.1f}\n")
+        stream.write(f"  {'total':<15}{'':>8}{self.elapsed:>12.4f}\n")
+        if self.stats_file:
+            stream.write(f"  \\_cProfile stats: {self.stats_file}\n")
+        if self.stacks_file:
+            stream.write(f"  \\_Sampled stacks: {self.stacks_file}\n")
+
+
 def banner():
     tmp = """
   _   _  ____ ____  __  __   _     _                    _              
@@ -250,17 +1358,187 @@ def banner():
     print(tmp)
 
 
+def pack(name):
+    from cpapi.cli import pack as pack_cpapi
+    with open(os.path.abspath(__file__), 'rb') as f:
+        source = f.read()
+    pack_cpapi(name,
+               main_source='from process import main\nmain()\n',
+               extra_files={'process.py': source},
+               interpreter='python3',
+               compiled=True)
+
+
 def main():
+    parser = argparse.ArgumentParser(
+        description='Count the licensed gateways per Domain of a Multi-Domain Server')
+    parser.add_argument(
+        'file', nargs='?', default='',
+        help='JSON output of show-gateways-and-servers for offline processing')
+    parser.add_argument(
+        '--diff', nargs=2, metavar=('OLD', 'NEW'),
+        help='compare the license counts of two offline JSON outputs')
+    parser.add_argument(
+        '--format', '-f', metavar='{text|json|ndjson|csv}', nargs=1,
+        default='text', action=Format,
+        help='summary output format, anything but text leaves stdout to the summary alone')
+    parser.add_argument(
+        '--members', action='store_true',
+        help='include the members of every Domain in the summary')
+    args_def = [
+        ('--management', '-m', 'SERVER', 'MGMT_CLI_MANAGEMENT',
+         'management server IPv4 address/hostname/FQDN'),
+        ('--port', None, 'PORT', 'MGMT_CLI_PORT', 'management server port'),
+        ('--user', '-u', 'USER', 'MGMT_CLI_USER', 'username'),
+        ('--password', '-p', 'PASSWORD', 'MGMT_CLI_PASSWORD', 'password'),
+        ('--api-key-file', None, 'FILE', 'MGMT_CLI_API_KEY_FILE',
+         'file holding the API key to log in with (MDS/SMS R80.40+)'),
+        ('--domain', '-d', 'DOMAIN', 'MGMT_CLI_DOMAIN', 'domain to log in to'),
+        ('--fingerprint', None, 'FINGERPRINT', 'MGMT_CLI_FINGERPRINT',
+         "expected SHA1 fingerprint of the server's certificate"),
+    ]
+    for lname, sname, meta, env, help_text in args_def:
+        pargs = [lname]
+        if sname:
+            pargs.append(sname)
+        parser.add_argument(*pargs,
+                            metavar=meta,
+                            default=os.environ.get(env),
+                            help=f"{help_text} (env: {env})")
+    parser.add_argument(
+        '--unsafe-auto-accept', action='store_true',
+        help="accept and save an unknown server fingerprint without asking")
+    parser.add_argument(
+        '--session-cache', metavar='FILE', nargs='?', const='',
+        default=os.environ.get('MGMT_CLI_SESSION_CACHE'),
+        help='keep the session for later runs and continue it while valid, '
+        'FILE defaults to ~/.cpapi_sessions.json (env: MGMT_CLI_SESSION_CACHE)')
+    parser.add_argument(
+        '--retries', metavar='N', type=int, default=5,
+        help='retries of a failed API call, with exponential backoff (default: 5)')
+    parser.add_argument(
+        '--rate-limit', metavar='CALLS', type=float,
+        help='most API calls per second')
+    parser.add_argument(
+        '--pack', metavar='FILE',
+        help='build a single-file, precompiled zipapp of process.py and cpapi, and exit')
+    parser.add_argument(
+        '--checkpoint', metavar='DIR',
+        help='save every fetched page to DIR, so that an interrupted run resumes from where it stopped')
+    parser.add_argument(
+        '--timeout', metavar='SECONDS', type=float,
+        help='most seconds to wait for the answer of an API call before it is retried')
+    parser.add_argument(
+        '--deadline', metavar='SECONDS', type=float,
+        help='most seconds all the API calls of the run may take')
+    parser.add_argument(
+        '--hedge', action='store_true',
+        help='request a page once more when it takes longer than 95%% of the pages so far')
+    parser.add_argument(
+        '--export', metavar='FILE',
+        help='also write the fetched objects to FILE, gzip compressed NDJSON with a FILE.manifest.json, '
+        'which can be processed offline like a JSON output')
+    parser.add_argument(
+        '--jobs', '-j', metavar='N', type=int, default=1,
+        help='fetch and decode N pages at a time, counting them as they arrive (default: 1)')
+    parser.add_argument(
+        '--profile', action='store_true',
+        help='time the login, fingerprint, fetch, decode, aggregate and render phases and report them on stderr')
+    parser.add_argument(
+        '--profile-stats', metavar='FILE',
+        help='with --profile, also dump cProfile stats to FILE (read them with pstats)')
+    parser.add_argument(
+        '--profile-stacks', metavar='FILE',
+        help='with --profile, also write sampled stacks to FILE in the folded format of flamegraph.pl')
+    args = parser.parse_args()
+    if args.pack:
+        pack(args.pack)
+        return
+    if args.diff and args.format is not TextWriter:
+        parser.error('--diff supports only the text format')
+    if args.jobs > 1 and args.checkpoint:
+        parser.error('--jobs cannot be combined with --checkpoint')
+    if args.export and (args.diff or args.file):
+        parser.error('--export writes the objects fetched from the server, not those of an offline input')
+    online = not (args.diff or args.file)
+    pool = None
+    if online and args.jobs > 1 and not args.checkpoint:
+        # forked before any thread starts, e.g. the sampler of --profile-stacks
+        pool = start_decode_pool(args.jobs)
+    profiler = None
+    if args.profile:
+        profiler = Profiler(args.profile_stats, args.profile_stacks)
+        profiler.instrument(online=online)
+        profiler.start()
+    try:
+        run(args, pool)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            profiler.report()
+        if pool is not None:
+            # the pipeline is over, the workers are idle. Not waiting for them races the exit of the
+            # pool's management thread, which may fail at exit with "Bad file descriptor".
+            pool.shutdown()
+
+
+def run(args, pool=None):
+    writer = args.format(sys.stdout, members=args.members)
+    if args.format is not TextWriter:
+        # keep stdout clean for the machine-readable summary
+        sys.stdout = sys.stderr
     banner()
-    file_path = sys.argv[1] if len(sys.argv) == 2 else ""
-    tmp_dict = {}
-    if file_path == "":
+    file_path = args.file
+    if args.diff:
+        try:
+            diff = diff_licensing(iter_objects(args.diff[0]),
+                                  iter_objects(args.diff[1]))
+        except OSError as e:
+            print(
+                f"{bcolors.FAIL}[-] Error reading file {e.filename}\n{e}{bcolors.ENDC}"
+            )
+            exit(1)
+        except ValueError as e:
+            print(
+                f"{bcolors.FAIL}[-] Failed parsing JSON input file\n{e}{bcolors.ENDC}"
+            )
+            exit(1)
+        print_diff(diff)
+    elif file_path == "":
         parameters = {"limit": 500, "offset": 0, "details-level": "full"}
-        tmp_dict = cp_api_call('show-gateways-and-servers', parameters, True)
+        session_cache = cpapi.SessionCache(
+            args.session_cache) if args.session_cache is not None else None
+        counter = LicenseCounter(writer.members)
+        export = None
+        if args.export:
+            try:
+                export = ObjectExport(args.export, 'show-gateways-and-servers',
+                                      parameters)
+            except OSError as e:
+                print(
+                    f"{bcolors.FAIL}[-] Error writing file {args.export}\n{e}{bcolors.ENDC}"
+                )
+                exit(1)
+        try:
+            dict_res = cp_api_call(
+                'show-gateways-and-servers', parameters, True,
+                get_credentials(args), session_cache, args.retries,
+                args.rate_limit,
+                cpapi.PageCheckpoint(args.checkpoint) if args.checkpoint else None,
+                counter, args.jobs, args.timeout, args.deadline, args.hedge,
+                export, pool)
+            if export is not None:
+                export.close(total=dict_res.get('total'))
+                print(
+                    f"{bcolors.OKGREEN}[+] Exported {export.objects} objects to {args.export}{bcolors.ENDC}"
+                )
+        finally:
+            if export is not None:
+                export.abort()
+        write_summary(counter, writer)
     else:
         try:
-            with open(file_path, 'r') as f:
-                tmp_dict = json.load(f)
+            counter = count_licensing(iter_objects(file_path), args.members)
         except OSError as e:
             print(
                 f"{bcolors.FAIL}[-] Error reading file {file_path}\n{e}{bcolors.ENDC}"
@@ -271,7 +1549,7 @@ def main():
                 f"{bcolors.FAIL}[-] Failed parsing JSON input file\n{e}{bcolors.ENDC}"
             )
             exit(1)
-    process_licensing(tmp_dict)
+        write_summary(counter, writer)
 
 
 if __name__ == "__main__":
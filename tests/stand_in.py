@@ -0,0 +1,111 @@
+"""
+A stand-in for the web API of a management server: HTTPS on a free local port, with the self-signed certificate
+keycert.pem, answering every request with the handler of the test.
+"""
+import hashlib
+import json
+import os
+import ssl
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cpapi import APIClient, APIClientArgs
+
+CERT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "keycert.pem")
+
+
+def fingerprint():
+    """:return: the fingerprint of the stand-in's certificate, as APIClient computes it"""
+    with open(CERT) as f:
+        pem = f.read()
+    cert = pem[pem.index("-----BEGIN CERTIFICATE-----"):]
+    return hashlib.sha1(ssl.PEM_cert_to_DER_cert(cert)).hexdigest().upper()
+
+
+def ok(command, payload):
+    if command == "login":
+        return 200, {"sid": "sid", "api-server-version": "1.5"}
+    return 200, {"message": "OK"}
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        stand_in = self.server.stand_in
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        command = self.path.rsplit("/", 1)[-1]
+        payload = json.loads(body.decode("utf-8") or "{}")
+        with stand_in.lock:
+            stand_in.requests.append((command, payload))
+        answer = stand_in.handler(command, payload)
+        if answer is None:
+            # the response is lost
+            self.close_connection = True
+            return
+        status, data = answer
+        data = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        if not stand_in.keep_alive:
+            # closed without telling the client, like an idle connection timing out
+            self.close_connection = True
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # the client hanging up, e.g. on a timeout or an aborted request, is part of the tests
+        if not isinstance(sys.exc_info()[1], OSError):
+            ThreadingHTTPServer.handle_error(self, request, client_address)
+
+
+class StandIn:
+    """
+    The server runs on its own thread from creation to close().
+    The handler is called with the command and the payload of every request, and returns (status, data) of the
+    response, or None to close the connection without one.
+    Without keep_alive the connection is closed after every response, the client finds out on its next request.
+    """
+
+    def __init__(self, handler=ok, keep_alive=True):
+        self.handler = handler
+        self.keep_alive = keep_alive
+        # (command, payload) of every request
+        self.requests = []
+        self.lock = threading.Lock()
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(CERT)
+        self.server = Server(("127.0.0.1", 0), RequestHandler)
+        self.server.socket = context.wrap_socket(self.server.socket, server_side=True)
+        self.server.stand_in = self
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def commands(self):
+        with self.lock:
+            return [command for command, _ in self.requests]
+
+    def client(self, **kwargs):
+        """:return: an APIClient of the stand-in, which trusts its certificate"""
+        return APIClient(APIClientArgs(server="127.0.0.1", port=self.port, fingerprint=fingerprint(), **kwargs))
@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from cpapi import APIException, PageCheckpoint
+from tests.stand_in import StandIn, ok
+
+OBJECTS = [{"uid": str(i), "name": "host%d" % i} for i in range(45)]
+
+
+def pages(objects, fail_offset=None):
+    def handler(command, payload):
+        if command != "show-hosts":
+            return ok(command, payload)
+        offset, limit = payload["offset"], payload["limit"]
+        if offset == fail_offset:
+            return 400, {"code": "generic_err", "message": "page failed"}
+        page = objects[offset:offset + limit]
+        return 200, {"from": offset + 1, "to": offset + len(page), "total": len(objects), "objects": page}
+    return handler
+
+
+class PageCheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.spool = os.path.join(self.dir, "spool")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_resume(self):
+        checkpoint = PageCheckpoint(self.spool)
+        checkpoint.start("show-hosts", {"limit": 10, "offset": 0})
+        checkpoint.save_page(0, 10, 45, {"objects": OBJECTS[:10]})
+        checkpoint.save_page(10, 20, 45, {"objects": OBJECTS[10:20]})
+        checkpoint = PageCheckpoint(self.spool)
+        # the offset is not part of the query
+        cursor = checkpoint.resume("show-hosts", {"limit": 10, "offset": 20})
+        self.assertEqual((cursor["next-offset"], cursor["total"]), (20, 45))
+        self.assertEqual(list(checkpoint.objects()), OBJECTS[:20])
+        self.assertTrue(checkpoint.is_consistent(45))
+        self.assertFalse(checkpoint.is_consistent(46))
+
+    def test_shifted_pages(self):
+        checkpoint = PageCheckpoint(self.spool)
+        checkpoint.start("show-hosts", {})
+        checkpoint.save_page(0, 10, 45, {"objects": OBJECTS[:10]})
+        checkpoint.save_page(10, 20, 45, {"objects": OBJECTS[9:19]})
+        self.assertEqual(list(checkpoint.objects()), OBJECTS[:19])
+
+    def test_other_query_starts_over(self):
+        checkpoint = PageCheckpoint(self.spool)
+        checkpoint.start("show-hosts", {"limit": 10})
+        checkpoint.save_page(0, 10, 45, {"objects": OBJECTS[:10]})
+        self.assertIsNone(PageCheckpoint(self.spool).resume("show-hosts", {"limit": 20}))
+        self.assertEqual(os.listdir(self.spool), [])
+
+    def test_completed_query_is_not_resumed(self):
+        checkpoint = PageCheckpoint(self.spool)
+        checkpoint.start("show-hosts", {})
+        checkpoint.save_page(0, 45, 45, {"objects": OBJECTS})
+        self.assertIsNone(PageCheckpoint(self.spool).resume("show-hosts", {}))
+
+    def test_nothing_to_resume(self):
+        self.assertIsNone(PageCheckpoint(self.spool).resume("show-hosts", {}))
+        with open(os.path.join(self.dir, PageCheckpoint.CURSOR_FILE), "w") as f:
+            f.write("{")
+        self.assertIsNone(PageCheckpoint(self.dir).resume("show-hosts", {}))
+
+
+class QueryResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def query(self, handler):
+        with StandIn(handler) as server:
+            with server.client() as client:
+                for res in client.gen_api_query("show-hosts", payload={"limit": 10},
+                                                 checkpoint=PageCheckpoint(self.dir)):
+                    pass
+            return res, [payload["offset"] for command, payload in server.requests if command == "show-hosts"]
+
+    def test_interrupted_query_resumes(self):
+        with self.assertRaisesRegex(APIException, "page failed"):
+            self.query(pages(OBJECTS, fail_offset=30))
+        res, offsets = self.query(pages(OBJECTS))
+        self.assertEqual(offsets, [30, 40])
+        self.assertEqual(res.data["objects"], OBJECTS)
+        # the completed query leaves no spool behind
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_changed_total_starts_over(self):
+        with self.assertRaises(APIException):
+            self.query(pages(OBJECTS, fail_offset=30))
+        res, offsets = self.query(pages(OBJECTS[:44]))
+        self.assertEqual(offsets, [30, 0, 10, 20, 30, 40])
+        self.assertEqual(res.data["objects"], OBJECTS[:44])
+
+
+if __name__ == "__main__":
+    unittest.main()
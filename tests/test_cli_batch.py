@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from cpapi.cli import read_batch, run_batch
+from tests.stand_in import StandIn, ok
+
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def batch_file(self, text):
+        path = os.path.join(self.dir, "batch")
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def run_batch(self, handler, rows, publish_every=0, workers=1):
+        results = []
+        with StandIn(handler) as server:
+            with server.client(thread_safe=workers > 1) as client:
+                summary = run_batch(client, "add-host", {"ip-address": "10.0.0.1"}, rows, workers, publish_every,
+                                    True, results.append)
+            commands = server.commands()
+        return summary, results, commands
+
+    def test_csv_rows(self):
+        path = self.batch_file("name,groups.1,comments\nh1,g1,\nh2,g2,x\n")
+        self.assertEqual(list(read_batch(path)),
+                         [(1, {"name": "h1", "groups": ["g1"]}), (2, {"name": "h2", "groups": ["g2"], "comments": "x"})])
+
+    def test_json_line_error_has_row_number(self):
+        path = self.batch_file('{"name": "h1"}\n\n{"name": \n')
+        with self.assertRaisesRegex(ValueError, "^row 3: "):
+            list(read_batch(path))
+
+    def test_bad_row_runs_nothing(self):
+        rows = read_batch(self.batch_file('{"name": "h1"}\n["h2"]\n'))
+        with StandIn() as server:
+            with server.client() as client:
+                with self.assertRaisesRegex(ValueError, "^row 2: "):
+                    run_batch(client, "add-host", {}, rows, 1, 0, True, lambda result: None)
+            self.assertEqual(server.commands(), [])
+
+    def test_publish_every_counts_changes(self):
+        def handler(command, payload):
+            if payload.get("name") == "bad":
+                return 400, {"code": "err_validation_failed", "message": "invalid"}
+            return ok(command, payload)
+
+        names = ["h1", "bad", "h2", "h3", "bad", "h4", "h5"]
+        summary, results, commands = self.run_batch(
+            handler, [(i + 1, {"name": name}) for i, name in enumerate(names)], publish_every=2)
+        self.assertEqual([result["success"] for result in results], [name != "bad" for name in names])
+        # published after h2, h4 and at the end after h5
+        self.assertEqual(commands, ["add-host", "add-host", "add-host", "publish", "add-host", "add-host", "add-host",
+                                    "publish", "add-host", "publish"])
+        self.assertEqual((summary["rows"], summary["failed"], summary["changes"], summary["published"],
+                          summary["publishes"]), (7, 2, 5, 5, 3))
+        self.assertNotIn("error", summary)
+
+    def test_failed_publish_discards(self):
+        publishes = []
+
+        def handler(command, payload):
+            if command == "publish":
+                publishes.append(payload)
+                if len(publishes) > 1:
+                    return 500, {"code": "generic_error", "message": "publish failed"}
+            return ok(command, payload)
+
+        summary, results, commands = self.run_batch(
+            handler, [(i + 1, {"name": "h%d" % i}) for i in range(5)], publish_every=2)
+        # stopped at the second publish: the changes of the first one are kept, the next two discarded
+        self.assertEqual(len(results), 4)
+        self.assertEqual(commands[-2:], ["publish", "discard"])
+        self.assertEqual((summary["published"], summary["publishes"], summary["discarded"]), (2, 1, 2))
+        self.assertIn("publish failed", summary["error"])
+
+    def test_stopped_batch_publishes_its_changes(self):
+        def write(result):
+            if result["row"] == 3:
+                raise IOError("broken pipe")
+
+        with StandIn() as server:
+            with server.client() as client:
+                summary = run_batch(client, "add-host", {}, [(i + 1, {"name": "h%d" % i}) for i in range(5)], 1, 0,
+                                    True, write)
+            self.assertEqual(server.commands(), ["add-host"] * 5 + ["publish"])
+        self.assertEqual((summary["rows"], summary["changes"], summary["published"]), (5, 5, 5))
+        self.assertEqual(summary["error"], "broken pipe")
+
+    def test_concurrent_rows(self):
+        summary, results, commands = self.run_batch(ok, [(i + 1, {"name": "h%d" % i}) for i in range(20)],
+                                                    workers=4)
+        self.assertEqual([result["row"] for result in results], list(range(1, 21)))
+        self.assertEqual(commands.count("publish"), 1)
+        self.assertEqual(summary["published"], 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
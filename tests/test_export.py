@@ -0,0 +1,108 @@
+import contextlib
+import gzip
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import process
+
+OBJECTS = [{"uid": str(i), "name": "gw%d" % i, "comments": "line\nbreak" if i % 7 == 0 else ""} for i in range(100)]
+
+
+class ExportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "export.ndjson.gz")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def export(self, pages):
+        export = process.ObjectExport(self.path, "show-gateways-and-servers", {"details-level": "full"})
+        for page in pages:
+            export.write_objects(page)
+        export.close(total=sum(len(page) for page in pages))
+        return export
+
+    def test_round_trip(self):
+        export = self.export([OBJECTS[:30], OBJECTS[30:60], OBJECTS[60:]])
+        self.assertEqual(list(process.iter_objects(self.path)), OBJECTS)
+        manifest = process.read_manifest(self.path)
+        self.assertEqual((manifest["objects"], manifest["total"]), (100, 100))
+        self.assertEqual(export.objects, 100)
+        self.assertFalse([name for name in os.listdir(self.dir) if name.endswith(".tmp")])
+
+    def test_restart_and_abort(self):
+        export = process.ObjectExport(self.path, "show-gateways-and-servers", {})
+        export.write_objects(OBJECTS[:10])
+        export.restart()
+        export.write_objects(OBJECTS[:5])
+        export.close()
+        self.assertEqual(list(process.iter_objects(self.path)), OBJECTS[:5])
+        export = process.ObjectExport(self.path + "2", "show-gateways-and-servers", {})
+        export.write_objects(OBJECTS)
+        export.abort()
+        self.assertEqual(sorted(os.listdir(self.dir)), ["export.ndjson.gz", "export.ndjson.gz.manifest.json"])
+
+    def test_chunks(self):
+        data = b"".join(json.dumps(obj).encode("utf-8") + b"\n" for obj in OBJECTS)
+        for chunk_size in (1, 7, 64, len(data)):
+            self.assertEqual(list(process.iter_ndjson(io.BytesIO(data), chunk_size)), OBJECTS)
+        # without a final newline
+        self.assertEqual(list(process.iter_ndjson(io.BytesIO(data.rstrip(b"\n")), 64)), OBJECTS)
+
+    def test_blank_lines(self):
+        lines = [json.dumps(obj).encode("utf-8") for obj in OBJECTS[:3]]
+        data = b"\n" + lines[0] + b"\n\n  \n" + lines[1] + b"\r\n\t\n" + lines[2] + b"\n\n"
+        for chunk_size in (1, 5, len(data)):
+            self.assertEqual(list(process.iter_ndjson(io.BytesIO(data), chunk_size)), OBJECTS[:3])
+
+    def test_concatenated_exports(self):
+        self.export([OBJECTS[:10]])
+        with open(self.path, "ab") as f:
+            f.write(gzip.compress(b"\n\n"))
+            f.write(process.ObjectExport.compress(OBJECTS[10:20]))
+        with self.assertRaisesRegex(ValueError, "Incomplete export: 20 of 10 objects"):
+            list(process.iter_objects(self.path))
+
+    def test_truncated(self):
+        self.export([OBJECTS])
+        with open(self.path, "rb") as f:
+            data = f.read()
+        with open(self.path, "wb") as f:
+            f.write(data[:len(data) // 2])
+        with self.assertRaisesRegex(ValueError, "Corrupt gzip file"):
+            list(process.iter_objects(self.path))
+
+    def test_corrupt(self):
+        self.export([OBJECTS])
+        with open(self.path, "r+b") as f:
+            f.seek(100)
+            f.write(b"\xff" * 100)
+        with self.assertRaises(ValueError):
+            list(process.iter_objects(self.path))
+
+    def test_gzip_json_output(self):
+        path = os.path.join(self.dir, "output.json.gz")
+        with gzip.open(path, "wt") as f:
+            json.dump({"objects": OBJECTS, "total": 100}, f)
+        self.assertEqual(list(process.iter_objects(path)), OBJECTS)
+
+    def test_offline_export_is_refused(self):
+        for argv in (["process.py", "--export", self.path, "input.json"],
+                     ["process.py", "--export", self.path, "--diff", "old.json", "new.json"]):
+            with mock.patch.object(sys, "argv", argv), contextlib.redirect_stderr(io.StringIO()) as errors:
+                with self.assertRaises(SystemExit) as raised:
+                    process.main()
+            self.assertEqual(raised.exception.code, 2)
+            self.assertIn("--export", errors.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
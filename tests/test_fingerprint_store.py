@@ -0,0 +1,99 @@
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from cpapi import APIClient, FingerprintStore
+
+
+def put_fingerprints(filename, writer, count):
+    store = FingerprintStore(filename)
+    for i in range(count):
+        store.put("mds%d-%d" % (writer, i), "FP%d" % i)
+
+
+class FingerprintStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "fingerprints.txt")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def read(self):
+        with open(self.filename) as f:
+            return json.load(f)
+
+    def test_put_and_get(self):
+        store = FingerprintStore(self.filename)
+        self.assertEqual(store.get("mds"), "")
+        self.assertFalse(store.put("mds", ""))
+        self.assertTrue(store.put("mds", "AB"))
+        self.assertEqual(store.get("mds"), "AB")
+        self.assertEqual(self.read(), {"mds": "AB"})
+        self.assertEqual(FingerprintStore(self.filename).get("mds"), "AB")
+
+    def test_changed_file_is_read_again(self):
+        store = FingerprintStore(self.filename)
+        store.put("mds", "AB")
+        # another process accepted a fingerprint
+        FingerprintStore(self.filename).put("mds2", "CD")
+        self.assertEqual(store.get("mds2"), "CD")
+        os.remove(self.filename)
+        self.assertEqual(store.get("mds"), "")
+
+    def test_unchanged_file_is_not_read_again(self):
+        store = FingerprintStore(self.filename)
+        store.put("mds", "AB")
+        store._read = None
+        self.assertEqual(store.get("mds"), "AB")
+
+    def test_corrupt_file(self):
+        with open(self.filename, "w") as f:
+            f.write("[]")
+        store = FingerprintStore(self.filename)
+        with contextlib.redirect_stderr(io.StringIO()) as errors:
+            self.assertEqual(store.get("mds"), "")
+            self.assertEqual(store.get("mds"), "")
+            # the file is not overwritten
+            self.assertFalse(store.put("mds", "AB"))
+        self.assertEqual(errors.getvalue().count("Corrupt JSON file"), 2)
+        self.assertEqual(self.read(), [])
+
+    def test_shared(self):
+        store = FingerprintStore.shared(self.filename)
+        self.assertIs(FingerprintStore.shared(os.path.relpath(self.filename)), store)
+        self.assertTrue(APIClient.save_fingerprint_to_file("mds", "AB", self.filename))
+        self.assertEqual(store.get("mds"), "AB")
+        self.assertEqual(APIClient.read_fingerprint_from_file("mds", self.filename), "AB")
+
+    def test_concurrent_threads(self):
+        threads = [threading.Thread(target=put_fingerprints, args=(self.filename, writer, 20)) for writer in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.read()), 160)
+
+    def test_concurrent_processes(self):
+        context = multiprocessing.get_context("spawn")
+        processes = [context.Process(target=put_fingerprints, args=(self.filename, writer, 20))
+                     for writer in range(4)]
+        for process in processes:
+            process.start()
+        put_fingerprints(self.filename, 4, 20)
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+        self.assertEqual(len(self.read()), 100)
+        self.assertEqual(sorted(os.listdir(self.dir)), ["fingerprints.txt", "fingerprints.txt.lock"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import threading
+import time
+import unittest
+
+from tests.stand_in import StandIn, ok
+
+
+class HedgingTest(unittest.TestCase):
+
+    def setUp(self):
+        # holds back the slow requests until the test ends
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+
+    def slow(self, times):
+        answers = ["slow"] * times
+
+        def handler(command, payload):
+            with lock:
+                slow = answers.pop() if answers else None
+            if slow:
+                self.release.wait(10)
+            return ok(command, payload)
+        lock = threading.Lock()
+        return handler
+
+    def test_slow_request_is_hedged(self):
+        with StandIn(self.slow(1)) as server:
+            with server.client(thread_safe=True) as client:
+                start = time.time()
+                res = client.api_call_hedged("show-host", {"name": "a"}, hedge_after=0.1)
+                self.assertLess(time.time() - start, 5)
+                self.assertTrue(res.success)
+                self.assertEqual(client.hedge_stats, {"sent": 1, "won": 1})
+                # the aborted request does not hold the next ones back
+                self.assertTrue(client.api_call_hedged("show-host", {"name": "b"}, hedge_after=0.1).success)
+            self.assertEqual(server.commands(), ["show-host"] * 3)
+
+    def test_fast_request_is_not_hedged(self):
+        with StandIn() as server:
+            with server.client(thread_safe=True) as client:
+                self.assertTrue(client.api_call_hedged("show-host", {"name": "a"}, hedge_after=5).success)
+                self.assertEqual(client.hedge_stats, {"sent": 0, "won": 0})
+            self.assertEqual(server.commands(), ["show-host"])
+
+    def test_change_is_not_hedged(self):
+        def handler(command, payload):
+            time.sleep(0.3)
+            return ok(command, payload)
+
+        with StandIn(handler) as server:
+            with server.client(thread_safe=True) as client:
+                self.assertTrue(client.api_call_hedged("set-host", {"name": "a"}, hedge_after=0.05).success)
+                self.assertEqual(client.hedge_stats["sent"], 0)
+            self.assertEqual(server.commands(), ["set-host"])
+
+    def test_without_latencies(self):
+        # no hedge is sent before the percentile of the command is known
+        with StandIn() as server:
+            with server.client(thread_safe=True) as client:
+                for _ in range(19):
+                    client.api_call_hedged("show-host", {"name": "a"})
+                self.assertIsNone(client.latencies.percentile("show-host", 95))
+                client.api_call_hedged("show-host", {"name": "a"})
+                self.assertIsNotNone(client.latencies.percentile("show-host", 95))
+                self.assertEqual(client.hedge_stats["sent"], 0)
+
+
+class TimeoutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+
+    def handler(self, command, payload):
+        self.release.wait(10)
+        return ok(command, payload)
+
+    def test_call_timeout(self):
+        with StandIn(self.handler) as server:
+            with server.client(call_timeout=0.2) as client:
+                start = time.time()
+                res = client.api_call("set-host", {"name": "a"})
+                self.assertLess(time.time() - start, 5)
+            self.assertFalse(res.success)
+            self.assertIn("timed out", str(res.error_message))
+            self.assertEqual(server.commands(), ["set-host"])
+
+    def test_deadline(self):
+        with StandIn(self.handler) as server:
+            with server.client(call_timeout=5, run_timeout=0.3) as client:
+                start = time.time()
+                res = client.api_call("show-host", {"name": "a"})
+                self.assertLess(time.time() - start, 5)
+                self.assertFalse(res.success)
+                # once the run is over, nothing is sent
+                res = client.api_call("show-host", {"name": "b"})
+                self.assertEqual(res.error_message, "Deadline exceeded")
+            self.assertEqual(server.commands(), ["show-host"])
+
+
+if __name__ == "__main__":
+    unittest.main()
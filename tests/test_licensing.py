@@ -0,0 +1,99 @@
+import contextlib
+import io
+import json
+import unittest
+
+import process
+
+
+def gateway(domain, name, uid=None):
+    return {"uid": uid or "gw-" + name, "name": name, "type": "simple-gateway", "domain": {"name": domain},
+            "network-security-blades": {"firewall": True}}
+
+
+def cluster(domain, name, members, uid=None):
+    return {"uid": uid or "ha-" + name, "name": name, "type": "CpmiGatewayCluster", "domain": {"name": domain},
+            "cluster-member-names": list(members), "network-security-blades": {"firewall": True}}
+
+
+def virtual_system(domain, name, vsx_members, uid=None):
+    return {"uid": uid or "vs-" + name, "name": name, "type": "CpmiVsClusterNetobj", "domain": {"name": domain},
+            "cluster-member-names": [member + "_" + name for member in vsx_members],
+            "network-security-blades": {"firewall": True}}
+
+
+OBJECTS = [
+    {"uid": "cma-Prod", "name": "cma_Prod", "type": "checkpoint-host", "domain": {"name": "Prod"},
+     "management-blades": {"network-policy-management": True, "secondary": True}},
+    gateway("Prod", "gw1"),
+    cluster("Prod", "cl1", ["a", "b"]),
+    # a member of both clusters
+    cluster("Prod", "cl2", ["b", "c"]),
+    # the same name in another domain is another member
+    cluster("Dev", "cl3", ["a", "d"]),
+    virtual_system("Prod", "vs1", ["vsx1", "vsx2"]),
+    # not deployed
+    {"uid": "vs-vs2", "name": "vs2", "type": "CpmiVsClusterNetobj", "domain": {"name": "Prod"},
+     "cluster-member-names": ["vsx1_other"], "network-security-blades": {"firewall": True}},
+    # the same VS name in two domains
+    virtual_system("Dev", "vs1", ["vsx1"], uid="vs-Dev-vs1"),
+]
+
+
+def summary(writer_class, objects=OBJECTS):
+    stream, errors = io.StringIO(), io.StringIO()
+    with contextlib.redirect_stderr(errors):
+        process.write_summary(process.count_licensing(objects), writer_class(stream))
+    return stream.getvalue(), errors.getvalue()
+
+
+class CountTest(unittest.TestCase):
+
+    def test_counts(self):
+        results = process.count_licensing(OBJECTS).results
+        self.assertEqual(results["Prod"]["GW"]["Members"], ["gw1"])
+        self.assertEqual(results["Prod"]["HA"]["Members"], ["a", "b", "b", "c"])
+        self.assertEqual(results["Prod"]["VS"]["Members"], ["vsx1_vs1", "vsx2_vs1"])
+        self.assertEqual((results["Prod"]["CountTotal"], results["Dev"]["CountTotal"]), (7, 3))
+        self.assertTrue(results["Prod"]["OnMDSStandby"])
+        self.assertEqual(process.count_licensing(OBJECTS).totals(), (10, 7))
+
+    def test_duplicates(self):
+        duplicates = process.count_licensing(OBJECTS).index.duplicates()
+        self.assertEqual(duplicates, {"b (Prod)": [("Prod", "HA", "cl1"), ("Prod", "HA", "cl2")],
+                                      "vsx1_vs1": [("Prod", "VS", "vs1"), ("Dev", "VS", "vs1")]})
+
+    def test_duplicates_in_every_format(self):
+        text, _ = summary(process.TextWriter)
+        self.assertIn("b (Prod) is counted 2 times: ClusterXL cl1 (Prod), ClusterXL cl2 (Prod)", text)
+        self.assertIn("b (Prod)", json.loads(summary(process.JSONWriter)[0])["Duplicates"])
+        lines = [json.loads(line) for line in summary(process.NDJSONWriter)[0].splitlines()]
+        self.assertIn("vsx1_vs1", lines[-2]["Duplicates"])
+        rows, warnings = summary(process.CSVWriter)
+        self.assertEqual(len(rows.splitlines()), 3)
+        self.assertIn("b (Prod) is counted 2 times", warnings)
+        self.assertIn("vsx1_vs1 is counted 2 times", warnings)
+
+    def test_no_duplicates(self):
+        text, warnings = summary(process.CSVWriter, OBJECTS[:3])
+        self.assertEqual(warnings, "")
+        self.assertNotIn("Duplicates", summary(process.JSONWriter, OBJECTS[:3])[0])
+
+
+class DiffTest(unittest.TestCase):
+
+    def test_diff(self):
+        new = [obj for obj in OBJECTS if obj["name"] != "gw1"] + [gateway("Dev", "gw2")]
+        # c moved from one cluster to another of its domain, b was removed and e added
+        new[1] = cluster("Prod", "cl1", ["a", "c"])
+        new[2] = cluster("Prod", "cl2", ["b", "e"])
+        diff = process.diff_licensing(OBJECTS, new)
+        self.assertIsNone(diff.old.index)
+        self.assertIsNone(diff.new.index)
+        self.assertEqual(diff.changes, {"Prod": {"GW": {"Added": set(), "Removed": {"gw1"}},
+                                                 "HA": {"Added": {"e"}, "Removed": {"b"}}},
+                                        "Dev": {"GW": {"Added": {"gw2"}, "Removed": set()}}})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from cpapi import ObjectCache
+from tests.stand_in import StandIn, ok
+
+
+def host(uid, name, modified):
+    return {"uid": uid, "name": name, "groups": [], "meta-info": {"last-modify-time": {"posix": modified}}}
+
+
+class ObjectCacheTest(unittest.TestCase):
+
+    def test_lru(self):
+        cache = ObjectCache(max_size=2)
+        cache.put("show-host", host("1", "a", 1))
+        cache.put("show-host", host("2", "b", 1))
+        cache.get("show-host", "1")
+        cache.put("show-host", host("3", "c", 1))
+        self.assertIsNone(cache.get("show-host", "2"))
+        self.assertEqual(cache.get("show-host", "1")["name"], "a")
+
+    def test_newer_modify_time_is_a_miss(self):
+        cache = ObjectCache()
+        cache.put("show-host", host("1", "a", 1))
+        cache.observe([host("1", "a", 1)])
+        self.assertIsNotNone(cache.get("show-host", "1"))
+        cache.observe([host("1", "a", 2)])
+        self.assertIsNone(cache.get("show-host", "1"))
+
+    def test_copies(self):
+        cache = ObjectCache()
+        obj = host("1", "a", 1)
+        cache.put("show-host", obj)
+        obj["groups"].append("changed after put")
+        cache.get("show-host", "1")["groups"].append("changed after get")
+        self.assertEqual(cache.get("show-host", "1")["groups"], [])
+
+    def test_loaded_entries_are_validated(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "cache.json")
+            cache = ObjectCache(filename=filename)
+            cache.put("show-host", host("1", "a", 1))
+            cache.put("show-host", host("2", "b", 1))
+            self.assertTrue(cache.save())
+            cache = ObjectCache(filename=filename)
+            self.assertIsNone(cache.get("show-host", "1"))
+            cache.observe([host("1", "a", 1), host("2", "b", 2)])
+            self.assertEqual(cache.get("show-host", "1")["name"], "a")
+            self.assertIsNone(cache.get("show-host", "2"))
+            trusting = ObjectCache(filename=filename, trust_loaded=True)
+            self.assertEqual(trusting.get("show-host", "2")["name"], "b")
+        finally:
+            shutil.rmtree(directory)
+
+    def test_invalidate(self):
+        cache = ObjectCache()
+        cache.put("show-host", host("1", "a", 1))
+        cache.put("show-host", host("1", "a", 1), "full")
+        cache.put("show-host", host("2", "b", 1))
+        cache.invalidate(name="a")
+        self.assertIsNone(cache.get("show-host", "1"))
+        self.assertIsNone(cache.get("show-host", "1", "full"))
+        self.assertIsNotNone(cache.get("show-host", "2"))
+        cache.clear()
+        self.assertIsNone(cache.get("show-host", "2"))
+
+
+class ClientObjectCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.hosts = {"1": host("1", "a", 1)}
+
+        def handler(command, payload):
+            if command == "show-host":
+                return 200, self.hosts[payload["uid"]]
+            if command == "set-host":
+                obj = self.hosts[payload["uid"]] if "uid" in payload else self.hosts["1"]
+                obj["name"] = payload.get("new-name", obj["name"])
+                obj["meta-info"]["last-modify-time"]["posix"] += 1
+                return 200, dict(obj)
+            return ok(command, payload)
+
+        self.server = StandIn(handler)
+        self.debug = io.StringIO()
+        self.client = self.server.client(object_cache=ObjectCache(), debug_stream=self.debug)
+
+    def tearDown(self):
+        self.client.close_connection()
+        self.server.close()
+
+    def show(self):
+        return self.client.api_call("show-host", {"uid": "1"}).data["name"]
+
+    def test_hits_are_logged(self):
+        self.assertEqual(self.show(), "a")
+        self.assertEqual(self.show(), "a")
+        self.assertEqual(self.server.commands(), ["show-host"])
+        records = [json.loads(line) for line in self.debug.getvalue().splitlines()]
+        self.assertEqual([record.get("cache-hit", False) for record in records], [False, True])
+
+    def test_own_changes_invalidate(self):
+        self.show()
+        self.client.api_call("set-host", {"uid": "1", "new-name": "b"})
+        self.assertEqual(self.show(), "b")
+        self.client.api_call("set-host", {"name": "b", "new-name": "c"})
+        self.assertEqual(self.show(), "c")
+        self.show()
+        self.client.api_call("publish", {})
+        self.show()
+        self.assertEqual(self.server.commands(), ["show-host", "set-host", "show-host", "set-host", "show-host",
+                                                  "publish", "show-host"])
+
+
+if __name__ == "__main__":
+    unittest.main()
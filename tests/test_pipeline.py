@@ -0,0 +1,133 @@
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import process
+from tests.stand_in import StandIn, fingerprint, ok
+from tests.test_licensing import cluster, gateway, virtual_system
+
+OBJECTS = [obj for i in range(40) for obj in (
+    gateway("D%d" % (i % 3), "gw%d" % i), cluster("D%d" % (i % 3), "cl%d" % i, ["cl%d_a" % i, "cl%d_b" % i]),
+    virtual_system("D%d" % (i % 3), "vs%d" % i, ["vsx1", "vsx2"]))]
+
+
+def pages(fail_offset=None):
+    def handler(command, payload):
+        if command != "show-gateways-and-servers":
+            return ok(command, payload)
+        offset, limit = payload["offset"], payload["limit"]
+        if offset == fail_offset:
+            return 400, {"code": "generic_err", "message": "page failed"}
+        page = OBJECTS[offset:offset + limit]
+        return 200, {"from": offset + 1, "to": offset + len(page), "total": len(OBJECTS), "objects": page}
+    return handler
+
+
+class PipelineTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # forked before the threads of the stand-in start
+        cls.pool = process.start_decode_pool(2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.shutdown()
+
+    def setUp(self):
+        self.stdout = contextlib.redirect_stdout(io.StringIO())
+        self.stdout.__enter__()
+
+    def tearDown(self):
+        self.stdout.__exit__(None, None, None)
+
+    def pipeline(self, handler, jobs=2, export=None):
+        counter = process.LicenseCounter()
+        with StandIn(handler) as server:
+            with server.client(thread_safe=True) as client:
+                res = process.cp_api_pipeline(client, "show-gateways-and-servers",
+                                              {"limit": 7, "offset": 0, "details-level": "full"}, counter, jobs,
+                                              export=export, pool=self.pool)
+        return res, counter
+
+    def test_counts(self):
+        phases = []
+        with mock.patch.object(process, "pool_phase", lambda name, seconds: phases.append(name)):
+            res, counter = self.pipeline(pages(), jobs=3)
+        self.assertEqual(counter.results, process.count_licensing(OBJECTS).results)
+        self.assertEqual((res["to"], res["total"]), (120, 120))
+        # every page but the first one, decoded in this process
+        self.assertEqual(phases, ["decode"] * 17)
+        # the pool was given, and is left running
+        self.assertEqual(self.pool.submit(int, "1").result(), 1)
+
+    def test_export(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "export.ndjson.gz")
+            export = process.ObjectExport(path, "show-gateways-and-servers", {})
+            self.pipeline(pages(), export=export)
+            export.close()
+            self.assertEqual(list(process.iter_objects(path)), OBJECTS)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_failed_page(self):
+        with self.assertRaises(SystemExit) as raised:
+            self.pipeline(pages(fail_offset=70))
+        self.assertEqual(raised.exception.code, 1)
+        self.assertIn("page failed", sys.stdout.getvalue())
+
+    def test_pool_starts_before_profiler(self):
+        order = []
+        pool = self.pool
+
+        def start_decode_pool(jobs):
+            order.append("pool")
+            return pool
+
+        def start(profiler):
+            order.append("profiler")
+
+        stacks = tempfile.NamedTemporaryFile(delete=False)
+        stacks.close()
+        try:
+            with StandIn(pages()) as server:
+                argv = ["process.py", "-m", "127.0.0.1", "--port", str(server.port), "-u", "admin", "-p", "secret",
+                        "--fingerprint", fingerprint(), "-j", "2", "--profile", "--profile-stacks", stacks.name]
+                with mock.patch.object(sys, "argv", argv), \
+                        mock.patch.object(process, "start_decode_pool", start_decode_pool), \
+                        mock.patch.object(process.Profiler, "start", start), \
+                        mock.patch.object(process.Profiler, "stop"), \
+                        mock.patch.object(process.Profiler, "report"), \
+                        mock.patch.object(process.Profiler, "instrument"):
+                    process.main()
+        finally:
+            os.remove(stacks.name)
+        self.assertEqual(order, ["pool", "profiler"])
+        self.assertIn("Primary MDS Total GWs: 200", sys.stdout.getvalue())
+
+
+class ProfilerTest(unittest.TestCase):
+
+    def test_pool_phases_are_apart(self):
+        profiler = process.Profiler()
+        profiler.start()
+        profiler.pool_phase("decode", 5.0)
+        profiler.add("fetch", 0.0)
+        profiler.stop()
+        report = io.StringIO()
+        profiler.report(report)
+        self.assertIn("decode (pool)", report.getvalue())
+        # the pool's time is not taken from the run's own
+        other = [line for line in report.getvalue().splitlines() if line.strip().startswith("other")]
+        self.assertEqual(len(other), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
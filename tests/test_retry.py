@@ -0,0 +1,133 @@
+import socket
+import ssl
+import time
+import unittest
+
+from cpapi import RetryPolicy, TokenBucket
+from cpapi.retry import LatencyTracker, http_client
+from tests.stand_in import StandIn, ok
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+    def test_exceptions(self):
+        policy = RetryPolicy()
+        self.assertTrue(policy.is_retryable_exception(socket.timeout()))
+        self.assertTrue(policy.is_retryable_exception(ConnectionResetError()))
+        self.assertTrue(policy.is_retryable_exception(http_client.BadStatusLine("")))
+        self.assertFalse(policy.is_retryable_exception(FileNotFoundError()))
+        self.assertFalse(policy.is_retryable_exception(ssl.SSLError()))
+        self.assertFalse(policy.is_retryable_exception(ValueError()))
+
+    def test_changes_are_not_sent_twice(self):
+        policy = RetryPolicy()
+        self.assertTrue(policy.is_idempotent("show-hosts"))
+        self.assertTrue(policy.is_idempotent("keepalive"))
+        self.assertFalse(policy.is_idempotent("add-host"))
+        self.assertFalse(policy.is_idempotent("publish"))
+        self.assertFalse(policy.is_retryable_exception(socket.timeout(), idempotent=False))
+        self.assertFalse(policy.is_retryable_exception(http_client.RemoteDisconnected(""), idempotent=False))
+        self.assertFalse(policy.is_retryable_status(503, idempotent=False))
+        self.assertTrue(policy.is_retryable_status(503))
+        # not sent yet
+        self.assertTrue(policy.is_retryable_exception(socket.timeout(), idempotent=False, sent=False))
+        self.assertTrue(policy.is_retryable_exception(http_client.CannotSendRequest(), idempotent=False))
+        self.assertTrue(policy.is_retryable_exception(ConnectionRefusedError(), idempotent=False))
+
+    def test_delay(self):
+        policy = RetryPolicy(backoff_base=1, backoff_max=5, jitter=False)
+        self.assertEqual([policy.delay(attempt) for attempt in range(1, 6)], [1, 2, 4, 5, 5])
+        self.assertEqual(policy.delay(1, retry_after=3), 3)
+        self.assertEqual(policy.delay(1, retry_after=60), 5)
+        policy = RetryPolicy(backoff_base=1, backoff_max=5)
+        self.assertTrue(all(0 <= policy.delay(3) <= 4 for _ in range(100)))
+
+    def test_can_retry(self):
+        policy = RetryPolicy(max_attempts=3)
+        self.assertEqual([policy.can_retry(attempt) for attempt in range(1, 4)], [True, True, False])
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_rate(self):
+        bucket = TokenBucket(50, capacity=5)
+        start = time.time()
+        for _ in range(15):
+            bucket.acquire()
+        # the burst of 5 is free, the other 10 wait for 1/50 of a second each
+        self.assertGreaterEqual(time.time() - start, 0.18)
+
+    def test_rate_must_be_positive(self):
+        self.assertRaises(ValueError, TokenBucket, 0)
+
+
+class LatencyTrackerTest(unittest.TestCase):
+
+    def test_percentile(self):
+        tracker = LatencyTracker(size=100, min_samples=20)
+        for i in range(19):
+            tracker.observe("show-hosts", i)
+        self.assertIsNone(tracker.percentile("show-hosts", 95))
+        tracker.observe("show-hosts", 19)
+        self.assertEqual(tracker.percentile("show-hosts", 95), 19)
+        self.assertEqual(tracker.percentile("show-hosts", 50), 10)
+
+
+class ClientRetryTest(unittest.TestCase):
+
+    def calls(self, handler, command, keep_alive=True, calls=1):
+        with StandIn(handler, keep_alive) as server:
+            with server.client(retry_policy=RetryPolicy(backoff_base=0)) as client:
+                results = [client.api_call(command, {"name": "a"}) for _ in range(calls)]
+            return results[-1], server.commands()
+
+    def busy(self, times):
+        answers = [(503, {"code": "generic_err", "message": "busy"})] * times
+
+        def handler(command, payload):
+            return answers.pop() if answers else ok(command, payload)
+        return handler
+
+    def lost(self, times):
+        answers = [None] * times
+
+        def handler(command, payload):
+            return answers.pop() if answers else ok(command, payload)
+        return handler
+
+    def test_busy_show_is_retried(self):
+        res, commands = self.calls(self.busy(2), "show-host")
+        self.assertTrue(res.success)
+        self.assertEqual(commands, ["show-host"] * 3)
+
+    def test_busy_change_is_not_retried(self):
+        res, commands = self.calls(self.busy(2), "add-host")
+        self.assertFalse(res.success)
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(commands, ["add-host"])
+
+    def test_lost_show_is_retried(self):
+        res, commands = self.calls(self.lost(1), "show-host")
+        self.assertTrue(res.success)
+        self.assertEqual(commands, ["show-host"] * 2)
+
+    def test_lost_change_is_not_retried(self):
+        res, commands = self.calls(self.lost(1), "publish")
+        self.assertFalse(res.success)
+        self.assertEqual(commands, ["publish"])
+
+    def test_explicitly_idempotent_change(self):
+        with StandIn(self.busy(1)) as server:
+            with server.client(retry_policy=RetryPolicy(backoff_base=0)) as client:
+                self.assertTrue(client.api_call("set-host", {"name": "a"}, idempotent=True).success)
+            self.assertEqual(server.commands(), ["set-host"] * 2)
+
+    def test_closed_idle_connection(self):
+        # the change is sent once, on a new connection
+        res, commands = self.calls(ok, "set-host", keep_alive=False, calls=3)
+        self.assertTrue(res.success)
+        self.assertEqual(commands, ["set-host"] * 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+from cpapi import APIClient, APIClientArgs, APIClientException
+from tests.stand_in import StandIn, ok
+
+
+class RootLoginTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.missing = os.path.join(self.dir, "missing")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def script(self, name, source):
+        path = os.path.join(self.dir, name)
+        with open(path, "w") as f:
+            f.write("#!%s\n%s" % (sys.executable, source))
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+        return path
+
+    def test_port(self):
+        api_get_port = self.script("api_get_port.py", 'print(\'{"external_port": 4434}\')\n')
+        client = APIClient(APIClientArgs(python_path=sys.executable, api_get_port_path=api_get_port))
+        self.assertEqual(client.get_root_port(), 4434)
+        self.assertEqual(APIClient(APIClientArgs(port=8443, api_get_port_path=api_get_port)).get_root_port(), 8443)
+
+    def test_port_without_script(self):
+        client = APIClient(APIClientArgs(python_path=self.missing, api_get_port_path=self.missing))
+        self.assertEqual(client.get_root_port(), 443)
+
+    def test_without_mgmt_cli(self):
+        client = APIClient(APIClientArgs(mgmt_cli_path=self.missing))
+        self.assertRaisesRegex(APIClientException, "Could not login as root", client.mgmt_cli_root_login, 443)
+
+    def test_domains(self):
+        # login-to-domain fails for B and C, B gets a root login of its own, and mgmt_cli fails for C
+        mgmt_cli = self.script("mgmt_cli", 'import json, sys\nif sys.argv[-1] == "C":\n    sys.exit(1)\n'
+                                           'print(json.dumps({"sid": "root-" + sys.argv[-1]}))\n')
+
+        def handler(command, payload):
+            if command == "login-to-domain":
+                if payload["domain"] == "A":
+                    return 200, {"sid": "sid-A"}
+                return 400, {"code": "generic_err_object_not_found", "message": "not found"}
+            return ok(command, payload)
+
+        for mgmt_cli_path in (mgmt_cli, self.missing):
+            with StandIn(handler) as server:
+                client = server.client(python_path=self.missing, mgmt_cli_path=mgmt_cli_path, thread_safe=True)
+                client.sid = "sid"
+                client.logout_on_exit = False
+                with client:
+                    results = client.login_as_root_to_domains(["A", "B", "C"])
+            self.assertEqual(list(results), ["A", "B", "C"])
+            self.assertEqual(results["A"].data["sid"], "sid-A")
+            self.assertEqual(results["B"].success, mgmt_cli_path == mgmt_cli)
+            if results["B"].success:
+                self.assertEqual(results["B"].data["sid"], "root-B")
+            self.assertFalse(results["C"].success)
+            self.assertIn("Could not login as root", str(results["C"].error_message))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import contextlib
+import io
+import multiprocessing
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import unittest
+
+from cpapi import SessionCache
+
+
+def put_sessions(filename, writer, count):
+    cache = SessionCache(filename)
+    for i in range(count):
+        cache.put(SessionCache.key("mds%d" % writer, username="user%d" % i), "sid-%d-%d" % (writer, i), "mds")
+
+
+class SessionCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "sessions.json")
+        self.cache = SessionCache(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_put_and_get(self):
+        key = SessionCache.key("mds", username="admin", domain="Prod")
+        self.assertIsNone(self.cache.get(key))
+        self.assertTrue(self.cache.put(key, "sid", "mds", "1.5", session_timeout=600))
+        session = self.cache.get(key)
+        self.assertEqual((session["sid"], session["api-version"]), ("sid", "1.5"))
+        self.assertEqual(stat.S_IMODE(os.stat(self.filename).st_mode), 0o600)
+        self.assertTrue(self.cache.remove(key))
+        self.assertIsNone(self.cache.get(key))
+
+    def test_expired(self):
+        old, new = SessionCache.key("mds", username="old"), SessionCache.key("mds", username="new")
+        self.cache.put(old, "sid", "mds", session_timeout=-1)
+        self.assertIsNone(self.cache.get(old))
+        self.cache.put(new, "sid", "mds")
+        # dropped on the way
+        self.assertEqual(list(self.cache.load()), [new])
+
+    def test_key(self):
+        key = SessionCache.key("mds", api_key="secret")
+        self.assertNotIn("secret", key)
+        self.assertEqual(key, SessionCache.key("mds", 443, api_key="secret"))
+        self.assertNotEqual(key, SessionCache.key("mds", api_key="secret", read_only=True))
+        self.assertNotEqual(SessionCache.key("mds", username="a"), SessionCache.key("mds", username="a", domain="D"))
+
+    def test_corrupt_file(self):
+        with open(self.filename, "w") as f:
+            f.write("{")
+        with contextlib.redirect_stderr(io.StringIO()) as errors:
+            self.assertIsNone(self.cache.get("key"))
+            self.assertTrue(self.cache.put("key", "sid", "mds"))
+        self.assertIn("Corrupt JSON file", errors.getvalue())
+        self.assertEqual(self.cache.get("key")["sid"], "sid")
+
+    def test_concurrent_threads(self):
+        threads = [threading.Thread(target=put_sessions, args=(self.filename, writer, 20)) for writer in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.cache.load()), 160)
+
+    def test_concurrent_processes(self):
+        context = multiprocessing.get_context("spawn")
+        processes = [context.Process(target=put_sessions, args=(self.filename, writer, 20)) for writer in range(4)]
+        for process in processes:
+            process.start()
+        # and a writer of this process at the same time
+        put_sessions(self.filename, 4, 20)
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+        self.assertEqual(len(self.cache.load()), 100)
+        self.assertEqual(sorted(name for name in os.listdir(self.dir)), ["sessions.json", "sessions.json.lock"])
+
+
+if __name__ == "__main__":
+    unittest.main()